@@ -5,9 +5,22 @@ Read the SystemMonitor database to create a report on
 the usage of the server and associated clients.
 """
 
-import MySQLdb
+try:
+    import MySQLdb
+    import MySQLdb.cursors
+except ImportError:
+    MySQLdb = None
+import sqlite3
+import random
+import math
+import platform
+import heapq
+import contextlib
+import array
+import mmap
 import argparse
 import csv
+import io
 import collections
 import datetime
 import time
@@ -17,6 +30,43 @@ import os.path
 import re
 import sys
 import shutil
+import json
+import hashlib
+import bisect
+import itertools
+import struct
+import bz2
+import zlib
+import tarfile
+import tempfile
+import multiprocessing
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import http.server as http_server
+    import urllib.parse as url_parse
+except ImportError:
+    import BaseHTTPServer as http_server
+    import urlparse as url_parse
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 VERSION = "0.9.5"
 # IMPORTANT--SAMPLE_TIME should be identical to the value in the
@@ -25,20 +75,319 @@ SAMPLE_TIME = 60
 # scaling for partial periods should be limited tono more than 1 day in period
 WEEK_MIN_SCALING = 1 / 7.0
 MONTH_MIN_SCALING = 1 / 20.0
+DUMP_COMMAND = \
+    "mysqldump --user=root --password=mysqlAdmin --add-drop-database --databases SystemMonitor "
+# the start of the mysqldump commands for the parts of a delta dump
+DELTA_DUMP_COMMAND = \
+    "mysqldump --user=root --password=mysqlAdmin "
+# the dump is read from mysqldump and compressed in pieces of this size
+DUMP_CHUNK_SIZE = 1024 * 1024
+# the dump is split into blocks of this size that are compressed in parallel
+COMPRESS_BLOCK_SIZE = 4 * 1024 * 1024
+# the archive file suffix for each compression codec
+ARCHIVE_SUFFIXES = {"bz2": ".tbz", "xz": ".txz", "zstd": ".tzst"}
+# the number of rows fetched at a time from a streaming query
+DEFAULT_CHUNK_SIZE = 10000
+# the parallel dump splits tables with more rows into primary key ranges
+DUMP_SPLIT_ROWS = 1000000
+# the number of rows in each INSERT statement of the parallel dump
+DUMP_INSERT_ROWS = 1000
+# the seconds the tables stay locked while the dump workers start
+DUMP_READY_TIMEOUT = 60
+# the file suffix of each compressed parallel dump chunk
+CHUNK_SUFFIXES = {"bz2": ".bz2", "xz": ".xz", "zstd": ".zst"}
+DUMP_DB_NAME = "SystemMonitor"
+# the columnar export starts and ends with this and holds blocks of at
+# most EXPORT_BLOCK_ROWS rows
+EXPORT_MAGIC = b"SMCOLS01"
+EXPORT_BLOCK_ROWS = 65536
+EXPORT_SUFFIX = ".smcol"
+# the SummaryData columns kept in the head office store
+INGEST_COLUMNS = ("Time", "TeacherCount", "StudentCount", "ActiveTeacherCount",
+                  "ActiveStudentCount")
+# a NULL in the column arrays that the ingest workers return
+INGEST_NULL = -2 ** 63
+# local directory for the cached daily histograms
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/systemmonitor-reporter")
+# the report cache keeps this many results for at most this many seconds
+REPORT_CACHE_ENTRIES = 8
+REPORT_CACHE_MAX_AGE = 7 * 24 * 3600
+# the niceness of the --watch process so it never slows the server down
+WATCH_NICE = 10
+# how often a report value query is tried again on a new connection
+GATHER_RETRIES = 2
+# the connections that read the report values at the same time
+GATHER_WORKERS = 4
+# SummaryData rows older than this many days are downsampled into hours
+DOWNSAMPLE_AGE_DAYS = 120
+# the largest count the prefix sum index keeps in its own bucket
+PREFIX_MAX_COUNT = 50
+# the local port of the json query service
+SERVE_PORT = 8765
+# the sampled SAMPLE_TIME slots per period of the quick preview, taken a
+# few at a time from equal strata of the period
+QUICK_SAMPLES = 200
+QUICK_STRATUM_SAMPLES = 4
+# the seconds the quick preview may take
+QUICK_TIME_BUDGET = 30
+# the most slot ranges the quick preview reads in one query
+QUICK_READ_RANGES = 50
 
 
 # --------------------------------------------------------------------
 
+def sql_least(first_value, second_value):
+    """
+    The MySQL LEAST function for the SQLite driver
+    """
+    if first_value is None or second_value is None:
+        return None
+    return min(first_value, second_value)
+
+
+class MySqlDriver:
+    """
+    The MySQL server of a school that the SystemMonitor daemon writes to.
+    """
+    name = "mysql"
+    rows_read_query = "SHOW SESSION STATUS LIKE 'Handler_read%'"
+
+    def __init__(self):
+        if MySQLdb is None:
+            raise ImportError("The MySQLdb module is not installed")
+        self.error_class = MySQLdb.Error
+
+    def connect(self, db_name, password, user_name, host, port,
+                connect_timeout):
+        connect_params = {}
+        if connect_timeout:
+            connect_params["connect_timeout"] = int(connect_timeout)
+            connect_params["read_timeout"] = int(connect_timeout)
+        return MySQLdb.connect(db=db_name, passwd=password, user=user_name,
+                               host=host, port=port, **connect_params)
+
+    def streaming_cursor(self, connector):
+        return connector.cursor(MySQLdb.cursors.SSCursor)
+
+    def prepare_query(self, sql_query_text):
+        return sql_query_text
+
+    def get_indexes(self, db_reader, table_name):
+        """
+        :return: a dict of index name to the list of its columns in order
+        """
+        indexes = {}
+        # the columns are Table, Non_unique, Key_name, Seq_in_index,
+        # Column_name...
+        for row in sorted(db_reader.return_list("SHOW INDEX FROM %s"
+                                                % table_name),
+                          key=lambda index_row: (index_row[2], index_row[3])):
+            indexes.setdefault(row[2], []).append(row[4])
+        return indexes
+
+    def iter_dump(self, connector):
+        """
+        MySQL databases are dumped with mysqldump
+        """
+        return None
+
+    def list_tables(self, db_reader):
+        return [row[0] for row in db_reader.return_list("SHOW TABLES")]
+
+    def get_partitions(self, db_reader, table_name):
+        """
+        :return: the list of (partition name, less than time) in order, the
+            time is None for MAXVALUE, an empty list if the table is not
+            partitioned
+        """
+        rows = db_reader.return_list(
+            "SELECT PARTITION_NAME, PARTITION_DESCRIPTION "
+            "FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = "
+            "DATABASE() AND TABLE_NAME = %s "
+            "ORDER BY PARTITION_ORDINAL_POSITION", (table_name,))
+        return [(name, None if description == "MAXVALUE"
+                 else int(description))
+                for name, description in rows if name is not None]
+
+    def get_create_statement(self, db_reader, table_name):
+        return db_reader.return_list("SHOW CREATE TABLE `%s`"
+                                     % table_name)[0][1]
+
+    def get_primary_key(self, db_reader, table_name):
+        return self.get_indexes(db_reader, table_name).get("PRIMARY", [])
+
+    def get_column_names(self, db_reader, table_name):
+        return [row[0] for row in db_reader.return_list(
+            "SHOW COLUMNS FROM `%s`" % table_name)]
+
+    def lock_for_snapshot(self, db_reader):
+        """
+        Stop all writes while the dump workers start their transactions.
+        This needs the RELOAD privilege.
+        :return: True if the tables are locked
+        """
+        return db_reader.return_cursor(
+            "FLUSH TABLES WITH READ LOCK") is not None
+
+    def unlock_after_snapshot(self, db_reader):
+        db_reader.return_cursor("UNLOCK TABLES")
+
+    def begin_snapshot(self, db_reader):
+        cursor = db_reader.connector.cursor()
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL "
+                       "REPEATABLE READ")
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        cursor.close()
+
+    def quote_value(self, connector, value):
+        literal = connector.literal(value)
+        if isinstance(literal, bytes):
+            return literal.decode("utf-8", "surrogateescape")
+        return literal
+
+    def get_schema_header(self, db_name):
+        return ["CREATE DATABASE IF NOT EXISTS `%s`;" % db_name,
+                "USE `%s`;" % db_name]
+
+    def get_data_header(self, db_name):
+        return ["USE `%s`;" % db_name,
+                "SET unique_checks=0, foreign_key_checks=0;"]
+
+
+class SqliteDriver:
+    """
+    A SQLite file with the same tables as the SystemMonitor database. It is
+    used to measure and test the reporter without a MySQL server.
+    """
+    name = "sqlite"
+    rows_read_query = None
+    error_class = sqlite3.Error
+
+    def connect(self, db_name, password, user_name, host, port,
+                connect_timeout):
+        connector = sqlite3.connect(db_name, timeout=connect_timeout or 5,
+                                    check_same_thread=False)
+        connector.create_function("LEAST", 2, sql_least)
+        return connector
+
+    def streaming_cursor(self, connector):
+        # SQLite cursors already step through the rows one at a time
+        return connector.cursor()
+
+    def prepare_query(self, sql_query_text):
+        # the queries are written with the MySQLdb %s placeholders
+        return sql_query_text.replace("%s", "?")
+
+    def get_indexes(self, db_reader, table_name):
+        indexes = {}
+        for row in db_reader.return_list("PRAGMA index_list(%s)"
+                                         % table_name):
+            index_name = row[1]
+            # the columns are seqno, cid, name
+            indexes[index_name] = [
+                info_row[2] for info_row in sorted(db_reader.return_list(
+                    "PRAGMA index_info(%s)" % index_name))]
+        return indexes
+
+    def iter_dump(self, connector):
+        return connector.iterdump()
+
+    def list_tables(self, db_reader):
+        return [row[0] for row in db_reader.return_list(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+
+    def get_partitions(self, db_reader, table_name):
+        # SQLite has no partitions
+        return None
+
+    def get_create_statement(self, db_reader, table_name):
+        return db_reader.return_single_value(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' "
+            "AND name = %s", (table_name,))[0]
+
+    def get_primary_key(self, db_reader, table_name):
+        # the columns are cid, name, type, notnull, dflt_value, pk
+        return [row[1] for row in sorted(
+            (row for row in db_reader.return_list(
+                "PRAGMA table_info(%s)" % table_name) if row[5]),
+            key=lambda row: row[5])]
+
+    def get_column_names(self, db_reader, table_name):
+        return [row[1] for row in db_reader.return_list(
+            "PRAGMA table_info(%s)" % table_name)]
+
+    def lock_for_snapshot(self, db_reader):
+        # each worker's read transaction already blocks the writers
+        return True
+
+    def unlock_after_snapshot(self, db_reader):
+        pass
+
+    def begin_snapshot(self, db_reader):
+        cursor = db_reader.connector.cursor()
+        cursor.execute("BEGIN")
+        # the snapshot starts with the first read
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+        cursor.fetchall()
+        cursor.close()
+
+    def quote_value(self, connector, value):
+        if value is None:
+            return "NULL"
+        if isinstance(value, (int, float)):
+            return repr(value)
+        if isinstance(value, bytes):
+            return "X'%s'" % "".join("%02x" % byte for byte in value)
+        # keep every statement on one line
+        return "'%s'" % str(value).replace("'", "''").replace(
+            "\n", "' || char(10) || '")
+
+    def get_schema_header(self, db_name):
+        return []
+
+    def get_data_header(self, db_name):
+        return []
+
+
+DB_DRIVERS = {"mysql": MySqlDriver, "sqlite": SqliteDriver}
+DB_ERRORS = (sqlite3.Error,)
+if MySQLdb is not None:
+    DB_ERRORS += (MySQLdb.Error,)
+# the errors of a truncated or corrupt result archive
+ARCHIVE_ERRORS = (IOError, OSError, EOFError, ValueError, KeyError,
+                  IndexError, struct.error, zlib.error, tarfile.TarError)
+if lzma is not None:
+    ARCHIVE_ERRORS += (lzma.LZMAError,)
+if zstandard is not None:
+    ARCHIVE_ERRORS += (zstandard.ZstdError,)
+
+
 class DbReader:
     """
     Generalize all db functions for consistency and flexibility.
     """
 
-    def __init__(self, db_name, password, user_name, host="localhost"):
+    def __init__(self, db_name, password, user_name, host="localhost",
+                 port=3306, connect_timeout=0, exit_on_error=True,
+                 backend="mysql"):
+        """
+
+        :param db_name: the database name or for SQLite the file name
+        :param connect_timeout: if set the seconds to wait for the server
+            to connect and to answer each query
+        :param exit_on_error: exit the program if the database can not be
+            reached, otherwise raise the error to the caller
+        :param backend: "mysql" or "sqlite"
+        """
         try:
-            self.connector = MySQLdb.connect(db=db_name, passwd=password,
-                                             user=user_name, host=host)
-        except StandardError:
+            self.driver = DB_DRIVERS[backend]()
+            self.connector = self.driver.connect(db_name, password,
+                                                 user_name, host, port,
+                                                 connect_timeout)
+        except (ImportError,) + DB_ERRORS:
+            if not exit_on_error:
+                raise
             print ("""
 Error:
     It looks like the mysql database server is not running.
@@ -49,37 +398,719 @@ Error:
     up to use the system monitor.
             """)
             sys.exit(-1)
+        self.error_class = self.driver.error_class
+        self.profiler = None
         self.cursor = self.connector.cursor()  # MySQLdb.cursors.DictCursor)
+        self.connect_params = {"db_name": db_name, "password": password,
+                               "user_name": user_name, "host": host,
+                               "port": port,
+                               "connect_timeout": connect_timeout,
+                               "backend": backend}
+
+    def get_database_id(self):
+        """
+        :return: a tuple that tells this database from the others
+        """
+        db_name = self.connect_params["db_name"]
+        if self.connect_params["backend"] == "sqlite":
+            db_name = os.path.abspath(db_name)
+        return (self.connect_params["backend"], self.connect_params["host"],
+                self.connect_params["port"], db_name)
+
+    def get_database_hash(self):
+        """
+        :return: a short hash of the database id for the cache file names
+        """
+        return hashlib.md5(repr(self.get_database_id()).encode()
+                           ).hexdigest()[:12]
+
+    def clone(self):
+        """
+        :return: a new DbReader with its own connection to the same
+            database that raises its connection errors
+        """
+        return DbReader(exit_on_error=False, **self.connect_params)
+
+    def write_rows(self, sql_query_text, rows):
+        """
+        Insert many rows with one parameterized statement and commit.
+        The statement uses %s placeholders.
+        :return: True if the rows were written
+        """
+        try:
+            self.cursor.executemany(
+                self.driver.prepare_query(sql_query_text), rows)
+            self.connector.commit()
+            return True
+        except self.error_class as e:
+            print ("Query %s failed with error %s" % (sql_query_text, e))
+            return False
+
+    def iter_dump(self):
+        """
+        :return: an iterator of the SQL statements of a dump for drivers
+            that dump in this process, else None
+        """
+        return self.driver.iter_dump(self.connector)
+
+    def set_profiler(self, profiler):
+        """
+        Time and count every query from now on.
+        :param profiler: a Profiler or None to stop profiling
+        """
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.db_reader = self
+
+    def get_rows_read(self):
+        """
+        The number of rows the server has read for this connection, if the
+        driver can tell.
+        :return: the count or None
+        """
+        if self.driver.rows_read_query is None:
+            return None
+        try:
+            cursor = self.connector.cursor()
+            cursor.execute(self.driver.rows_read_query)
+            rows_read = sum(int(value) for name, value in cursor.fetchall())
+            cursor.close()
+            return rows_read
+        except self.error_class:
+            return None
+
+    def execute(self, cursor, sql_query_text, params=None):
+        """
+        Run a query written with %s placeholders on the cursor. Values are
+        always passed as params and never formatted into the text.
+        """
+        if params is None:
+            cursor.execute(sql_query_text)
+        else:
+            cursor.execute(self.driver.prepare_query(sql_query_text),
+                           params)
+
+    def fetch_all(self, sql_query_text, params=None):
+        """
+        Like return_list but the error of a failed query is raised to the
+        caller.
+        :return: the list of rows
+        """
+        start_time = time.time()
+        self.execute(self.cursor, sql_query_text, params)
+        rows = self.cursor.fetchall()
+        if self.profiler is not None:
+            self.profiler.record_query(sql_query_text,
+                                       time.time() - start_time,
+                                       len(rows), params)
+        return rows
 
-    def return_list(self, sql_query_text):
+    def return_list(self, sql_query_text, params=None):
         """
 
         :param sql_query_text:
+        :param params: the values for the %s placeholders in the query
         :return:
         """
         try:
-            self.cursor.execute(sql_query_text)
-            return self.cursor.fetchall()
-        except MySQLdb.Error as e:
+            return self.fetch_all(sql_query_text, params)
+        except self.error_class as e:
             print ("Query %s failed with error %s" % (sql_query_text, e))
             return []
 
-    def return_single_value(self, sql_query_text):
+    def return_single_value(self, sql_query_text, params=None):
         try:
-            self.cursor.execute(sql_query_text)
-            return self.cursor.fetchone()
-        except MySQLdb.Error as e:
+            start_time = time.time()
+            self.execute(self.cursor, sql_query_text, params)
+            row = self.cursor.fetchone()
+            if self.profiler is not None:
+                self.profiler.record_query(sql_query_text,
+                                           time.time() - start_time, 1,
+                                           params)
+            return row
+        except self.error_class as e:
             print ("Query %s failed with error %s" % (sql_query_text, e))
             return None
 
-    def return_cursor(self, sql_query_text):
+    def return_cursor(self, sql_query_text, params=None):
         try:
-            self.cursor.execute(sql_query_text)
+            start_time = time.time()
+            self.execute(self.cursor, sql_query_text, params)
+            if self.profiler is not None:
+                self.profiler.record_query(sql_query_text,
+                                           time.time() - start_time,
+                                           max(self.cursor.rowcount, 0),
+                                           params)
             return self.cursor
-        except MySQLdb.Error as e:
+        except self.error_class as e:
             print ("Query %s failed with error %s" % (sql_query_text, e))
             return None
 
+    def iter_chunks(self, sql_query_text, params=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Run the query on an unbuffered server side cursor and generate its
+        rows in lists of at most chunk_size rows, so that memory use does
+        not depend on the size of the result. No other query can be run on
+        this DbReader until the generator is finished or closed. As in
+        fetch_all the error of a failed query is raised to the caller, so a
+        read that stops early is never taken for the whole result.
+        :param sql_query_text: the query with %s placeholders
+        :param params: the values for the placeholders
+        :return: a generator of lists of rows
+        """
+        cursor = self.driver.streaming_cursor(self.connector)
+        start_time = time.time()
+        row_count = 0
+        try:
+            self.execute(cursor, sql_query_text, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                row_count += len(rows)
+                yield rows
+        finally:
+            cursor.close()
+            if self.profiler is not None:
+                self.profiler.record_query(sql_query_text,
+                                           time.time() - start_time,
+                                           row_count, params)
+
+    def iter_rows(self, sql_query_text, params=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Generate the rows of the query one at a time, see iter_chunks.
+        """
+        for rows in self.iter_chunks(sql_query_text, params, chunk_size):
+            for row in rows:
+                yield row
+
+
+class Profiler:
+    """
+    Collect the time of every query and the wall time, peak memory and rows
+    read by the database in each stage of a run. The summary is written
+    next to the csv report so it comes back with the result archive.
+    """
+
+    SLOWEST_QUERY_COUNT = 10
+
+    def __init__(self):
+        self.db_reader = None
+        self.lock = threading.Lock()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.query_rows = 0
+        # query text with the numbers removed -> [count, seconds, max, rows]
+        self.query_shapes = {}
+        self.slowest_queries = []
+        self.stages = collections.OrderedDict()
+        self.stage_starts = {}
+        self.counters = collections.OrderedDict()
+        self.notes = []
+
+    def record_query(self, sql_query_text, seconds, row_count, params=None):
+        with self.lock:
+            self.query_count += 1
+            self.query_time += seconds
+            self.query_rows += row_count
+            shape = re.sub(r"\b\d+\b", "N", sql_query_text.strip())
+            shape_values = self.query_shapes.setdefault(shape, [0, 0.0, 0.0, 0])
+            shape_values[0] += 1
+            shape_values[1] += seconds
+            shape_values[2] = max(shape_values[2], seconds)
+            shape_values[3] += row_count
+            query_text = sql_query_text.strip()
+            if params is not None:
+                query_text += " -- %s" % (tuple(params),)
+            if len(self.slowest_queries) < self.SLOWEST_QUERY_COUNT:
+                heapq.heappush(self.slowest_queries, (seconds, query_text))
+            elif seconds > self.slowest_queries[0][0]:
+                heapq.heapreplace(self.slowest_queries,
+                                  (seconds, query_text))
+
+    def start_stage(self, stage_name):
+        rows_read = None
+        if self.db_reader is not None:
+            rows_read = self.db_reader.get_rows_read()
+        self.stage_starts[stage_name] = (time.time(), self.query_count,
+                                         rows_read)
+
+    def end_stage(self, stage_name):
+        start_time, query_count, rows_read = \
+            self.stage_starts.pop(stage_name)
+        if rows_read is not None:
+            end_rows_read = self.db_reader.get_rows_read()
+            if end_rows_read is not None:
+                rows_read = end_rows_read - rows_read
+        self.stages[stage_name] = {
+            "seconds": time.time() - start_time,
+            "queries": self.query_count - query_count,
+            "rows_read": rows_read,
+            "peak_rss_mb": get_peak_rss_mb(resource_self()),
+            "children_peak_rss_mb": get_peak_rss_mb(resource_children())}
+
+    def add_counter(self, counter_name, value):
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + \
+                                      value
+
+    def add_note(self, note):
+        self.notes.append(note)
+
+    def get_summary_text(self):
+        lines = ["SystemMonitor reporter %s profile, %s"
+                 % (VERSION, time.strftime("%Y-%m-%d %H:%M:%S")), "",
+                 "%-28s %9s %8s %12s %9s %9s"
+                 % ("Stage", "Seconds", "Queries", "Rows read", "Peak MB",
+                    "Child MB")]
+        for stage_name, values in self.stages.items():
+            lines.append("%-28s %9.2f %8d %12s %9.1f %9.1f" % (
+                stage_name, values["seconds"], values["queries"],
+                "-" if values["rows_read"] is None else values["rows_read"],
+                values["peak_rss_mb"], values["children_peak_rss_mb"]))
+        lines.extend(["", "%d queries took %.2f seconds and returned %d rows"
+                      % (self.query_count, self.query_time,
+                         self.query_rows), "",
+                      "Queries by total time:",
+                      "%8s %9s %9s %10s  %s" % ("Count", "Seconds", "Max",
+                                                "Rows", "Query")])
+        shapes = sorted(self.query_shapes.items(),
+                        key=lambda shape_item: shape_item[1][1],
+                        reverse=True)
+        for shape, values in shapes[:20]:
+            lines.append("%8d %9.2f %9.3f %10d  %s"
+                         % (values[0], values[1], values[2], values[3],
+                            shape[:200]))
+        lines.extend(["", "Slowest queries:"])
+        for seconds, sql_query_text in sorted(self.slowest_queries,
+                                              reverse=True):
+            lines.append("%9.3f  %s" % (seconds, sql_query_text[:200]))
+        if self.counters:
+            lines.extend(["", "Counters:"])
+            for counter_name, value in self.counters.items():
+                lines.append("%-28s %s" % (counter_name, value))
+        if self.notes:
+            lines.extend(["", "Notes:"])
+            lines.extend(self.notes)
+        return "\n".join(lines) + "\n"
+
+    def write_summary(self, summary_filename):
+        try:
+            with open(summary_filename, "w") as summary_file:
+                summary_file.write(self.get_summary_text())
+        except (IOError, OSError) as e:
+            print ("The profile %s could not be written: %s"
+                   % (summary_filename, e))
+
+
+def resource_self():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF)
+
+
+def resource_children():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def get_peak_rss_mb(usage):
+    """
+    :param usage: the result of resource.getrusage or None
+    :return: the peak resident memory in MB, ru_maxrss is in kB on Linux
+    """
+    if usage is None:
+        return 0.0
+    if sys.platform == "darwin":
+        return usage.ru_maxrss / (1024.0 * 1024.0)
+    return usage.ru_maxrss / 1024.0
+
+
+@contextlib.contextmanager
+def profile_stage(profiler, stage_name):
+    """
+    Record a stage in the profiler if profiling is on.
+    """
+    if profiler is None:
+        yield
+        return
+    profiler.start_stage(stage_name)
+    try:
+        yield
+    finally:
+        profiler.end_stage(stage_name)
+
+
+class SummaryIndexManager:
+    """
+    Check that SummaryData has an index that starts with Time so that each
+    period query reads only the rows of its period and MIN(Time) and
+    MAX(Time) are index lookups. When allowed, create a covering index that
+    also holds the count columns so the report never reads the table rows.
+    """
+
+    INDEX_NAME = "SummaryData_Time_Counts"
+    INDEX_COLUMNS = ("Time", "StudentCount", "ActiveStudentCount",
+                     "TeacherCount", "ActiveTeacherCount")
+
+    def __init__(self, db_reader):
+        self.db_reader = db_reader
+        self.status = "unknown"
+        self.index_name = ""
+        self.created = False
+
+    def check(self):
+        """
+        :return: "covering" if an index starting with Time has all the
+            count columns, "time" if an index only starts with Time, else
+            "none"
+        """
+        self.status = "none"
+        self.index_name = ""
+        indexes = self.db_reader.driver.get_indexes(self.db_reader,
+                                                    "SummaryData")
+        for index_name, columns in sorted(indexes.items()):
+            if not columns or columns[0] != "Time":
+                continue
+            if set(self.INDEX_COLUMNS) <= set(columns):
+                self.status = "covering"
+                self.index_name = index_name
+                break
+            if self.status == "none":
+                self.status = "time"
+                self.index_name = index_name
+        return self.status
+
+    def ensure_index(self, allow_create=False):
+        """
+        Check the indexes and create the covering index if it is missing
+        and creating it is allowed. This can take some minutes on a large
+        table but it only needs to be done once.
+        :return: the status from check
+        """
+        if self.check() == "covering" or not allow_create:
+            return self.status
+        print ("Creating the index %s on SummaryData, this only needs to be "
+               "done once." % self.INDEX_NAME)
+        if self.db_reader.return_cursor(
+                "CREATE INDEX %s ON SummaryData (%s)"
+                % (self.INDEX_NAME, ", ".join(self.INDEX_COLUMNS))) \
+                is not None:
+            self.db_reader.connector.commit()
+            self.created = True
+        return self.check()
+
+    def get_status_text(self):
+        if self.status == "covering":
+            return "SummaryData index: %s covers Time and the counts, " \
+                   "the fast path was used%s." \
+                   % (self.index_name, " (created in this run)"
+                      if self.created else "")
+        if self.status == "time":
+            return "SummaryData index: %s is on Time only, the period " \
+                   "queries also read the table rows. Use --createindex " \
+                   "for the fast path." % self.index_name
+        return "SummaryData index: there is no index on Time so every " \
+               "query scans the whole table. Use --createindex for the " \
+               "fast path."
+
+
+class SummaryMaintainer:
+    """
+    Keep SummaryData from growing forever. On MySQL the table is range
+    partitioned by month on Time. The months older than raw_days are
+    downsampled into SummaryHourly, one row per hour with the number of
+    samples and for each count column how many samples had each value as
+    "value:samples" pairs (a NULL is stored as -1), so the report
+    histograms of those months stay exact. The month is then
+    removed from SummaryData with a DROP PARTITION, or a DELETE where the
+    table can not be partitioned. A sample that is on the boundary of two
+    periods is counted in only one of them once it is downsampled.
+    """
+    HOURLY_TABLE = "SummaryHourly"
+    COLUMN_NAMES = ("TeacherCount", "StudentCount", "ActiveTeacherCount",
+                    "ActiveStudentCount")
+
+    def __init__(self, db_reader, raw_days=DOWNSAMPLE_AGE_DAYS, now=None):
+        self.db_reader = db_reader
+        self.raw_days = raw_days
+        self.now = time.time() if now is None else now
+        self.partitioned = False
+        self.created_partitions = 0
+        self.downsampled_months = 0
+        self.downsampled_rows = 0
+        self.hourly_rows = 0
+        self.removed_partitions = 0
+
+    def create_hourly_table(self):
+        self.db_reader.return_cursor(
+            "CREATE TABLE IF NOT EXISTS %s (Time INT PRIMARY KEY, "
+            "Samples INT NOT NULL, %s)"
+            % (self.HOURLY_TABLE, ", ".join("%s TEXT" % column_name
+                                           for column_name in
+                                           self.COLUMN_NAMES)))
+        self.db_reader.connector.commit()
+
+    @staticmethod
+    def format_histogram(counter):
+        return " ".join("%d:%d" % (value, samples_count)
+                        for value, samples_count in sorted(counter.items()))
+
+    @staticmethod
+    def parse_histogram(histogram_text):
+        """
+        :return: a list of (value, samples) of a SummaryHourly column
+        """
+        value_counts = []
+        for pair in (histogram_text or "").split():
+            value, samples_count = pair.split(":")
+            value_counts.append((int(value), int(samples_count)))
+        return value_counts
+
+    @staticmethod
+    def get_hour_start(sample_time):
+        """
+        :return: the start of the local hour of the time, also in time
+            zones that are not a whole number of hours from UTC
+        """
+        hour_offset = -time.timezone % 3600
+        return sample_time - (sample_time - hour_offset) % 3600
+
+    @staticmethod
+    def get_month_start(sample_time, months_later=0):
+        local_time = time.localtime(sample_time)
+        month_index = local_time.tm_year * 12 + local_time.tm_mon - 1 + \
+            months_later
+        return int(time.mktime((month_index // 12, month_index % 12 + 1, 1,
+                                0, 0, 0, 0, 0, -1)))
+
+    @staticmethod
+    def get_partition_name(month_start):
+        return time.strftime("p%Y%m", time.localtime(month_start))
+
+    def get_cutoff_time(self):
+        """
+        :return: the start of the month that holds the time raw_days ago,
+            everything before it is downsampled
+        """
+        return self.get_month_start(self.now - self.raw_days * 86400)
+
+    def ensure_partitions(self, min_time):
+        """
+        Partition SummaryData by month if it is not yet and add the
+        partitions up to the end of next month.
+        :return: True if the table is partitioned
+        """
+        partitions = self.db_reader.driver.get_partitions(self.db_reader,
+                                                          "SummaryData")
+        if partitions is None:
+            return False
+        last_bound = self.get_month_start(self.now, 2)
+        if not partitions:
+            month_start = self.get_month_start(min_time)
+            definitions = []
+            while month_start < last_bound:
+                next_start = self.get_month_start(month_start, 1)
+                definitions.append("PARTITION %s VALUES LESS THAN (%d)"
+                                   % (self.get_partition_name(month_start),
+                                      next_start))
+                month_start = next_start
+            definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+            print ("Partitioning SummaryData by month, this only needs to be "
+                   "done once.")
+            if self.db_reader.return_cursor(
+                    "ALTER TABLE SummaryData PARTITION BY RANGE (Time) (%s)"
+                    % ", ".join(definitions)) is None:
+                print ("SummaryData could not be partitioned so the old rows "
+                       "are deleted instead.")
+                return False
+            self.created_partitions += len(definitions) - 1
+            return True
+        bounds = [bound for name, bound in partitions if bound is not None]
+        if len(bounds) == len(partitions):
+            # there is no MAXVALUE partition to split
+            return True
+        month_start = bounds[-1] if bounds else self.get_month_start(min_time)
+        definitions = []
+        while month_start < last_bound:
+            next_start = self.get_month_start(month_start, 1)
+            definitions.append("PARTITION %s VALUES LESS THAN (%d)"
+                               % (self.get_partition_name(month_start),
+                                  next_start))
+            month_start = next_start
+        if definitions and self.db_reader.return_cursor(
+                "ALTER TABLE SummaryData REORGANIZE PARTITION %s INTO "
+                "(%s, PARTITION %s VALUES LESS THAN MAXVALUE)"
+                % (partitions[-1][0], ", ".join(definitions),
+                   partitions[-1][0])) is not None:
+            self.created_partitions += len(definitions)
+        return True
+
+    def get_segments(self, min_time):
+        """
+        :return: a list of (partition name or None, start, stop) of the
+            parts of SummaryData that are removed together in time order
+        """
+        segments = []
+        if self.partitioned:
+            start_time = min_time
+            for name, bound in self.db_reader.driver.get_partitions(
+                    self.db_reader, "SummaryData"):
+                if bound is None:
+                    break
+                segments.append((name, start_time, bound))
+                start_time = bound
+            return segments
+        start_time = min_time
+        while start_time < self.get_cutoff_time():
+            next_start = self.get_month_start(start_time, 1)
+            segments.append((None, start_time, next_start))
+            start_time = next_start
+        return segments
+
+    def downsample(self, start_time, stop_time):
+        """
+        Replace the SummaryHourly rows of the time range with the histograms
+        of the SummaryData rows in it. An hour that begins before the range
+        is stored at the start of the range so the first sample time of
+        the database is kept. Nothing is written unless every row of the
+        range was read.
+        :return: the number of SummaryData rows read or None if the rows
+            could not all be read or the hourly rows could not be written
+        """
+        hours = collections.OrderedDict()
+        row_count = 0
+        query = "SELECT Time, %s FROM SummaryData " \
+                "WHERE Time >= %%s AND Time < %%s ORDER BY Time" \
+                % ", ".join(self.COLUMN_NAMES)
+        hour_start = None
+        hour_counters = None
+        try:
+            for row in self.db_reader.iter_rows(query,
+                                                (start_time, stop_time)):
+                if hour_start is None or not \
+                        hour_start <= row[0] < hour_start + 3600:
+                    hour_start = self.get_hour_start(row[0])
+                    hour_counters = hours.setdefault(
+                        max(hour_start, start_time),
+                        [collections.Counter() for column_name in
+                         self.COLUMN_NAMES])
+                for counter, value in zip(hour_counters, row[1:]):
+                    counter[-1 if value is None else value] += 1
+                row_count += 1
+        except self.db_reader.error_class as e:
+            print ("SummaryData could not be read from %s: %s"
+                   % (time.strftime("%m/%d/%y", time.localtime(start_time)),
+                      e))
+            return None
+        if not self.has_row_count(start_time, stop_time, row_count):
+            return None
+        hourly_rows = [(hour_time, sum(hour_counters[0].values())) +
+                       tuple(self.format_histogram(counter)
+                             for counter in hour_counters)
+                       for hour_time, hour_counters in hours.items()]
+        if self.db_reader.return_cursor(
+                "DELETE FROM %s WHERE Time >= %%s AND Time < %%s"
+                % self.HOURLY_TABLE, (start_time, stop_time)) is None:
+            return None
+        if hourly_rows and not self.db_reader.write_rows(
+                "INSERT INTO %s VALUES (%s)"
+                % (self.HOURLY_TABLE,
+                   ", ".join(["%s"] * (len(self.COLUMN_NAMES) + 2))),
+                hourly_rows):
+            return None
+        self.db_reader.connector.commit()
+        self.hourly_rows += len(hourly_rows)
+        return row_count
+
+    def has_row_count(self, start_time, stop_time, row_count):
+        """
+        :return: True if SummaryData has row_count rows in the time range
+        """
+        row = self.db_reader.return_single_value(
+            "SELECT COUNT(*) FROM SummaryData WHERE Time >= %s AND Time < %s",
+            (start_time, stop_time))
+        if row is None or row[0] != row_count:
+            print ("SummaryData from %s has %s rows but %d were downsampled "
+                   "so it is kept." % (time.strftime(
+                       "%m/%d/%y", time.localtime(start_time)),
+                       "an unknown number of" if row is None else row[0],
+                       row_count))
+            return False
+        return True
+
+    def remove(self, partition_name, start_time, stop_time):
+        if partition_name is not None:
+            removed = self.db_reader.return_cursor(
+                "ALTER TABLE SummaryData DROP PARTITION %s"
+                % partition_name) is not None
+            self.removed_partitions += removed
+            return removed
+        removed = self.db_reader.return_cursor(
+            "DELETE FROM SummaryData WHERE Time >= %s AND Time < %s",
+            (start_time, stop_time)) is not None
+        self.db_reader.connector.commit()
+        return removed
+
+    def run(self):
+        """
+        Partition, downsample and remove the old months. Each month is
+        downsampled and committed before it is removed so an interrupted
+        run only repeats work. A month is only removed while its row count
+        is still the number of rows that were downsampled, and the run
+        stops at the first month that fails.
+        :return: True if every old month was downsampled and removed
+        """
+        self.create_hourly_table()
+        min_time = self.db_reader.return_single_value(
+            "SELECT MIN(Time) FROM SummaryData")[0]
+        if min_time is None:
+            return True
+        self.partitioned = self.ensure_partitions(min_time)
+        cutoff_time = self.get_cutoff_time()
+        for partition_name, start_time, stop_time in \
+                self.get_segments(min_time):
+            if stop_time > cutoff_time:
+                break
+            row_count = self.downsample(start_time, stop_time)
+            if row_count is None or \
+                    not self.has_row_count(start_time, stop_time,
+                                           row_count) or \
+                    not self.remove(partition_name, start_time, stop_time):
+                return False
+            self.downsampled_months += 1
+            self.downsampled_rows += row_count
+        return True
+
+    def get_status_text(self):
+        return "Downsampled %d rows of %d months before %s into %d hourly " \
+               "rows, %d partitions created and %d dropped" \
+               % (self.downsampled_rows, self.downsampled_months,
+                  time.strftime("%m/%d/%y", time.localtime(
+                      self.get_cutoff_time())),
+                  self.hourly_rows, self.created_partitions,
+                  self.removed_partitions)
+
+
+def get_downsampled_range(db_reader):
+    """
+    :return: the first hour in SummaryHourly and the end of its last hour,
+        SummaryData has no rows before that end, or None if nothing has
+        been downsampled
+    """
+    if SummaryMaintainer.HOURLY_TABLE not in \
+            db_reader.driver.list_tables(db_reader):
+        return None
+    min_time, max_time = db_reader.return_single_value(
+        "SELECT MIN(Time), MAX(Time) FROM %s"
+        % SummaryMaintainer.HOURLY_TABLE)
+    if min_time is None:
+        return None
+    return int(min_time), \
+        int(SummaryMaintainer.get_hour_start(max_time)) + 3600
+
 
 class TimePeriod:
     """
@@ -87,6 +1118,7 @@ class TimePeriod:
     start_time., stop_time, and scaling factor (the fraction of the period
     that is valid
     """
+    __slots__ = ("start_time", "stop_time", "period_time", "scaling_factor")
 
     def __init__(self, start_time, stop_time, period_time):
         """
@@ -131,6 +1163,48 @@ class TimePeriod:
         return self.scaling_factor
 
 
+class PeriodIndex:
+    """
+    The periods of one granularity in time order with their boundaries in
+    sorted arrays so the periods that contain a timestamp are found with
+    a binary search. Neighbouring weeks share their boundary so a time can
+    be in two periods.
+    """
+
+    def __init__(self, granularity, periods):
+        self.granularity = granularity
+        self.periods = periods
+        self.start_times = array.array(
+            "d", [period.get_period_start() for period in periods])
+        self.stop_times = array.array(
+            "d", [period.get_period_end() for period in periods])
+
+    def __len__(self):
+        return len(self.periods)
+
+    def __iter__(self):
+        return iter(self.periods)
+
+    def find(self, timestamp):
+        """
+        :return: the (first, last + 1) index of the periods that contain
+            the timestamp, both ends of a period included
+        """
+        first_index = bisect.bisect_left(self.stop_times, timestamp)
+        stop_index = bisect.bisect_right(self.start_times, timestamp)
+        return first_index, max(first_index, stop_index)
+
+    def find_periods(self, timestamp):
+        first_index, stop_index = self.find(timestamp)
+        return self.periods[first_index:stop_index]
+
+    def get_start_time(self):
+        return self.start_times[0] if self.periods else None
+
+    def get_stop_time(self):
+        return self.stop_times[-1] if self.periods else None
+
+
 class TimeFinder:
     """
     Generate arrays of time periods in unix time to
@@ -139,20 +1213,64 @@ class TimeFinder:
     when data is avalable. It will not return any periods that
     are either before the first recorded database entry or after the
     last.
+    The periods of each granularity are computed once per end time and
+    kept as a PeriodIndex that all engines share.
     """
+    # the school year has two terms, January to June and July to December
+    TERM_START_MONTHS = (1, 7)
 
     def __init__(self, db_reader, num_months, num_weeks=0):
         self.db_reader = db_reader
-        self.database_min_time = self.db_reader.return_single_value(
-            "SELECT MIN(Time) from SummaryData")[0]
-        self.database_max_time = self.db_reader.return_single_value(
-            "SELECT MAX(Time) from SummaryData")[0]
+        time_range = self.db_reader.return_single_value(
+            "SELECT MIN(Time), MAX(Time) from SummaryData")
+        self.database_min_time, self.database_max_time = time_range
+        # the old months may only be in SummaryHourly
+        self.downsampled_before = None
+        downsampled_range = get_downsampled_range(db_reader)
+        if downsampled_range is not None:
+            self.downsampled_before = downsampled_range[1]
+            if self.database_max_time is None:
+                self.database_max_time = downsampled_range[1] - 1
+            self.database_min_time = min(
+                downsampled_range[0],
+                self.database_min_time or downsampled_range[0])
         self.max_datetime = datetime.date.fromtimestamp(
             float(self.database_max_time))
         self.num_months = num_months
         self.num_weeks = num_weeks
         if not num_weeks:
             self.num_weeks = num_months * 4
+        self.period_indexes = {}
+
+    def clip_end_time(self, end_time):
+        """
+        assure that the end time is in the range of recorded values in the
+        database
+        """
+        if not end_time:
+            return self.database_max_time
+        end_time = min(self.database_max_time, end_time)
+        return max(self.database_min_time, end_time)
+
+    def get_period_index(self, granularity, end_time=0):
+        """
+        :param granularity: "day", "week", "month" or "term"
+        :param end_time: a unix timestamp, the last recorded time if 0
+        :return: the memoized PeriodIndex of the granularity
+        """
+        end_time = self.clip_end_time(end_time)
+        key = (granularity, end_time)
+        if key not in self.period_indexes:
+            build_function = {"day": self.build_days,
+                              "week": self.build_weeks,
+                              "month": self.build_months,
+                              "term": self.build_terms}[granularity]
+            self.period_indexes[key] = PeriodIndex(granularity,
+                                                   build_function(end_time))
+        return self.period_indexes[key]
+
+    def get_days(self, end_time=0):
+        return self.get_period_index("day", end_time).periods
 
     def get_weeks(self, end_time=0.0):
         """
@@ -163,16 +1281,42 @@ class TimeFinder:
         :param end_time: a unix timestamp
         :return: an ordered ist of tuples for each week (start, end)
         """
-        if not end_time:
-            end_time = self.database_max_time
-        else:
-            # assure that the end time is in the range of recorded values in the database
-            end_time = min(self.database_max_time, end_time)
-            end_time = max(self.database_min_time, end_time)
+        return self.get_period_index("week", end_time).periods
+
+    def get_months(self, end_time=0):
+        """
+        Generate list for months simliar to weeks. This adds the complication
+        of differing days per month
+        :param end_time: a datetime objeect for the latest time to be reported
+        :return
+        """
+        return self.get_period_index("month", end_time).periods
+
+    def get_terms(self, end_time=0):
+        return self.get_period_index("term", end_time).periods
+
+    def build_days(self, end_time):
+        """
+        The days of the reported months, the last one partial.
+        """
+        sec_per_day = 24 * 3600
+        day_date = datetime.date.fromtimestamp(float(end_time))
+        day_start = int(time.mktime(day_date.timetuple()))
+        daily_periods = [TimePeriod(day_start, end_time, sec_per_day)]
+        for i in range(self.num_months * 31 - 1):
+            day_end = day_start - 1
+            day_date -= datetime.timedelta(1)
+            day_start = int(time.mktime(day_date.timetuple()))
+            if day_start < self.database_min_time:
+                daily_periods.append(
+                    TimePeriod(self.database_min_time, day_end, sec_per_day))
+                break
+            daily_periods.append(TimePeriod(day_start, day_end, sec_per_day))
+        daily_periods.reverse()
+        return daily_periods
+
+    def build_weeks(self, end_time):
         sec_per_week = 7 * 24 * 3600
-        # assure that the end time is in the range of recorded values in the database
-        end_time = min(self.database_max_time, end_time)
-        end_time = max(self.database_min_time, end_time)
         # adjust for the portion of the current week
         end_date_time = datetime.date.fromtimestamp(float(end_time))
         dt_start_of_week = end_date_time - datetime.timedelta(
@@ -195,53 +1339,593 @@ class TimeFinder:
         weekly_periods.reverse()
         return weekly_periods
 
-    def get_months(self, end_time=0):
+    def build_months(self, end_time):
+        # use 30 days as a monthlong perod for scaling
+        time_per_month = 60 + 60 * 24 * 30
+        return self.build_calendar_periods(end_time, range(1, 13),
+                                           self.num_months, time_per_month)
+
+    def build_terms(self, end_time):
+        time_per_term = (60 + 60 * 24 * 30) * 12 // len(
+            self.TERM_START_MONTHS)
+        num_terms = -(-self.num_months * len(self.TERM_START_MONTHS) // 12)
+        return self.build_calendar_periods(end_time, self.TERM_START_MONTHS,
+                                           num_terms, time_per_term)
+
+    def build_calendar_periods(self, end_time, start_months, num_periods,
+                               period_time):
         """
-        Generate list for months simliar to weeks. This adds the complication
-        of differing days per month
-        :param end_time: a datetime objeect for the latest time to be reported
-        :return
+        Periods that start on the first day of one of the start months.
+        Like the months before, the first period starts before the first
+        recorded time.
+        :param start_months: the ordered months in which a period starts
         """
-        if not end_time:
-            end_time = self.database_max_time
-        else:
-            # assure that the end time is in the range of recorded values in the database
-            end_time = min(self.database_max_time, end_time)
-            end_time = max(self.database_min_time, end_time)
         end_datetime = datetime.datetime.fromtimestamp(end_time)
         target_year = end_datetime.year
-        target_month = end_datetime.month
-        dt_month_start = datetime.date(target_year, target_month, 1)
-        month_start = time.mktime(dt_month_start.timetuple())
-        # use 30 days as a monthlong perod for scaling
-        time_per_month = 60 + 60 * 24 * 30
-        monthly_periods = [TimePeriod(month_start, end_time, time_per_month)]
-        for i in range(self.num_months - 1):
-            month_end = month_start - 1
-            target_month -= 1
-            if target_month < 1:
-                target_month = 12
+        month_index = bisect.bisect_right(start_months,
+                                          end_datetime.month) - 1
+        if month_index < 0:
+            month_index = len(start_months) - 1
+            target_year -= 1
+        dt_period_start = datetime.date(target_year,
+                                        start_months[month_index], 1)
+        period_start = time.mktime(dt_period_start.timetuple())
+        periods = [TimePeriod(period_start, end_time, period_time)]
+        for i in range(num_periods - 1):
+            period_end = period_start - 1
+            month_index -= 1
+            if month_index < 0:
+                month_index = len(start_months) - 1
                 target_year -= 1
-            dt_month_start = datetime.date(target_year, target_month, 1)
-            month_start = time.mktime(dt_month_start.timetuple())
-            monthly_periods.append(
-                TimePeriod(month_start, month_end, time_per_month))
-            if month_start < self.database_min_time:
+            dt_period_start = datetime.date(target_year,
+                                            start_months[month_index], 1)
+            period_start = time.mktime(dt_period_start.timetuple())
+            periods.append(TimePeriod(period_start, period_end, period_time))
+            if period_start < self.database_min_time:
                 break
         # list is in reverser order (lastest first) so reverse
-        monthly_periods.reverse()
-        return monthly_periods
+        periods.reverse()
+        return periods
 
 
-class ReportValues:
-    def __init__(self, db_reader, user_type, status, time_period, max_count):
-        self.db_reader = db_reader
-        self.max_count = max_count
-        self.value = 0.0
-        self.start_time = time_period.get_period_start()
-        self.stop_time = time_period.get_period_end()
-        self.time_period = time_period
-        self.scale_factor = time_period.get_scaling_factor()
+class DayHistogram:
+    """
+    The count histograms of all samples recorded in one local day.
+    The samples taken exactly at the start of the day are also kept
+    separately because a week that ends at midnight includes them.
+    """
+
+    def __init__(self, day_start, first_time, last_time):
+        self.day_start = day_start
+        self.first_time = first_time
+        self.last_time = last_time
+        # column name -> {count value: number of samples}
+        self.counts = {}
+        self.start_counts = {}
+
+    def add_sample(self, column_name, value, at_day_start):
+        column_counts = self.counts.setdefault(column_name, {})
+        column_counts[value] = column_counts.get(value, 0) + 1
+        if at_day_start:
+            column_counts = self.start_counts.setdefault(column_name, {})
+            column_counts[value] = column_counts.get(value, 0) + 1
+
+
+class DailyRollup:
+    """
+    Keep per day histograms of the SummaryData count columns in a local
+    cache file of each database. Each run only reads the rows that are
+    newer than the high water mark stored with the histograms so the cost
+    of a report depends on the new data rather than the whole history.
+    """
+
+    COLUMN_NAMES = ("TeacherCount", "StudentCount", "ActiveTeacherCount",
+                    "ActiveStudentCount")
+    FILE_VERSION = 1
+
+    def __init__(self, db_reader, cache_dir=DEFAULT_CACHE_DIR):
+        self.db_reader = db_reader
+        self.cache_dir = cache_dir
+        self.cache_filename = os.path.join(
+            cache_dir, "SystemMonitor_rollup_%s.json"
+            % db_reader.get_database_hash())
+        self.min_time = None
+        self.high_water_mark = None
+        self.days = []
+        self.day_starts = []
+
+    def clear(self):
+        self.min_time = None
+        self.high_water_mark = None
+        self.days = []
+        self.day_starts = []
+
+    def load(self):
+        """
+        Read the histograms from the cache file. A missing or unreadable
+        file just leaves the rollup empty so that it is rebuilt.
+        :return: True if the cache file was read
+        """
+        self.clear()
+        if not os.path.exists(self.cache_filename):
+            return False
+        try:
+            with open(self.cache_filename, "r") as cache_file:
+                contents = json.load(cache_file)
+            if contents.get("version") != self.FILE_VERSION:
+                return False
+            for day_values in contents["days"]:
+                day = DayHistogram(day_values[0], day_values[1],
+                                   day_values[2])
+                for column_counts, stored_counts in (
+                        (day.counts, day_values[3]),
+                        (day.start_counts, day_values[4])):
+                    for column_name, value_counts in stored_counts.items():
+                        column_counts[column_name] = dict(
+                            (None if value == "None" else int(value), count)
+                            for value, count in value_counts.items())
+                self.days.append(day)
+                self.day_starts.append(day.day_start)
+            self.min_time = contents["min_time"]
+            self.high_water_mark = contents["high_water_mark"]
+        except (IOError, OSError, ValueError, KeyError, IndexError) as e:
+            print ("The rollup cache %s could not be read: %s"
+                   % (self.cache_filename, e))
+            self.clear()
+            return False
+        return True
+
+    def save(self):
+        """
+        Write the histograms to a temporary file and then rename it so that
+        an interrupted run never leaves a partial cache file.
+        :return: True if the file was written
+        """
+        days = []
+        for day in self.days:
+            days.append([day.day_start, day.first_time, day.last_time,
+                         dict((column_name, dict(
+                             (str(value), count)
+                             for value, count in value_counts.items()))
+                              for column_name, value_counts in
+                              day.counts.items()),
+                         dict((column_name, dict(
+                             (str(value), count)
+                             for value, count in value_counts.items()))
+                              for column_name, value_counts in
+                              day.start_counts.items())])
+        contents = {"version": self.FILE_VERSION, "min_time": self.min_time,
+                    "high_water_mark": self.high_water_mark, "days": days}
+        temp_filename = self.cache_filename + ".tmp"
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(temp_filename, "w") as cache_file:
+                json.dump(contents, cache_file)
+            os.rename(temp_filename, self.cache_filename)
+        except (IOError, OSError) as e:
+            print ("The rollup cache %s could not be written: %s"
+                   % (self.cache_filename, e))
+            return False
+        return True
+
+    def refresh(self):
+        """
+        Bring the histograms up to date with the database. If the database
+        no longer matches the cache (it was cleared or restored) the
+        histograms are rebuilt from the beginning.
+        :return: the number of new rows folded into the histograms
+        """
+        self.load()
+        database_min_time, database_max_time = \
+            self.db_reader.return_single_value(
+                "SELECT MIN(Time), MAX(Time) FROM SummaryData")
+        if database_min_time is None:
+            self.clear()
+            return 0
+        if self.min_time != database_min_time or \
+                self.high_water_mark is None or \
+                database_max_time < self.high_water_mark:
+            self.clear()
+            self.min_time = database_min_time
+            query = "SELECT Time, %s FROM SummaryData ORDER BY Time" \
+                    % ", ".join(self.COLUMN_NAMES)
+            params = None
+        elif database_max_time == self.high_water_mark:
+            return 0
+        else:
+            query = "SELECT Time, %s FROM SummaryData WHERE Time > %%s " \
+                    "ORDER BY Time" % ", ".join(self.COLUMN_NAMES)
+            params = (self.high_water_mark,)
+        row_count = 0
+        day = None
+        next_day_start = None
+        if self.days:
+            day = self.days[-1]
+            next_day_start = self.next_day_start(day.day_start)
+        for row in self.db_reader.iter_rows(query, params):
+            sample_time = row[0]
+            if day is None or sample_time >= next_day_start:
+                day_date = datetime.date.fromtimestamp(sample_time)
+                day_start = int(time.mktime(day_date.timetuple()))
+                next_day_start = self.next_day_start(day_start)
+                day = DayHistogram(day_start, sample_time, sample_time)
+                self.days.append(day)
+                self.day_starts.append(day_start)
+            day.last_time = sample_time
+            at_day_start = sample_time == day.day_start
+            for column_name, value in zip(self.COLUMN_NAMES, row[1:]):
+                day.add_sample(column_name, value, at_day_start)
+            self.high_water_mark = sample_time
+            row_count += 1
+        self.save()
+        return row_count
+
+    @staticmethod
+    def next_day_start(day_start):
+        day_date = datetime.date.fromtimestamp(day_start) + \
+                   datetime.timedelta(1)
+        return int(time.mktime(day_date.timetuple()))
+
+    def histogram_rows(self, column_name, time_period, max_count):
+        """
+        Sum the daily histograms into the rows returned by the
+        ReportValues histogram query for the period.
+        :return: the list of (bucket, samples, column sum) or None if the
+            period does not start and end on day boundaries
+        """
+        start_time = time_period.get_period_start()
+        stop_time = time_period.get_period_end()
+        bucket_sums = {}
+        index = max(bisect.bisect_right(self.day_starts, start_time) - 1, 0)
+        while index < len(self.days) and \
+                self.days[index].day_start <= stop_time:
+            day = self.days[index]
+            index += 1
+            if day.last_time < start_time:
+                continue
+            if start_time <= day.first_time and day.last_time <= stop_time:
+                value_counts = day.counts.get(column_name, {})
+            elif day.day_start == stop_time and start_time <= stop_time:
+                value_counts = day.start_counts.get(column_name, {})
+            elif day.first_time > stop_time:
+                continue
+            else:
+                return None
+            for value, count in value_counts.items():
+                if value is None:
+                    bucket = None
+                else:
+                    bucket = min(value, max_count + 1)
+                bucket_sum = bucket_sums.setdefault(bucket, [0, 0])
+                bucket_sum[0] += count
+                bucket_sum[1] += (value or 0) * count
+        return [(bucket, bucket_sum[0], bucket_sum[1])
+                for bucket, bucket_sum in bucket_sums.items()]
+
+
+class SummarySnapshot:
+    """
+    The Time and count columns of SummaryData held as NumPy arrays in time
+    order. A NULL or negative count is stored as -1 so that, as in the
+    queries, it is only counted in the "On Hours".
+    """
+
+    COLUMN_NAMES = DailyRollup.COLUMN_NAMES
+    FETCH_SIZE = 100000
+
+    def __init__(self, times, columns):
+        """
+
+        :param times: an int64 array of the sample times in order
+        :param columns: a dict of column name to an int32 array
+        """
+        self.times = times
+        self.columns = columns
+        self.positive_sums = {}
+
+    @classmethod
+    def read_from_database(cls, db_reader, start_time, stop_time):
+        """
+        Fetch the rows of the time range in blocks of FETCH_SIZE rows and
+        convert each block to arrays so the rows are never all held as
+        Python tuples.
+        :return: a SummarySnapshot
+        """
+        query = "SELECT Time, %s FROM SummaryData " \
+                "WHERE Time >= %%s AND Time <= %%s ORDER BY Time" \
+                % ", ".join(cls.COLUMN_NAMES)
+        blocks = []
+        for rows in db_reader.iter_chunks(
+                query, (int(start_time), int(stop_time)), cls.FETCH_SIZE):
+            # None becomes nan in a float array
+            blocks.append(numpy.array(rows, dtype=numpy.float64))
+        if blocks:
+            values = numpy.concatenate(blocks)
+        else:
+            values = numpy.zeros((0, len(cls.COLUMN_NAMES) + 1))
+        return cls.from_values(values)
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        :param values: a float array with a row per sample of Time and the
+            count columns, nan for NULL
+        """
+        times = values[:, 0].astype(numpy.int64)
+        columns = {}
+        for column_index, column_name in enumerate(cls.COLUMN_NAMES):
+            column = numpy.nan_to_num(values[:, column_index + 1], nan=-1.0)
+            columns[column_name] = numpy.maximum(column, -1).astype(
+                numpy.int32)
+        return cls(times, columns)
+
+    def get_period_slices(self, period_index):
+        """
+        The row slices of all periods of a PeriodIndex in two searches.
+        :return: arrays of the first and the last + 1 row of each period
+        """
+        return (numpy.searchsorted(self.times,
+                                   numpy.asarray(period_index.start_times),
+                                   "left"),
+                numpy.searchsorted(self.times,
+                                   numpy.asarray(period_index.stop_times),
+                                   "right"))
+
+    def get_positive_sums(self, column_name):
+        """
+        The running sum of the positive counts so the sum for any period is
+        the difference of two values.
+        """
+        if column_name not in self.positive_sums:
+            column = self.columns[column_name]
+            running_sum = numpy.zeros(len(column) + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.maximum(column, 0), out=running_sum[1:])
+            self.positive_sums[column_name] = running_sum
+        return self.positive_sums[column_name]
+
+    def histogram_rows(self, column_name, first_row, stop_row, max_count):
+        """
+        Count the samples of each clipped value in the rows of a period.
+        :return: the rows of the ReportValues histogram query
+        """
+        clipped = numpy.minimum(self.columns[column_name][first_row:stop_row],
+                                max_count + 1)
+        # shift by one so the NULL value -1 is counted in bin 0
+        bucket_counts = numpy.bincount(clipped + 1, minlength=max_count + 3)
+        running_sum = self.get_positive_sums(column_name)
+        user_sum = int(running_sum[stop_row] - running_sum[first_row])
+        histogram_rows = [(None, int(bucket_counts[0]), None),
+                          (0, int(bucket_counts[1]), 0)]
+        for bucket in range(1, max_count + 1):
+            samples_count = int(bucket_counts[bucket + 1])
+            histogram_rows.append((bucket, samples_count,
+                                   bucket * samples_count))
+            user_sum -= bucket * samples_count
+        histogram_rows.append((max_count + 1,
+                               int(bucket_counts[max_count + 2]), user_sum))
+        return [row for row in histogram_rows if row[1]]
+
+
+class ColumnCache:
+    """
+    A local copy of the Time and count columns of SummaryData as fixed
+    width binary files, one per column and database, that are opened with
+    mmap. Each run only appends the rows newer than the last cached time so
+    repeat reports start without reading the history from MySQL. The json file
+    with the row count is written last so an interrupted append is simply
+    ignored.
+    """
+
+    COLUMN_NAMES = DailyRollup.COLUMN_NAMES
+    FILE_VERSION = 1
+    APPEND_SIZE = 100000
+
+    def __init__(self, db_reader, cache_dir=DEFAULT_CACHE_DIR):
+        self.db_reader = db_reader
+        self.cache_dir = cache_dir
+        self.database_hash = db_reader.get_database_hash()
+        self.meta_filename = os.path.join(
+            cache_dir, "SummaryData_%s_columns.json" % self.database_hash)
+        self.row_count = 0
+        self.min_time = None
+        self.last_time = None
+        self.memory_maps = {}
+
+    def get_column_filename(self, column_name):
+        return os.path.join(self.cache_dir, "SummaryData_%s_%s.bin"
+                            % (self.database_hash, column_name))
+
+    def get_type_code(self, column_name):
+        # the counts are small but the times need 64 bits
+        if column_name == "Time":
+            return "q"
+        return "i"
+
+    def load(self):
+        """
+        Read the row count and time range of the cached columns.
+        :return: True if there is a usable cache
+        """
+        self.row_count = 0
+        self.min_time = None
+        self.last_time = None
+        try:
+            with open(self.meta_filename, "r") as meta_file:
+                meta = json.load(meta_file)
+            if meta.get("version") != self.FILE_VERSION or \
+                    meta.get("byteorder") != sys.byteorder:
+                return False
+            for column_name in ("Time",) + self.COLUMN_NAMES:
+                item_size = array.array(
+                    self.get_type_code(column_name)).itemsize
+                if os.path.getsize(self.get_column_filename(column_name)) < \
+                        meta["row_count"] * item_size:
+                    return False
+            self.row_count = meta["row_count"]
+            self.min_time = meta["min_time"]
+            self.last_time = meta["last_time"]
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def save_meta(self):
+        meta = {"version": self.FILE_VERSION, "byteorder": sys.byteorder,
+                "row_count": self.row_count, "min_time": self.min_time,
+                "last_time": self.last_time}
+        temp_filename = self.meta_filename + ".tmp"
+        with open(temp_filename, "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.rename(temp_filename, self.meta_filename)
+
+    def refresh(self):
+        """
+        Bring the cached columns up to date with the database. The cache is
+        rebuilt if the first row of the database is not the first cached
+        row or the database ends before the cache.
+        :return: the number of rows appended
+        """
+        self.close()
+        has_cache = self.load()
+        database_min_time, database_max_time = \
+            self.db_reader.return_single_value(
+                "SELECT MIN(Time), MAX(Time) FROM SummaryData")
+        if not has_cache or database_min_time is None or \
+                self.min_time != database_min_time or \
+                self.last_time is None or \
+                database_max_time < self.last_time:
+            self.row_count = 0
+            self.min_time = database_min_time
+            self.last_time = None
+        if database_min_time is None or \
+                (self.last_time is not None and
+                 database_max_time == self.last_time):
+            return 0
+        query = "SELECT Time, %s FROM SummaryData " \
+                % ", ".join(self.COLUMN_NAMES)
+        params = None
+        if self.last_time is not None:
+            query += "WHERE Time > %s "
+            params = (self.last_time,)
+        chunks = self.db_reader.iter_chunks(query + "ORDER BY Time", params,
+                                            self.APPEND_SIZE)
+        appended_count = 0
+        last_time = self.last_time
+        column_files = []
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            for column_name in ("Time",) + self.COLUMN_NAMES:
+                column_file = open(self.get_column_filename(column_name),
+                                   "r+b" if self.row_count else "wb")
+                item_size = array.array(
+                    self.get_type_code(column_name)).itemsize
+                # drop anything after the last complete append
+                column_file.truncate(self.row_count * item_size)
+                column_file.seek(self.row_count * item_size)
+                column_files.append((column_name, column_file))
+            for rows in chunks:
+                for column_index, (column_name, column_file) in \
+                        enumerate(column_files):
+                    values = array.array(self.get_type_code(column_name))
+                    if column_index:
+                        values.extend(-1 if row[column_index] is None or
+                                      row[column_index] < 0
+                                      else row[column_index] for row in rows)
+                    else:
+                        values.extend(row[0] for row in rows)
+                    values.tofile(column_file)
+                appended_count += len(rows)
+                self.last_time = rows[-1][0]
+            for column_name, column_file in column_files:
+                column_file.close()
+            self.row_count += appended_count
+            self.save_meta()
+        except (IOError, OSError) as e:
+            print ("The column cache in %s could not be written: %s"
+                   % (self.cache_dir, e))
+            self.row_count = 0
+        except self.db_reader.error_class:
+            # the appended rows past row_count are truncated on the next
+            # refresh since the meta file still has the old row count
+            self.last_time = last_time
+            raise
+        finally:
+            for column_name, column_file in column_files:
+                column_file.close()
+            chunks.close()
+        return appended_count
+
+    def get_column(self, column_name):
+        """
+        :return: a read only memoryview of the cached column
+        """
+        if column_name not in self.memory_maps:
+            with open(self.get_column_filename(column_name), "rb") as \
+                    column_file:
+                self.memory_maps[column_name] = mmap.mmap(
+                    column_file.fileno(), 0, access=mmap.ACCESS_READ)
+        type_code = self.get_type_code(column_name)
+        item_size = array.array(type_code).itemsize
+        return memoryview(self.memory_maps[column_name])[
+               :self.row_count * item_size].cast(type_code)
+
+    def iter_rows(self, start_time, stop_time):
+        """
+        Generate the (Time, counts...) rows of a time range, both ends
+        included, without a database. A NULL count is -1.
+        """
+        if not self.row_count:
+            return
+        times = self.get_column("Time")
+        columns = [self.get_column(column_name)
+                   for column_name in self.COLUMN_NAMES]
+        for row_index in range(bisect.bisect_left(times, start_time),
+                               bisect.bisect_right(times, stop_time)):
+            yield (times[row_index],) + tuple(column[row_index]
+                                              for column in columns)
+
+    def get_snapshot(self):
+        """
+        :return: a SummarySnapshot whose arrays share the mapped memory
+        """
+        if not self.row_count:
+            return SummarySnapshot.from_values(
+                numpy.zeros((0, len(self.COLUMN_NAMES) + 1)))
+        return SummarySnapshot(
+            numpy.frombuffer(self.get_column("Time"), dtype=numpy.int64),
+            dict((column_name, numpy.frombuffer(self.get_column(column_name),
+                                                dtype=numpy.int32))
+                 for column_name in self.COLUMN_NAMES))
+
+    def close(self):
+        """
+        Unmap the files. Arrays from get_snapshot must not be used after.
+        """
+        for memory_map in self.memory_maps.values():
+            try:
+                memory_map.close()
+            except BufferError:
+                pass
+        self.memory_maps = {}
+
+
+class ReportValues:
+    def __init__(self, db_reader, user_type, status, time_period, max_count,
+                 downsampled_before=None):
+        """
+
+        :param downsampled_before: the time before which the samples are
+            only in SummaryHourly, None if nothing is downsampled
+        """
+        self.db_reader = db_reader
+        self.max_count = max_count
+        self.downsampled_before = downsampled_before
+        self.value = 0.0
+        self.start_time = time_period.get_period_start()
+        self.stop_time = time_period.get_period_end()
+        self.time_period = time_period
+        self.scale_factor = time_period.get_scaling_factor()
         if status == "Active":
             self.column_name = "Active%sCount" % user_type
         else:
@@ -255,45 +1939,124 @@ class ReportValues:
         self.value_dict["User Hours"] = 0
         self.value_dict["Active Hours"] = 0
 
-    def fill_array_from_database(self):
-        # for all
-        try:
-            action = "SUM"
-            for i in range(self.max_count + 2):
-                if i == 0:
-                    action = "SUM"
-                else:
-                    action = "COUNT"
-                query = "SELECT %s(%s) FROM SummaryData WHERE Time >= %d AND Time <= %d " \
-                        "AND %s >= %d" \
-                        % (action, self.column_name, self.start_time,
-                           self.stop_time,
-                           self.column_name, i)
-                samples_count = self.db_reader.return_single_value(query)[0]
-                if not samples_count:
-                    break
-                if i == 0:
-                    self.value_dict["User Hours"] = int(samples_count)
-                elif i > self.max_count:
-                    self.value_dict[self.max_count] -= int(samples_count)
-                    self.value_dict["> Count"] = int(samples_count)
-                elif i == 1:
-                    self.value_dict[i] = int(samples_count)
-                    self.value_dict["Active Hours"] = int(samples_count)
-                else:
-                    self.value_dict[i - 1] -= int(samples_count)
-                    self.value_dict[i] = int(samples_count)
-            # Get hours server turned on
-            query = "SELECT COUNT(Time) FROM SummaryData WHERE Time >= %d AND Time <= %d " \
-                    % (self.start_time, self.stop_time)
-            self.value_dict["On Hours"] = \
-                self.db_reader.return_single_value(query)[
-                    0]
-            return self
-        except StandardError as e:
-            print ("""Getting values from the database had an error.
-  The type was %s, the time %d and the count %d. 
-  The error was:%s""" % (self.column_name, self.start_time, i, e))
+    def build_histogram_query(self):
+        """
+        Build a single query that returns the distribution of the column
+        over the period. Every count above max_count is clipped into the
+        max_count + 1 bucket which becomes the "> Count" value. Rows with
+        a NULL count form their own group so they are still counted in the
+        "On Hours".
+        The part of the period before downsampled_before is not in
+        SummaryData and is left out.
+        :return: the query text and its params. Each row is (bucket,
+            samples, column sum)
+        """
+        query = "SELECT LEAST(%s, %%s) AS bucket, COUNT(*), SUM(%s) " \
+                "FROM SummaryData WHERE Time >= %%s AND Time <= %%s " \
+                "GROUP BY bucket" % (self.column_name, self.column_name)
+        start_time = self.start_time
+        if self.downsampled_before is not None:
+            start_time = max(start_time, self.downsampled_before)
+        return query, (self.max_count + 1, int(start_time),
+                       int(self.stop_time))
+
+    def add_hourly_histogram(self, db_reader, histogram_rows):
+        """
+        Add the hours of SummaryHourly that start in the period to the
+        rows of the histogram query.
+        :return: the combined histogram rows
+        """
+        buckets = {}
+        for bucket, samples_count, column_sum in histogram_rows:
+            buckets[bucket] = [int(samples_count), int(column_sum or 0)]
+        bucket_limit = self.max_count + 1
+        query = "SELECT %s FROM %s WHERE Time >= %%s AND Time < %%s" \
+                % (self.column_name, SummaryMaintainer.HOURLY_TABLE)
+        for (histogram_text,) in db_reader.fetch_all(
+                query, (int(self.start_time), int(self.stop_time))):
+            for value, samples_count in \
+                    SummaryMaintainer.parse_histogram(histogram_text):
+                bucket_sum = buckets.setdefault(
+                    None if value < 0 else min(value, bucket_limit), [0, 0])
+                bucket_sum[0] += samples_count
+                bucket_sum[1] += max(value, 0) * samples_count
+        return [(bucket, bucket_sum[0], bucket_sum[1])
+                for bucket, bucket_sum in buckets.items()]
+
+    def fill_from_histogram(self, histogram_rows):
+        """
+        Fill the value_dict from the rows of the histogram query.
+        The bucket for i counts only the samples with exactly i users,
+        the max_count bucket is exact too and everything larger is
+        in "> Count".
+        :param histogram_rows: a sequence of (bucket, samples, column sum)
+        :return: self
+        """
+        user_sum = 0
+        on_count = 0
+        for bucket, samples_count, column_sum in histogram_rows:
+            on_count += int(samples_count)
+            if bucket is None or bucket < 1:
+                continue
+            user_sum += int(column_sum)
+            self.value_dict["Active Hours"] += int(samples_count)
+            if bucket > self.max_count:
+                self.value_dict["> Count"] = int(samples_count)
+            else:
+                self.value_dict[int(bucket)] = int(samples_count)
+        self.value_dict["User Hours"] = user_sum
+        self.value_dict["On Hours"] = on_count
+        return self
+
+    def fill_from_list(self, values):
+        """
+        Fill the value_dict from a list of its values in key order.
+        :return: self
+        """
+        for key, value in zip(list(self.value_dict.keys()), values):
+            self.value_dict[key] = value
+        return self
+
+    def fill_from_rollup(self, rollup):
+        """
+        Fill the value_dict by summing the daily histograms. A period that
+        does not fall on day boundaries is read from the database instead.
+        :param rollup: an up to date DailyRollup
+        :return: self
+        """
+        histogram_rows = rollup.histogram_rows(self.column_name,
+                                               self.time_period,
+                                               self.max_count)
+        if histogram_rows is None:
+            return self.fill_array_from_database()
+        return self.fill_from_histogram(histogram_rows)
+
+    def fill_array_from_database(self, db_reader=None):
+        """
+        Fill the value_dict with one histogram query. A failed query raises
+        the error class of the driver so the period is never left empty.
+        :param db_reader: the connection to use instead of the one this
+            object was created with
+        :return: self
+        """
+        # all buckets, the user sum and the on hours come from one query
+        db_reader = db_reader or self.db_reader
+        histogram_rows = []
+        if self.downsampled_before is None or \
+                self.downsampled_before <= self.stop_time:
+            query, params = self.build_histogram_query()
+            histogram_rows = db_reader.fetch_all(query, params)
+        if self.downsampled_before is not None and \
+                self.downsampled_before > self.start_time:
+            histogram_rows = self.add_hourly_histogram(db_reader,
+                                                       histogram_rows)
+        return self.fill_from_histogram(histogram_rows)
+
+    def get_error_text(self, error):
+        return """Getting values from the database had an error.
+  The type was %s, the time %d and the count %d.
+  The error was:%s""" % (self.column_name, self.start_time,
+                         self.max_count, error)
 
     def set_value(self, samples_count=1):
         """
@@ -313,259 +2076,3943 @@ class ReportValues:
     def get_scaled_value(self):
         return self.value * self.get_scaling_factor()
 
-    def get_times(self):
+    def get_times(self):
+        """
+        Create datetime objects for start and finish time
+        :return: start and end datetime objects
+        """
+        start_datetime = datetime.datetime.fromtimestamp(
+            self.time_period.get_start_time())
+        end_datetime = datetime.datetime.fromtimestamp(
+            self.time_period.get_end_time())
+        return start_datetime, end_datetime
+
+
+class UsageHeatmap:
+    """
+    The usage of every hour of the day on every weekday. Each cell keeps
+    a count of how often each StudentCount and ActiveStudentCount value
+    was seen, so the percentiles are exact without keeping the samples.
+    """
+    WEEKDAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday",
+                     "Saturday", "Sunday")
+    COLUMN_NAMES = ("StudentCount", "ActiveStudentCount")
+    PERCENTILES = (50, 90)
+
+    def __init__(self):
+        self.cells = {}
+        for weekday in range(7):
+            for hour in range(24):
+                self.cells[(weekday, hour)] = [
+                    collections.Counter() for column_name in self.COLUMN_NAMES]
+
+    def add_rows(self, rows):
+        """
+        Add rows in time order. The local weekday and hour are only looked
+        up when a row is in a new hour.
+        :param rows: an iterable of (Time, StudentCount, ActiveStudentCount)
+        :return: the number of rows added
+        """
+        row_count = 0
+        hour_end = None
+        counters = None
+        for row in rows:
+            sample_time = row[0]
+            if hour_end is None or sample_time >= hour_end \
+                    or sample_time < hour_end - 3600:
+                local_time = time.localtime(sample_time)
+                counters = self.cells[(local_time.tm_wday,
+                                       local_time.tm_hour)]
+                hour_end = sample_time - local_time.tm_min * 60 \
+                    - local_time.tm_sec + 3600
+            for counter, value in zip(counters, row[1:]):
+                # a NULL count is -1 in the column cache
+                if value is not None and value >= 0:
+                    counter[value] += 1
+            row_count += 1
+        return row_count
+
+    def add_hourly_rows(self, rows):
+        """
+        Add the downsampled hours of SummaryHourly.
+        :param rows: an iterable of (Time, StudentCount, ActiveStudentCount)
+            with the columns of SummaryHourly
+        """
+        for row in rows:
+            local_time = time.localtime(row[0])
+            counters = self.cells[(local_time.tm_wday, local_time.tm_hour)]
+            for counter, histogram_text in zip(counters, row[1:]):
+                for value, samples_count in \
+                        SummaryMaintainer.parse_histogram(histogram_text):
+                    # a NULL count is stored as -1
+                    if value >= 0:
+                        counter[value] += samples_count
+
+    @staticmethod
+    def get_percentile(counter, sample_count, percentile):
+        """
+        :return: the nearest rank percentile of the counted values
+        """
+        rank = max(1, -(-sample_count * percentile // 100))
+        seen = 0
+        for value in sorted(counter):
+            seen += counter[value]
+            if seen >= rank:
+                return value
+        return 0
+
+    def iter_report_rows(self):
+        """
+        Generate the rows of the heatmap csv, the header row first.
+        The occupied percent is the share of samples with any student.
+        :return: a generator of row lists
+        """
+        row_header = ["Weekday", "Hour", "Samples", "Occupied Percent"]
+        for column_name in self.COLUMN_NAMES:
+            label = column_name.replace("Count", "").replace(
+                "Active", "Active ")
+            for percentile in self.PERCENTILES:
+                row_header.append("%s p%d" % (label, percentile))
+            row_header.append("%s Max" % label)
+        yield row_header
+        for weekday in range(7):
+            for hour in range(24):
+                counters = self.cells[(weekday, hour)]
+                sample_count = sum(counters[0].values())
+                occupied_count = sample_count - counters[0][0]
+                row_values = [self.WEEKDAY_NAMES[weekday], "%02d:00" % hour,
+                              sample_count]
+                if sample_count:
+                    row_values.append(float(
+                        "%3.2f" % (100.0 * occupied_count / sample_count)))
+                else:
+                    row_values.append(0.0)
+                for counter in counters:
+                    counter_samples = sum(counter.values())
+                    for percentile in self.PERCENTILES:
+                        row_values.append(self.get_percentile(
+                            counter, counter_samples, percentile))
+                    row_values.append(max(counter) if counter else 0)
+                yield row_values
+
+
+class ConcurrentGatherer:
+    """
+    Fill ReportValues from the database on a bounded pool of connections.
+    Each worker thread opens its own connection and takes reporters from a
+    shared queue so the round trips of the small histogram queries
+    overlap. A reporter whose query fails is put back for another try on a
+    new connection and is reported as failed after the last retry. Any
+    other error fails the reporter at once.
+    """
+
+    def __init__(self, db_reader, workers=GATHER_WORKERS,
+                 retries=GATHER_RETRIES):
+        self.db_reader = db_reader
+        self.workers = max(workers, 1)
+        self.retries = retries
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.work_queue = queue.Queue()
+
+    def connect(self):
+        """
+        :return: a new connection or None if it could not be opened
+        """
+        try:
+            return self.db_reader.clone()
+        except (ImportError,) + DB_ERRORS:
+            return None
+
+    def run_worker(self, db_reader=None):
+        """
+        Fill reporters until the queue is empty. A worker that can not
+        connect leaves its work to the others.
+        :param db_reader: the connection to use, by default a new one
+        """
+        if db_reader is None:
+            db_reader = self.connect()
+        while db_reader is not None:
+            try:
+                index, reporter, attempt = self.work_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                reporter.fill_array_from_database(db_reader)
+            except db_reader.error_class as e:
+                if attempt < self.retries:
+                    self.work_queue.put((index, reporter, attempt + 1))
+                    # the connection may be broken so use a new one
+                    db_reader = self.connect()
+                else:
+                    with self.lock:
+                        self.errors[index] = reporter.get_error_text(e)
+            except Exception as e:
+                with self.lock:
+                    self.errors[index] = reporter.get_error_text(e)
+
+    def fill(self, reporters):
+        """
+        Fill every reporter. The reporters are filled in place so the
+        order of the caller is kept.
+        :return: a dict of the index of each failed reporter to its error
+        """
+        for index, reporter in enumerate(reporters):
+            self.work_queue.put((index, reporter, 0))
+        if self.workers > 1 and len(reporters) > 1:
+            threads = []
+            for i in range(min(self.workers, len(reporters))):
+                worker = threading.Thread(target=self.run_worker)
+                worker.start()
+                threads.append(worker)
+            for worker in threads:
+                worker.join()
+        # whatever the workers could not do is done on this connection
+        self.run_worker(self.db_reader)
+        while not self.work_queue.empty():
+            index, reporter, attempt = self.work_queue.get_nowait()
+            self.errors[index] = reporter.get_error_text(
+                "no connection to the database")
+        return self.errors
+
+
+class DataGatherer:
+    """
+
+    """
+
+    def __init__(self, db_reader, time_finder, max_user_count=20,
+                 engine="query", cache_dir=DEFAULT_CACHE_DIR,
+                 column_cache=False, workers=GATHER_WORKERS):
+        """
+
+        :param engine: "query" for one histogram query per report value,
+            "sweep" for a single pass over the SummaryData table,
+            "rollup" to sum the cached daily histograms or "numpy" to count
+            a bulk fetch of the table with NumPy
+        :param cache_dir: the directory for the rollup cache file
+        :param column_cache: let the numpy engine read the mmap column
+            cache in cache_dir instead of the whole table
+        :param workers: the number of connections the query and rollup
+            engines read the report values on at the same time
+        """
+        self.db_reader = db_reader
+        self.time_finder = time_finder
+        self.max_user_count = max_user_count
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.column_cache = column_cache
+        self.workers = workers
+        self.failed_count = 0
+        self.reporter_dict = {}
+
+    # def perform_count_query(self, ):
+    def create_value_objects(self):
+        """
+        Create a dictionary of all ReportValue objects. The key is generated by the ReportValue
+        object.
+        :return:
+        """
+        engine = self.engine
+        if engine != "query" and \
+                self.time_finder.downsampled_before is not None:
+            print ("SummaryData is downsampled before %s so the query "
+                   "engine is used." % datetime.date.fromtimestamp(
+                       self.time_finder.downsampled_before))
+            engine = "query"
+        try:
+            if engine == "numpy":
+                if numpy is not None and self.column_cache:
+                    column_cache = ColumnCache(self.db_reader, self.cache_dir)
+                    column_cache.refresh()
+                    return self.create_value_objects_vectorized(
+                        column_cache.get_snapshot())
+                if numpy is not None:
+                    return self.create_value_objects_vectorized()
+                print ("NumPy is not installed so the sweep engine is used.")
+                return self.create_value_objects_by_sweep()
+            if engine == "sweep":
+                return self.create_value_objects_by_sweep()
+            rollup = None
+            if engine == "rollup":
+                rollup = DailyRollup(self.db_reader, self.cache_dir)
+                rollup.refresh()
+        except self.db_reader.error_class as e:
+            # nothing of a partial read is reported
+            print ("SummaryData could not be read by the %s engine: %s"
+                   % (engine, e))
+            self.reporter_dict = {}
+            self.failed_count += 1
+            return self.reporter_dict, 0
+        self.fill_reporters(self.create_empty_reporters(), rollup)
+        reporter_count = len(self.reporter_dict)
+        if reporter_count == 0:
+            """
+Error:
+    There was a problem with getting report data so the report is bad.
+    If no other errors reported then the database dump may be OK.
+    Return the .the .tbz file. """
+        return self.reporter_dict, reporter_count
+
+    def create_usage_heatmap(self):
+        """
+        Count the hour of day and weekday usage over the reported months in
+        a single pass through SummaryData, or through the column cache
+        when it is used, and the hours of SummaryHourly.
+        :return: a UsageHeatmap
+        """
+        heatmap = UsageHeatmap()
+        months = self.time_finder.get_months()
+        if not months:
+            return heatmap
+        start_time = int(max(months[0].get_period_start(),
+                             self.time_finder.database_min_time))
+        stop_time = int(self.time_finder.database_max_time)
+        downsampled_before = self.time_finder.downsampled_before
+        if downsampled_before is not None and \
+                start_time < downsampled_before:
+            query = "SELECT Time, %s FROM %s WHERE Time >= %%s " \
+                    "AND Time < %%s" % (", ".join(UsageHeatmap.COLUMN_NAMES),
+                                        SummaryMaintainer.HOURLY_TABLE)
+            heatmap.add_hourly_rows(self.db_reader.iter_rows(
+                query, (start_time, downsampled_before)))
+        if self.column_cache:
+            column_cache = ColumnCache(self.db_reader, self.cache_dir)
+            column_cache.refresh()
+            column_indexes = [ColumnCache.COLUMN_NAMES.index(column_name) + 1
+                              for column_name in UsageHeatmap.COLUMN_NAMES]
+            heatmap.add_rows(
+                (row[0],) + tuple(row[index] for index in column_indexes)
+                for row in column_cache.iter_rows(start_time, stop_time))
+            column_cache.close()
+            return heatmap
+        query = "SELECT Time, %s FROM SummaryData " \
+                "WHERE Time >= %%s AND Time <= %%s ORDER BY Time" \
+                % ", ".join(UsageHeatmap.COLUMN_NAMES)
+        heatmap.add_rows(self.db_reader.iter_rows(query,
+                                                  (start_time, stop_time)))
+        return heatmap
+
+    def fill_reporters(self, reporters, rollup=None):
+        """
+        Fill the reporters from the rollup and the rest from the database
+        on a ConcurrentGatherer. A reporter whose query still fails after
+        the retries is reported and removed from reporter_dict so its
+        period is missing from the report instead of being all zero.
+        :param reporters: ReportValues that are in reporter_dict
+        :return: the number of failed reporters
+        """
+        if rollup is not None:
+            database_reporters = []
+            for reporter in reporters:
+                histogram_rows = rollup.histogram_rows(
+                    reporter.column_name, reporter.time_period,
+                    reporter.max_count)
+                if histogram_rows is None:
+                    database_reporters.append(reporter)
+                else:
+                    reporter.fill_from_histogram(histogram_rows)
+            reporters = database_reporters
+        errors = ConcurrentGatherer(self.db_reader, self.workers).fill(
+            reporters)
+        for index in sorted(errors):
+            print (errors[index])
+        if errors:
+            failed_reporters = set(reporters[index] for index in errors)
+            for key, reporter in list(self.reporter_dict.items()):
+                if reporter in failed_reporters:
+                    del self.reporter_dict[key]
+        self.failed_count += len(errors)
+        return len(errors)
+
+    def create_empty_reporters(self):
+        """
+        Create the ReportValues objects of every period in reporter_dict
+        without reading their values.
+        :return: a list of the ReportValues in the order of create_value_objects
+        """
+        reporters = []
+        for period_type, time_periods in (
+                ("Week", self.time_finder.get_weeks()),
+                ("Month", self.time_finder.get_months())):
+            for time_period in time_periods:
+                for status in ("All", "Active"):
+                    for user_type in ("Teacher", "Student"):
+                        reporter = ReportValues(
+                            self.db_reader, user_type, status, time_period,
+                            self.max_user_count,
+                            self.time_finder.downsampled_before)
+                        self.reporter_dict[
+                            (period_type, user_type, status, time_period)] = \
+                            reporter
+                        reporters.append(reporter)
+        return reporters
+
+    def create_value_objects_vectorized(self, snapshot=None):
+        """
+        Create the same dictionary as create_value_objects from one bulk
+        fetch of SummaryData into NumPy arrays. The rows of each period are
+        found with a binary search on Time and counted with bincount.
+        :param snapshot: a SummarySnapshot to use instead of reading the
+            database
+        :return:
+        """
+        reporters = self.create_empty_reporters()
+        if not reporters:
+            return self.reporter_dict, 0
+        if snapshot is None:
+            snapshot = SummarySnapshot.read_from_database(
+                self.db_reader,
+                min(reporter.start_time for reporter in reporters),
+                max(reporter.stop_time for reporter in reporters))
+            if snapshot is None:
+                return {}, 0
+        period_slices = {}
+        for granularity in ("week", "month"):
+            period_index = self.time_finder.get_period_index(granularity)
+            first_rows, stop_rows = snapshot.get_period_slices(period_index)
+            for time_period, first_row, stop_row in zip(
+                    period_index, first_rows, stop_rows):
+                period_slices[time_period] = (int(first_row),
+                                                  int(stop_row))
+        for reporter in reporters:
+            first_row, stop_row = period_slices[reporter.time_period]
+            reporter.fill_from_histogram(snapshot.histogram_rows(
+                reporter.column_name, first_row, stop_row,
+                reporter.max_count))
+        return self.reporter_dict, len(reporters)
+
+    def create_value_objects_by_sweep(self):
+        """
+        Create the same dictionary as create_value_objects but read the
+        SummaryData table only once. The rows are streamed in time order and
+        each row is added to the histograms of every week and month that
+        contain it. As in the queries a row exactly on a week boundary
+        belongs to both weeks.
+        :return:
+        """
+        column_names = ["TeacherCount", "StudentCount", "ActiveTeacherCount",
+                        "ActiveStudentCount"]
+        period_bins = []
+        histograms = {}
+        reporter_count = 0
+        for period_type, period_index in (
+                ("Week", self.time_finder.get_period_index("week")),
+                ("Month", self.time_finder.get_period_index("month"))):
+            period_reporters = []
+            for time_period in period_index:
+                reporters = []
+                for status in ("All", "Active"):
+                    for user_type in ("Teacher", "Student"):
+                        reporter = ReportValues(self.db_reader, user_type,
+                                                status, time_period,
+                                                self.max_user_count)
+                        self.reporter_dict[
+                            (period_type, user_type, status, time_period)] = \
+                            reporter
+                        histograms[reporter] = {}
+                        reporters.append(
+                            (reporter,
+                             column_names.index(reporter.column_name) + 1))
+                        reporter_count += 1
+                period_reporters.append(reporters)
+            period_bins.append((period_index, period_reporters))
+        if not histograms:
+            return self.reporter_dict, reporter_count
+        start_time = min(period_index.get_start_time()
+                         for period_index, bins in period_bins if bins)
+        stop_time = max(period_index.get_stop_time()
+                        for period_index, bins in period_bins if bins)
+        query = "SELECT Time, %s FROM SummaryData " \
+                "WHERE Time >= %%s AND Time <= %%s ORDER BY Time" \
+                % ", ".join(column_names)
+        bucket_limit = self.max_user_count + 1
+        # the first bin of each period list that may still contain a row
+        first_bins = [0] * len(period_bins)
+        for row in self.db_reader.iter_rows(query, (int(start_time),
+                                                    int(stop_time))):
+            sample_time = row[0]
+            for bins_index, (period_index, bins) in enumerate(period_bins):
+                stop_times = period_index.stop_times
+                start_times = period_index.start_times
+                index = first_bins[bins_index]
+                while index < len(bins) and stop_times[index] < sample_time:
+                    index += 1
+                first_bins[bins_index] = index
+                while index < len(bins) and \
+                        start_times[index] <= sample_time:
+                    for reporter, column_index in bins[index]:
+                        value = row[column_index]
+                        if value is None:
+                            bucket = None
+                        else:
+                            bucket = min(value, bucket_limit)
+                        bucket_sum = histograms[reporter].setdefault(
+                            bucket, [0, 0])
+                        bucket_sum[0] += 1
+                        bucket_sum[1] += value or 0
+                    index += 1
+        for reporter, histogram in histograms.items():
+            reporter.fill_from_histogram(
+                [(bucket, bucket_sum[0], bucket_sum[1])
+                 for bucket, bucket_sum in histogram.items()])
+        return self.reporter_dict, reporter_count
+
+
+class ReportCache:
+    """
+    The rendered csv reports and the report values, one cache file per
+    database and key of (months, max count, MAX(Time), row count) so a
+    report is only computed again when SummaryData changed. The newest
+    results are also kept in memory for callers in the same process, by
+    cache directory and database as well as the key. If rows were only
+    appended since a cached result, the periods that ended before its last
+    time are copied and only the newer periods are read from the database.
+    """
+    FILE_VERSION = 2
+    # shared by all instances in the process, newest last, with the cache
+    # directory and database id in front of the key
+    memory_entries = collections.OrderedDict()
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_entries=REPORT_CACHE_ENTRIES,
+                 max_age=REPORT_CACHE_MAX_AGE):
+        self.cache_dir = os.path.join(cache_dir, "reports")
+        self.max_entries = max_entries
+        self.max_age = max_age
+        # how the last report was found: "memory", "file", "partial" or
+        # "computed"
+        self.status = ""
+        self.reused_count = 0
+
+    @staticmethod
+    def get_key(db_reader, num_months, max_user_count):
+        max_time, row_count = db_reader.return_single_value(
+            "SELECT MAX(Time), COUNT(*) FROM SummaryData")
+        return num_months, max_user_count, max_time, row_count
+
+    def get_filename(self, key, database_hash):
+        return os.path.join(self.cache_dir, "report_%s_%s_%s_%s_%s.json"
+                            % ((database_hash,) + tuple(key)))
+
+    def list_filenames(self):
+        """
+        :return: the cache files, the oldest first
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        filenames = [os.path.join(self.cache_dir, filename)
+                     for filename in os.listdir(self.cache_dir)
+                     if filename.startswith("report_")
+                     and filename.endswith(".json")]
+        return sorted(filenames, key=os.path.getmtime)
+
+    def load_entry(self, filename):
+        """
+        :return: the contents of a cache file or None if it can not be used
+        """
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, "r") as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError) as e:
+            print ("The report cache %s could not be read: %s"
+                   % (filename, e))
+            return None
+        if entry.get("version") != self.FILE_VERSION or \
+                time.time() - entry.get("created", 0) > self.max_age:
+            return None
+        return entry
+
+    def find_previous_entry(self, key, database_hash):
+        """
+        :return: the newest cached result of the database for the same
+            months and max count that is older than the key, or None
+        """
+        previous_entry = None
+        for filename in self.list_filenames():
+            entry = self.load_entry(filename)
+            if entry is None or entry.get("database") != database_hash or \
+                    entry["key"][:2] != list(key[:2]) or \
+                    entry["key"][2] is None or entry["key"][2] >= key[2]:
+                continue
+            if previous_entry is None or \
+                    entry["key"][2] > previous_entry["key"][2]:
+                previous_entry = entry
+        return previous_entry
+
+    def save_entry(self, key, database_hash, report_text, reporter_dict):
+        """
+        Write the result to a temporary file and then rename it, then
+        remove the entries that are too old or too many.
+        :return: True if the file was written
+        """
+        values = []
+        for value_key, reporter in reporter_dict.items():
+            values.append([value_key[0], value_key[1], value_key[2],
+                           value_key[3].get_period_start(),
+                           value_key[3].get_period_end(),
+                           list(reporter.value_dict.values())])
+        contents = {"version": self.FILE_VERSION, "key": list(key),
+                    "database": database_hash, "created": time.time(),
+                    "csv": report_text, "values": values}
+        filename = self.get_filename(key, database_hash)
+        temp_filename = filename + ".tmp"
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(temp_filename, "w") as cache_file:
+                json.dump(contents, cache_file)
+            os.rename(temp_filename, filename)
+        except (IOError, OSError) as e:
+            print ("The report cache %s could not be written: %s"
+                   % (filename, e))
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        filenames = self.list_filenames()
+        for index, filename in enumerate(filenames):
+            try:
+                if index < len(filenames) - self.max_entries or \
+                        time.time() - os.path.getmtime(filename) > \
+                        self.max_age:
+                    os.remove(filename)
+            except OSError:
+                pass
+        while len(self.memory_entries) > self.max_entries:
+            self.memory_entries.popitem(last=False)
+
+    @staticmethod
+    def fill_from_entry(data_gatherer, entry, before_time=None):
+        """
+        Create the reporters of the data_gatherer and copy the stored
+        values of each period that is also in the entry and ends no later
+        than before_time. The others are read from the database.
+        :return: the number of copied reporters
+        """
+        stored_values = dict(
+            (tuple(values[:5]), values[5]) for values in entry["values"])
+        data_gatherer.create_empty_reporters()
+        reused_count = 0
+        database_reporters = []
+        for value_key, reporter in data_gatherer.reporter_dict.items():
+            values = stored_values.get(
+                value_key[:3] + (value_key[3].get_period_start(),
+                                 value_key[3].get_period_end()))
+            if values is not None and (
+                    before_time is None or
+                    value_key[3].get_period_end() <= before_time):
+                reporter.fill_from_list(values)
+                reused_count += 1
+            else:
+                database_reporters.append(reporter)
+        data_gatherer.fill_reporters(database_reporters)
+        return reused_count
+
+    def get_report(self, data_gatherer, num_months, max_user_count):
+        """
+        :return: the csv text and the reporter_dict of the report
+        """
+        db_reader = data_gatherer.db_reader
+        key = self.get_key(db_reader, num_months, max_user_count)
+        memory_key = (self.cache_dir, db_reader.get_database_id()) + key
+        database_hash = db_reader.get_database_hash()
+        if memory_key in self.memory_entries:
+            self.memory_entries[memory_key] = \
+                self.memory_entries.pop(memory_key)
+            self.status = "memory"
+            return self.memory_entries[memory_key]
+        entry = self.load_entry(self.get_filename(key, database_hash))
+        if entry is not None:
+            self.status = "file"
+            self.reused_count = self.fill_from_entry(data_gatherer, entry)
+            result = entry["csv"], data_gatherer.reporter_dict
+            self.memory_entries[memory_key] = result
+            self.evict()
+            return result
+        previous_entry = None
+        if key[2] is not None:
+            previous_entry = self.find_previous_entry(key, database_hash)
+        if previous_entry is not None and db_reader.return_single_value(
+                "SELECT COUNT(*) FROM SummaryData WHERE Time <= %s",
+                (previous_entry["key"][2],))[0] == previous_entry["key"][3]:
+            # only appended rows, the older periods are unchanged
+            self.status = "partial"
+            self.reused_count = self.fill_from_entry(
+                data_gatherer, previous_entry, previous_entry["key"][2])
+            reporter_dict = data_gatherer.reporter_dict
+        else:
+            self.status = "computed"
+            self.reused_count = 0
+            reporter_dict, reporter_count = \
+                data_gatherer.create_value_objects()
+        report_text = ResultGenerator(reporter_dict, "School",
+                                      "./").get_report_text()
+        if data_gatherer.failed_count:
+            # a report with missing periods is not kept
+            return report_text, reporter_dict
+        self.save_entry(key, database_hash, report_text, reporter_dict)
+        self.memory_entries[memory_key] = (report_text, reporter_dict)
+        self.evict()
+        return report_text, reporter_dict
+
+
+class ReportWatcher:
+    """
+    Keep the week and month histograms of the report in memory and add
+    the new SummaryData rows every SAMPLE_TIME. The csv report is written
+    on a schedule and saved in the ReportCache so that a later run only
+    has to dump the database. Only the histograms of the reported periods
+    are kept, each holds at most max_count + 3 buckets per column.
+    """
+    COLUMN_NAMES = DailyRollup.COLUMN_NAMES
+    PERIOD_GRANULARITIES = (("Week", "week"), ("Month", "month"))
+
+    def __init__(self, db_reader, report_filename, num_months=60,
+                 max_user_count=20, cache_dir=DEFAULT_CACHE_DIR,
+                 write_interval=3600):
+        """
+
+        :param report_filename: the csv file that is replaced on each write
+        :param write_interval: the least seconds between two csv writes
+        """
+        self.db_reader = db_reader
+        self.report_filename = report_filename
+        self.num_months = num_months
+        self.max_user_count = max_user_count
+        self.report_cache = ReportCache(cache_dir)
+        self.write_interval = write_interval
+        self.high_water_mark = None
+        self.key = None
+        self.time_finder = None
+        # (period type, period start) to a dict of column name to a dict
+        # of bucket to [samples, column sum]
+        self.histograms = {}
+        self.last_write_time = 0
+        self.written_key = None
+
+    def clear(self):
+        self.high_water_mark = None
+        self.histograms = {}
+
+    def update(self):
+        """
+        Add the rows recorded since the last update to the histograms.
+        :return: the number of rows added
+        """
+        key = ReportCache.get_key(self.db_reader, self.num_months,
+                                  self.max_user_count)
+        max_time = key[2]
+        if max_time is None:
+            self.clear()
+            return 0
+        if self.high_water_mark is not None and \
+                max_time < self.high_water_mark:
+            # the table was replaced so start again
+            self.clear()
+        self.key = key
+        if max_time == self.high_water_mark:
+            return 0
+        self.time_finder = TimeFinder(self.db_reader, self.num_months,
+                                      num_weeks=0)
+        period_indexes = [
+            (period_type, self.time_finder.get_period_index(granularity))
+            for period_type, granularity in self.PERIOD_GRANULARITIES]
+        current_keys = set()
+        for period_type, period_index in period_indexes:
+            for time_period in period_index:
+                current_keys.add((period_type,
+                                  time_period.get_period_start()))
+        for histogram_key in list(self.histograms.keys()):
+            if histogram_key not in current_keys:
+                del self.histograms[histogram_key]
+        if self.high_water_mark is None:
+            query = "SELECT Time, %s FROM SummaryData " \
+                    "WHERE Time >= %%s AND Time <= %%s ORDER BY Time" \
+                    % ", ".join(self.COLUMN_NAMES)
+            params = (int(min(period_index.get_start_time()
+                              for period_type, period_index in
+                              period_indexes)), max_time)
+        else:
+            query = "SELECT Time, %s FROM SummaryData " \
+                    "WHERE Time > %%s AND Time <= %%s ORDER BY Time" \
+                    % ", ".join(self.COLUMN_NAMES)
+            params = (self.high_water_mark, max_time)
+        bucket_limit = self.max_user_count + 1
+        try:
+            if self.high_water_mark is None and \
+                    self.time_finder.downsampled_before is not None:
+                self.add_hourly_rows(period_indexes, params[0],
+                                     self.time_finder.downsampled_before)
+            # the histograms of the periods that contain every time between
+            # the two bounds, found again when a row is outside of them
+            found_histograms = []
+            found_bounds = (0, 0)
+            row_count = 0
+            for row in self.db_reader.iter_rows(query, params):
+                sample_time = row[0]
+                if not found_bounds[0] < sample_time < found_bounds[1]:
+                    found_histograms = []
+                    low_bound = 0
+                    high_bound = float("inf")
+                    for period_type, period_index in period_indexes:
+                        first_index, stop_index = \
+                            period_index.find(sample_time)
+                        # no other period starts or ends between the bounds
+                        if first_index > 0:
+                            low_bound = max(
+                                low_bound,
+                                period_index.stop_times[first_index - 1])
+                        if stop_index < len(period_index):
+                            high_bound = min(
+                                high_bound,
+                                period_index.start_times[stop_index])
+                        for index in range(first_index, stop_index):
+                            low_bound = max(low_bound,
+                                            period_index.start_times[index])
+                            # the last period grows with the new rows
+                            if index < len(period_index) - 1:
+                                high_bound = min(
+                                    high_bound,
+                                    period_index.stop_times[index])
+                            found_histograms.append(self.histograms.setdefault(
+                                (period_type, period_index.start_times[index]),
+                                dict((column_name, {}) for column_name in
+                                     self.COLUMN_NAMES)))
+                    found_bounds = (low_bound, high_bound)
+                for histogram in found_histograms:
+                    for column_name, value in zip(self.COLUMN_NAMES, row[1:]):
+                        if value is None:
+                            bucket = None
+                        else:
+                            bucket = min(value, bucket_limit)
+                        bucket_sum = histogram[column_name].setdefault(
+                            bucket, [0, 0])
+                        bucket_sum[0] += 1
+                        bucket_sum[1] += value or 0
+                row_count += 1
+        except self.db_reader.error_class:
+            # the histograms hold a part of the rows so they are rebuilt
+            self.clear()
+            raise
+        self.high_water_mark = max_time
+        return row_count
+
+    def add_hourly_rows(self, period_indexes, start_time, stop_time):
+        """
+        Add the downsampled hours of SummaryHourly to the histograms of the
+        periods they start in.
+        """
+        bucket_limit = self.max_user_count + 1
+        query = "SELECT Time, %s FROM %s WHERE Time >= %%s AND Time < %%s" \
+                % (", ".join(self.COLUMN_NAMES),
+                   SummaryMaintainer.HOURLY_TABLE)
+        for row in self.db_reader.iter_rows(query, (start_time, stop_time)):
+            histograms = []
+            for period_type, period_index in period_indexes:
+                first_index, stop_index = period_index.find(row[0])
+                for index in range(first_index, stop_index):
+                    if period_index.stop_times[index] != row[0]:
+                        histograms.append(self.histograms.setdefault(
+                            (period_type, period_index.start_times[index]),
+                            dict((column_name, {}) for column_name in
+                                 self.COLUMN_NAMES)))
+            for column_name, histogram_text in zip(self.COLUMN_NAMES,
+                                                   row[1:]):
+                for value, samples_count in \
+                        SummaryMaintainer.parse_histogram(histogram_text):
+                    bucket = None if value < 0 else min(value, bucket_limit)
+                    for histogram in histograms:
+                        bucket_sum = histogram[column_name].setdefault(
+                            bucket, [0, 0])
+                        bucket_sum[0] += samples_count
+                        bucket_sum[1] += max(value, 0) * samples_count
+
+    def create_value_objects(self):
+        """
+        :return: the reporter_dict of the current histograms
+        """
+        reporter_dict = {}
+        for period_type, granularity in self.PERIOD_GRANULARITIES:
+            for time_period in self.time_finder.get_period_index(
+                    granularity):
+                histogram = self.histograms.get(
+                    (period_type, time_period.get_period_start()), {})
+                for status in ("All", "Active"):
+                    for user_type in ("Teacher", "Student"):
+                        reporter = ReportValues(self.db_reader, user_type,
+                                                status, time_period,
+                                                self.max_user_count)
+                        reporter.fill_from_histogram(
+                            [(bucket, bucket_sum[0], bucket_sum[1])
+                             for bucket, bucket_sum in histogram.get(
+                                reporter.column_name, {}).items()])
+                        reporter_dict[(period_type, user_type, status,
+                                       time_period)] = reporter
+        return reporter_dict
+
+    def write_report(self):
+        """
+        Write the csv report to a temporary file and rename it so a reader
+        never sees a partial file, then save it in the report cache.
+        :return: True if the report was written
+        """
+        reporter_dict = self.create_value_objects()
+        if not reporter_dict:
+            return False
+        report_text = ResultGenerator(reporter_dict, "School",
+                                      "./").get_report_text()
+        temp_filename = self.report_filename + ".tmp"
+        try:
+            with open(temp_filename, "w", newline="") as report_file:
+                report_file.write(report_text)
+            os.rename(temp_filename, self.report_filename)
+        except (IOError, OSError) as e:
+            print ("The report %s could not be written: %s"
+                   % (self.report_filename, e))
+            return False
+        self.report_cache.save_entry(
+            self.key, self.db_reader.get_database_hash(),
+            report_text, reporter_dict)
+        self.last_write_time = time.time()
+        self.written_key = self.key
+        return True
+
+    def run(self, max_updates=None):
+        """
+        Update every SAMPLE_TIME seconds and write the report when it has
+        changed and write_interval seconds have passed since the last write.
+        :param max_updates: stop after this many updates, None to run until
+            interrupted
+        """
+        update_count = 0
+        while max_updates is None or update_count < max_updates:
+            update_start = time.time()
+            try:
+                self.update()
+                if self.key != self.written_key and \
+                        update_start - self.last_write_time >= \
+                        self.write_interval:
+                    self.write_report()
+            except self.db_reader.error_class as e:
+                print ("The watch update failed: %s" % e)
+            update_count += 1
+            if max_updates is None or update_count < max_updates:
+                time.sleep(max(0.0, SAMPLE_TIME -
+                               (time.time() - update_start)))
+
+
+class ParallelCompressor:
+    """
+    Compress a stream of data in independent blocks on a pool of worker
+    processes. Every block is a complete compressed stream so the output
+    is a standard multi-stream file that bzip2, xz and zstd decompress as
+    one file.
+    """
+
+    def __init__(self, out_file, codec="bz2", workers=1,
+                 block_size=COMPRESS_BLOCK_SIZE):
+        self.out_file = out_file
+        self.codec = codec
+        self.workers = workers
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.pool = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.start_time = time.time()
+        self.elapsed_time = 0.0
+        if workers > 1:
+            try:
+                self.pool = multiprocessing.Pool(workers)
+            except (OSError, ImportError) as e:
+                print ("Compressing in one process, the worker pool could "
+                       "not be started: %s" % e)
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self.submit_block(block)
+
+    def submit_block(self, block):
+        if self.pool is None:
+            self.write_compressed(compress_block(self.codec, block))
+            return
+        self.pending.append(
+            self.pool.apply_async(compress_block, (self.codec, block)))
+        # keep only a few blocks in flight so memory use stays bounded
+        while len(self.pending) > 2 * self.workers:
+            self.write_compressed(self.pending.popleft().get())
+
+    def write_compressed(self, compressed):
+        self.bytes_out += len(compressed)
+        self.out_file.write(compressed)
+
+    def flush(self):
+        """
+        Compress the buffered partial block and wait until every block has
+        been written.
+        """
+        if self.buffer:
+            self.submit_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.write_compressed(self.pending.popleft().get())
+        self.elapsed_time = time.time() - self.start_time
+
+    def close(self):
+        """
+        Compress the last partial block and wait for all workers.
+        """
+        try:
+            self.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def get_throughput_text(self):
+        megabyte = 1024.0 * 1024.0
+        return "Compressed %.1f MB to %.1f MB in %.1f s (%.1f MB/s) " \
+               "using %s on %d worker(s)" \
+               % (self.bytes_in / megabyte, self.bytes_out / megabyte,
+                  self.elapsed_time,
+                  self.bytes_in / megabyte / max(self.elapsed_time, 0.001),
+                  self.codec, max(self.workers, 1))
+
+
+class ParallelDumper:
+    """
+    Dump every table of the database on a pool of worker processes.
+    Each worker opens its own connection and starts its transaction while
+    the tables are locked, so all chunks come from one consistent
+    snapshot. Tables with more than DUMP_SPLIT_ROWS rows are split into
+    ranges of their primary key. Every chunk is a compressed file of SQL
+    statements that loads on its own once the schema chunk is loaded, and
+    in name order the chunks form one loadable dump.
+    """
+    MANIFEST_FILENAME = "manifest.json"
+
+    def __init__(self, db_reader, dump_dirname, codec="bz2", workers=1):
+        self.db_reader = db_reader
+        self.dump_dirname = dump_dirname
+        self.codec = codec
+        self.workers = max(workers, 1)
+        self.chunks = []
+        self.errors = []
+        self.elapsed_time = 0.0
+
+    def get_chunk_filename(self, chunk_index, table_name, part=0):
+        return os.path.join(self.dump_dirname, "%03d_%s.%d.sql%s" % (
+            chunk_index, table_name, part, CHUNK_SUFFIXES[self.codec]))
+
+    def plan_tasks(self, table_names):
+        """
+        :return: a list of one task dict per chunk of table rows
+        """
+        driver = self.db_reader.driver
+        tasks = []
+        for table_name in table_names:
+            key_columns = driver.get_primary_key(self.db_reader, table_name)
+            key_name = key_columns[0] if key_columns else None
+            ranges = [(None, None)]
+            if key_name is not None:
+                row = self.db_reader.return_single_value(
+                    "SELECT COUNT(*), MIN(`%s`), MAX(`%s`) FROM `%s`"
+                    % (key_name, key_name, table_name))
+                if row is not None and row[0] > DUMP_SPLIT_ROWS and \
+                        isinstance(row[1], int) and isinstance(row[2], int):
+                    part_count = -(-row[0] // DUMP_SPLIT_ROWS)
+                    step = (row[2] - row[1]) // part_count + 1
+                    bounds = [row[1] + step * part
+                              for part in range(1, part_count)]
+                    # the ends are open so rows added later are not lost
+                    ranges = list(zip([None] + bounds, bounds + [None]))
+            for part, (low_value, high_value) in enumerate(ranges):
+                tasks.append({"table": table_name, "key": key_name,
+                              "low": low_value, "high": high_value,
+                              "filename": self.get_chunk_filename(
+                                  len(tasks) + 1, table_name, part)})
+        return tasks
+
+    def write_schema_chunk(self, table_names):
+        """
+        Write the chunk that creates the database and empty tables.
+        :return: the chunk filename
+        """
+        driver = self.db_reader.driver
+        lines = driver.get_schema_header(DUMP_DB_NAME)
+        for table_name in table_names:
+            lines.append("DROP TABLE IF EXISTS `%s`;" % table_name)
+            lines.append(driver.get_create_statement(self.db_reader,
+                                                     table_name) + ";")
+        filename = self.get_chunk_filename(0, "schema")
+        with open(filename, "wb") as chunk_file:
+            chunk_file.write(compress_block(
+                self.codec, ("\n".join(lines) + "\n").encode("utf-8")))
+        return filename
+
+    def wait_for_workers(self, processes, result_queue):
+        """
+        Wait until every worker has its snapshot so the writes can go on.
+        A worker that stops without saying so or is not ready within
+        DUMP_READY_TIMEOUT is left out, and one that is still running is
+        stopped so that it takes no task without the snapshot.
+        :return: the processes that are ready
+        """
+        deadline = time.time() + DUMP_READY_TIMEOUT
+        waiting = set(range(len(processes)))
+        ready = set()
+        while waiting and time.time() < deadline:
+            try:
+                kind, worker_index, detail = result_queue.get(timeout=1)
+            except queue.Empty:
+                for worker_index in list(waiting):
+                    if not processes[worker_index].is_alive():
+                        self.errors.append("dump worker %d stopped before "
+                                           "it was ready" % worker_index)
+                        waiting.discard(worker_index)
+                continue
+            waiting.discard(worker_index)
+            if kind == "ready":
+                ready.add(worker_index)
+            else:
+                self.errors.append(detail)
+        for worker_index in waiting:
+            self.errors.append("dump worker %d was not ready within %d s"
+                               % (worker_index, DUMP_READY_TIMEOUT))
+            processes[worker_index].terminate()
+        return [process for worker_index, process in enumerate(processes)
+                if worker_index in ready]
+
+    def dump(self):
+        """
+        Write the schema chunk, dump the table chunks on the workers and
+        write the manifest.
+        :return: True if every chunk was written
+        """
+        start_time = time.time()
+        driver = self.db_reader.driver
+        if not os.path.isdir(self.dump_dirname):
+            os.makedirs(self.dump_dirname)
+        table_names = driver.list_tables(self.db_reader)
+        tasks = self.plan_tasks(table_names)
+        schema_filename = self.write_schema_chunk(table_names)
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue()
+        processes = []
+        if not driver.lock_for_snapshot(self.db_reader):
+            print ("The tables could not be locked so the dump chunks may "
+                   "not be from the same moment.")
+        try:
+            for worker_index in range(min(self.workers, len(tasks))):
+                process = multiprocessing.Process(
+                    target=run_dump_worker,
+                    args=(self.db_reader.connect_params, self.codec,
+                          task_queue, result_queue, worker_index))
+                process.daemon = True
+                process.start()
+                processes.append(process)
+            processes = self.wait_for_workers(processes, result_queue)
+        finally:
+            driver.unlock_after_snapshot(self.db_reader)
+        for task_index, task in enumerate(tasks):
+            task_queue.put((task_index, task))
+        for process in processes:
+            task_queue.put(None)
+        results = {}
+        while len(results) < len(tasks) and processes:
+            try:
+                kind, task_index, detail = result_queue.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if kind == "ready":
+                continue
+            if kind == "done":
+                results[task_index] = detail
+            else:
+                self.errors.append(detail)
+                results[task_index] = None
+        for process in processes:
+            process.join()
+        self.chunks = []
+        for task_index, task in enumerate(tasks):
+            detail = results.get(task_index)
+            if detail is None:
+                continue
+            chunk = {"file": os.path.basename(task["filename"]),
+                     "table": task["table"], "key": task["key"],
+                     "low": task["low"], "high": task["high"]}
+            chunk.update(detail)
+            self.chunks.append(chunk)
+        self.elapsed_time = time.time() - start_time
+        self.write_manifest(schema_filename)
+        for error in self.errors:
+            print ("Error in the parallel dump: %s" % error)
+        return len(self.chunks) == len(tasks) and not self.errors
+
+    def write_manifest(self, schema_filename):
+        manifest = {"format": "SystemMonitor parallel dump",
+                    "version": 1,
+                    "database": DUMP_DB_NAME,
+                    "created": int(time.time()),
+                    "codec": self.codec,
+                    "workers": self.workers,
+                    "seconds": round(self.elapsed_time, 3),
+                    "schema": os.path.basename(schema_filename),
+                    "chunks": self.chunks,
+                    "errors": self.errors,
+                    "load": "Run \"reporter.py --load <this directory>\" "
+                            "to load the chunks in parallel, or "
+                            "decompress the chunks in name order into "
+                            "\"mysql\"."}
+        with open(os.path.join(self.dump_dirname, self.MANIFEST_FILENAME),
+                  "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+    def get_throughput_text(self):
+        megabyte = 1024.0 * 1024.0
+        return "Dumped %d rows, %.1f MB to %.1f MB in %d chunks in %.1f s " \
+               "on %d worker(s)" \
+               % (sum(chunk["rows"] for chunk in self.chunks),
+                  sum(chunk["bytes"] for chunk in self.chunks) / megabyte,
+                  sum(chunk["compressed_bytes"]
+                      for chunk in self.chunks) / megabyte,
+                  len(self.chunks) + 1, self.elapsed_time, self.workers)
+
+
+class ColumnarExporter:
+    """
+    Export every table into one compact binary file instead of SQL text.
+    The rows are stored in blocks of EXPORT_BLOCK_ROWS and each column of
+    a block is a typed fixed width array compressed on its own. Integers
+    use the smallest width that holds them and an ascending column without
+    NULLs, like Time, stores the differences to the previous row. The
+    footer at the end of the file describes the tables and blocks and is
+    read by ColumnarExportReader.
+
+    The file is: EXPORT_MAGIC, the compressed column blocks, the json
+    footer, the footer size as 8 byte little endian and EXPORT_MAGIC.
+    """
+    VERSION = 1
+    INT_TYPE_CODES = ("b", "h", "i", "q")
+
+    def __init__(self, db_reader, export_filename, codec="bz2"):
+        self.db_reader = db_reader
+        self.export_filename = export_filename
+        self.codec = codec
+        self.tables = []
+        self.bytes_out = 0
+        self.elapsed_time = 0.0
+
+    @classmethod
+    def get_int_type_code(cls, values):
+        low_value = min(values) if values else 0
+        high_value = max(values) if values else 0
+        for type_code in cls.INT_TYPE_CODES:
+            bits = 8 * array.array(type_code).itemsize - 1
+            if -2 ** bits <= low_value and high_value < 2 ** bits:
+                return type_code
+        raise OverflowError("the integer column does not fit in 64 bits")
+
+    @classmethod
+    def encode_column(cls, values):
+        """
+        :param values: the values of one column of a block
+        :return: the block description and the raw bytes of the column
+        """
+        is_null = [value is None for value in values]
+        present = [value for value in values if value is not None]
+        column = {}
+        data = b""
+        if any(is_null):
+            column["nulls"] = True
+            data = bytes(bytearray(is_null))
+        if all(isinstance(value, int) for value in present):
+            filled = [0 if value is None else value for value in values]
+            if len(filled) > 1 and "nulls" not in column and \
+                    all(filled[index] <= filled[index + 1]
+                        for index in range(len(filled) - 1)):
+                column["encoding"] = "delta"
+                column["first"] = filled[0]
+                filled = [filled[index + 1] - filled[index]
+                          for index in range(len(filled) - 1)]
+            else:
+                column["encoding"] = "plain"
+            column["type"] = cls.get_int_type_code(filled)
+            data += array.array(column["type"], filled).tobytes()
+        elif all(isinstance(value, (int, float)) for value in present):
+            column["encoding"] = "plain"
+            column["type"] = "d"
+            data += array.array("d", [0.0 if value is None else value
+                                      for value in values]).tobytes()
+        else:
+            column["encoding"] = "bytes" if all(
+                isinstance(value, bytes) for value in present) else "text"
+            pieces = []
+            for value in values:
+                if value is None:
+                    value = b""
+                elif not isinstance(value, bytes):
+                    value = str(value).encode("utf-8")
+                pieces.append(value)
+            lengths = array.array("I", [len(piece) for piece in pieces])
+            column["type"] = "I"
+            data += lengths.tobytes() + b"".join(pieces)
+        return column, data
+
+    def write_block(self, export_file, rows, table):
+        block = {"rows": len(rows), "columns": []}
+        for values in zip(*rows):
+            column, data = self.encode_column(list(values))
+            compressed = compress_block(self.codec, data)
+            column["offset"] = self.bytes_out
+            column["size"] = len(compressed)
+            export_file.write(compressed)
+            self.bytes_out += len(compressed)
+            block["columns"].append(column)
+        table["blocks"].append(block)
+        table["rows"] += len(rows)
+
+    def dump(self):
+        """
+        Export every table in the order of its primary key.
+        :return: True if the file was written
+        """
+        start_time = time.time()
+        driver = self.db_reader.driver
+        self.tables = []
+        try:
+            with open(self.export_filename, "wb") as export_file:
+                export_file.write(EXPORT_MAGIC)
+                self.bytes_out = len(EXPORT_MAGIC)
+                for table_name in driver.list_tables(self.db_reader):
+                    table = {"name": table_name, "rows": 0, "blocks": [],
+                             "columns": driver.get_column_names(
+                                 self.db_reader, table_name),
+                             "create": driver.get_create_statement(
+                                 self.db_reader, table_name)}
+                    query = "SELECT * FROM `%s`" % table_name
+                    key_columns = driver.get_primary_key(self.db_reader,
+                                                         table_name)
+                    if key_columns:
+                        query += " ORDER BY %s" % ", ".join(
+                            "`%s`" % column_name
+                            for column_name in key_columns)
+                    for rows in self.db_reader.iter_chunks(
+                            query, None, EXPORT_BLOCK_ROWS):
+                        self.write_block(export_file, rows, table)
+                    self.tables.append(table)
+                footer = json.dumps({"format": "SystemMonitor columnar "
+                                               "export",
+                                     "version": self.VERSION,
+                                     "database": DUMP_DB_NAME,
+                                     "created": int(time.time()),
+                                     "codec": self.codec,
+                                     "byteorder": sys.byteorder,
+                                     "tables": self.tables}).encode()
+                export_file.write(footer)
+                export_file.write(struct.pack("<Q", len(footer)))
+                export_file.write(EXPORT_MAGIC)
+                self.bytes_out += len(footer) + 8 + len(EXPORT_MAGIC)
+        except (IOError, OSError, OverflowError, struct.error,
+                self.db_reader.error_class) as e:
+            print ("The columnar export %s could not be written: %s"
+                   % (self.export_filename, e))
+            return False
+        self.elapsed_time = time.time() - start_time
+        return True
+
+    def get_throughput_text(self):
+        return "Exported %d rows of %d tables to %.1f MB in %.1f s" \
+               % (sum(table["rows"] for table in self.tables),
+                  len(self.tables), self.bytes_out / (1024.0 * 1024.0),
+                  self.elapsed_time)
+
+
+class ColumnarExportReader:
+    """
+    Read a ColumnarExporter file without a database, as rows or as NumPy
+    arrays.
+    """
+
+    def __init__(self, export_filename):
+        self.export_file = open(export_filename, "rb")
+        trailer_size = 8 + len(EXPORT_MAGIC)
+        self.export_file.seek(-trailer_size, os.SEEK_END)
+        trailer = self.export_file.read(trailer_size)
+        if trailer[8:] != EXPORT_MAGIC:
+            self.export_file.close()
+            raise ValueError("%s is not a columnar export" % export_filename)
+        footer_size = struct.unpack("<Q", trailer[:8])[0]
+        self.export_file.seek(-trailer_size - footer_size, os.SEEK_END)
+        self.footer = json.loads(
+            self.export_file.read(footer_size).decode())
+        self.codec = self.footer["codec"]
+        self.tables = collections.OrderedDict(
+            (table["name"], table) for table in self.footer["tables"])
+
+    def close(self):
+        self.export_file.close()
+
+    def get_table_names(self):
+        return list(self.tables.keys())
+
+    def get_column_names(self, table_name):
+        return self.tables[table_name]["columns"]
+
+    def get_row_count(self, table_name):
+        return self.tables[table_name]["rows"]
+
+    def read_column_data(self, column, row_count):
+        """
+        :return: the null flags or None and the raw array of a column block
+        """
+        self.export_file.seek(column["offset"])
+        data = decompress_block(self.codec,
+                                self.export_file.read(column["size"]))
+        is_null = None
+        if column.get("nulls"):
+            is_null = data[:row_count]
+            data = data[row_count:]
+        if column["encoding"] in ("text", "bytes"):
+            return is_null, data
+        values = array.array(column["type"])
+        values.frombytes(data)
+        if self.footer["byteorder"] != sys.byteorder:
+            values.byteswap()
+        return is_null, values
+
+    def decode_column(self, column, row_count):
+        """
+        :return: the list of values of a column block
+        """
+        is_null, data = self.read_column_data(column, row_count)
+        if column["encoding"] in ("text", "bytes"):
+            lengths = array.array("I")
+            lengths.frombytes(data[:4 * row_count])
+            if self.footer["byteorder"] != sys.byteorder:
+                lengths.byteswap()
+            values = []
+            position = 4 * row_count
+            for length in lengths:
+                piece = data[position:position + length]
+                position += length
+                if column["encoding"] == "text":
+                    piece = piece.decode("utf-8")
+                values.append(piece)
+        elif column["encoding"] == "delta":
+            values = list(itertools.accumulate(
+                itertools.chain([column["first"]], data)))
+        else:
+            values = data.tolist()
+        if is_null is not None:
+            values = [None if null_flag else value
+                      for value, null_flag in zip(values, bytearray(is_null))]
+        return values
+
+    def iter_rows(self, table_name):
+        """
+        Generate the rows of a table as tuples, one block at a time.
+        """
+        for block in self.tables[table_name]["blocks"]:
+            columns = [self.decode_column(column, block["rows"])
+                       for column in block["columns"]]
+            for row in zip(*columns):
+                yield row
+
+    def read_arrays(self, table_name):
+        """
+        Read every column of a table as a NumPy array. Integer columns with
+        NULLs become float arrays with nan, text columns object arrays.
+        :return: a dict of column name to array
+        """
+        table = self.tables[table_name]
+        column_parts = [[] for column_name in table["columns"]]
+        for block in table["blocks"]:
+            for parts, column in zip(column_parts, block["columns"]):
+                if column["encoding"] in ("text", "bytes"):
+                    parts.append(numpy.array(
+                        self.decode_column(column, block["rows"]),
+                        dtype=object))
+                    continue
+                is_null, values = self.read_column_data(column,
+                                                        block["rows"])
+                part = numpy.frombuffer(values, dtype=values.typecode)
+                if column["encoding"] == "delta":
+                    part = numpy.cumsum(numpy.concatenate(
+                        [[column["first"]], part.astype(numpy.int64)]))
+                if is_null is not None:
+                    part = part.astype(numpy.float64)
+                    part[numpy.frombuffer(is_null, dtype=numpy.uint8)
+                         .astype(bool)] = numpy.nan
+                parts.append(part)
+        arrays = collections.OrderedDict()
+        for column_name, parts in zip(table["columns"], column_parts):
+            arrays[column_name] = numpy.concatenate(parts) if parts \
+                else numpy.zeros(0)
+        return arrays
+
+
+class ReportMatrix:
+    """
+    All values of a report in one array of integers with a small header.
+    Each row is one (period type, user, status, period) and holds the
+    sample counts of the ReportValues keys. The rows are kept in the order
+    of the csv report, months before weeks, students before teachers,
+    active before all and the newest period first, so the writers stream
+    them without sorting. A row that was never set is left out.
+    """
+    PERIOD_TYPES = ("Month", "Week")
+    GROUPS = (("Student", "Active"), ("Student", "All"), ("Teacher", "Active"),
+              ("Teacher", "All"))
+
+    def __init__(self, max_count, periods):
+        """
+
+        :param periods: a dict of period type to its TimePeriods in time
+            order
+        """
+        self.max_count = max_count
+        self.value_keys = list(range(1, max_count + 1)) + [
+            "> Count", "On Hours", "User Hours", "Active Hours"]
+        self.width = len(self.value_keys)
+        self.period_types = [period_type for period_type in self.PERIOD_TYPES
+                             if periods.get(period_type)] + sorted(
+            period_type for period_type in periods
+            if period_type not in self.PERIOD_TYPES and periods[period_type])
+        self.periods = dict((period_type, list(periods[period_type]))
+                            for period_type in self.period_types)
+        self.row_offsets = {}
+        row_count = 0
+        for period_type in self.period_types:
+            self.row_offsets[period_type] = row_count
+            row_count += len(self.GROUPS) * len(self.periods[period_type])
+        self.row_count = row_count
+        self.values = array.array("q", bytes(8 * row_count * self.width))
+        self.row_set = bytearray(row_count)
+
+    @classmethod
+    def from_reporter_dict(cls, reporter_dict):
+        """
+        :return: a ReportMatrix of the values of a reporter_dict
+        :raises ValueError: if the reporters have different max counts
+        """
+        periods = {}
+        max_counts = set()
+        for key, reporter in reporter_dict.items():
+            periods.setdefault(key[0], {})[key[3].get_period_start()] = key[3]
+            max_counts.add(reporter.max_count)
+        if len(max_counts) > 1:
+            raise ValueError("the reporters have the max counts %s"
+                             % ", ".join(str(max_count) for max_count in
+                                         sorted(max_counts)))
+        max_count = max_counts.pop() if max_counts else 0
+        report_matrix = cls(max_count, dict(
+            (period_type, [type_periods[start_time] for start_time in
+                           sorted(type_periods)])
+            for period_type, type_periods in periods.items()))
+        period_indexes = dict(
+            (period_type, dict((time_period.get_period_start(), index)
+                               for index, time_period in enumerate(
+                                   report_matrix.periods[period_type])))
+            for period_type in report_matrix.period_types)
+        for key, reporter in reporter_dict.items():
+            report_matrix.set_values(
+                key[0], key[1], key[2],
+                period_indexes[key[0]][key[3].get_period_start()],
+                reporter.value_dict.values())
+        return report_matrix
+
+    def get_row_index(self, period_type, user_type, status, period_index):
+        period_count = len(self.periods[period_type])
+        return self.row_offsets[period_type] + \
+            self.GROUPS.index((user_type, status)) * period_count + \
+            period_count - 1 - period_index
+
+    def set_values(self, period_type, user_type, status, period_index,
+                   values):
+        """
+        :param values: the counts in the order of value_keys
+        """
+        row_index = self.get_row_index(period_type, user_type, status,
+                                       period_index)
+        offset = row_index * self.width
+        self.values[offset:offset + self.width] = array.array("q", values)
+        self.row_set[row_index] = 1
+
+    def get_values(self, period_type, user_type, status, period_index):
+        offset = self.get_row_index(period_type, user_type, status,
+                                    period_index) * self.width
+        return self.values[offset:offset + self.width]
+
+    def iter_rows(self):
+        """
+        Generate the rows that are set in report order.
+        :return: a generator of (period type, user, status, TimePeriod,
+            the counts as an array)
+        """
+        for period_type in self.period_types:
+            periods = self.periods[period_type]
+            row_index = self.row_offsets[period_type]
+            for user_type, status in self.GROUPS:
+                for time_period in reversed(periods):
+                    if self.row_set[row_index]:
+                        offset = row_index * self.width
+                        yield period_type, user_type, status, time_period, \
+                            self.values[offset:offset + self.width]
+                    row_index += 1
+
+    def iter_csv_rows(self):
+        """
+        Generate the rows of the csv report, the header row first. The
+        counts are shown in hours.
+        :return: a generator of row lists
+        """
+        yield ["Period Type", "User", "Status", "Start Time"] + \
+            [str(value_key) for value_key in self.value_keys]
+        # the same counts and dates come back in every group
+        hours = {}
+        dates = {}
+        for period_type, user_type, status, time_period, values in \
+                self.iter_rows():
+            start_time = time_period.get_period_start()
+            date = dates.get(start_time)
+            if date is None:
+                date = dates[start_time] = datetime.datetime.fromtimestamp(
+                    start_time).strftime("%m/%d/%y")
+            row_values = [period_type, user_type, status, date]
+            for value in values:
+                value_hours = hours.get(value)
+                if value_hours is None:
+                    value_hours = hours[value] = float("%3.2f"
+                                                       % (value / 60.0))
+                row_values.append(value_hours)
+            yield row_values
+
+    def write_csv(self, out_file):
+        writer = csv.writer(out_file)
+        for row_values in self.iter_csv_rows():
+            writer.writerow(row_values)
+
+    def write_json(self, out_file, school_name=""):
+        """
+        Write the report as json one row at a time. The rows are lists
+        in the order of "columns" as in the csv report.
+        """
+        rows = self.iter_csv_rows()
+        out_file.write('{"school": %s, "max_count": %d, "columns": %s, '
+                       '"rows": [' % (json.dumps(school_name),
+                                      self.max_count,
+                                      json.dumps(next(rows))))
+        separator = "\n"
+        for row_values in rows:
+            out_file.write(separator)
+            out_file.write(json.dumps(row_values))
+            separator = ",\n"
+        out_file.write("]}\n")
+
+
+class QuickEstimator:
+    """
+    Estimate the report values from a stratified random sample of
+    SummaryData. Each period is cut into SAMPLE_TIME slots and the slots
+    into equal strata, a few slots of each stratum are read with one
+    indexed query per period, and every value is estimated from the rows
+    in the sampled slots with a 95% confidence interval. Since the slots
+    cover the period the estimates are unbiased. The interval of a count
+    is never narrower than the Wilson score interval of its share of the
+    slots, which keeps rare buckets that were missed by the sample from
+    showing a zero margin. Periods with fewer slots
+    than the sample and downsampled periods are read exactly. Months come
+    first, then the weeks newest first, and the periods that are not
+    done within the time budget are left out. The time is checked before
+    every query and no query reads more than QUICK_READ_RANGES slot
+    ranges or one period of hours, so the budget is only overrun by one
+    small query.
+    """
+    COLUMN_NAMES = DailyRollup.COLUMN_NAMES
+    Z_VALUE = 1.96
+
+    def __init__(self, db_reader, time_finder, max_count=20,
+                 samples=QUICK_SAMPLES, time_budget=QUICK_TIME_BUDGET,
+                 seed=None):
+        self.db_reader = db_reader
+        self.time_finder = time_finder
+        self.max_count = max_count
+        self.samples = samples
+        self.time_budget = time_budget
+        self.random = random.Random(seed)
+        periods = {"Month": time_finder.get_months(),
+                   "Week": time_finder.get_weeks()}
+        self.estimates = ReportMatrix(max_count, periods)
+        self.margins = ReportMatrix(max_count, periods)
+        self.sampled_count = 0
+        self.exact_count = 0
+        self.skipped_count = 0
+        self.elapsed_time = 0.0
+        self.deadline = None
+
+    def choose_slots(self, slot_count):
+        """
+        :return: a list of (stratum slot count, sampled slot indexes)
+        """
+        strata_count = max(1, min(self.samples // QUICK_STRATUM_SAMPLES,
+                                  slot_count))
+        strata = []
+        for stratum in range(strata_count):
+            first_slot = stratum * slot_count // strata_count
+            stop_slot = (stratum + 1) * slot_count // strata_count
+            strata.append((stop_slot - first_slot, self.random.sample(
+                range(first_slot, stop_slot),
+                min(QUICK_STRATUM_SAMPLES, stop_slot - first_slot))))
+        return strata
+
+    def read_slots(self, start_time, stop_time, slot_indexes):
+        """
+        Read the rows of the slots with queries of at most
+        QUICK_READ_RANGES index ranges.
+        :return: a dict of slot index to the list of its rows or None if
+            the time was up
+        """
+        ranges = []
+        for slot_index in sorted(slot_indexes):
+            range_start = start_time + slot_index * SAMPLE_TIME
+            range_stop = min(range_start + SAMPLE_TIME, stop_time + 1)
+            if ranges and ranges[-1][1] == range_start:
+                ranges[-1][1] = range_stop
+            else:
+                ranges.append([range_start, range_stop])
+        slot_rows = dict((slot_index, []) for slot_index in slot_indexes)
+        for first_range in range(0, len(ranges), QUICK_READ_RANGES):
+            if time.time() >= self.deadline:
+                return None
+            read_ranges = ranges[first_range:first_range + QUICK_READ_RANGES]
+            query = "SELECT Time, %s FROM SummaryData WHERE %s" \
+                    % (", ".join(self.COLUMN_NAMES), " OR ".join(
+                        ["(Time >= %s AND Time < %s)"] * len(read_ranges)))
+            for row in self.db_reader.fetch_all(
+                    query, [bound for time_range in read_ranges
+                            for bound in time_range]):
+                slot_rows[(int(row[0]) - start_time) //
+                          SAMPLE_TIME].append(row)
+        return slot_rows
+
+    def get_slot_values(self, rows, column_index):
+        """
+        :return: the contribution of the rows of one slot to each value of
+            the value_dict in order
+        """
+        slot_values = [0] * (self.max_count + 4)
+        for row in rows:
+            value = row[column_index + 1]
+            slot_values[-3] += 1
+            if value is None or value < 1:
+                continue
+            slot_values[min(value, self.max_count + 1) - 1] += 1
+            slot_values[-2] += value
+            slot_values[-1] += 1
+        return slot_values
+
+    def estimate_period(self, time_period):
+        """
+        :return: a list per column of the (estimates, margins) of the
+            values of the period or None if the time was up
+        """
+        start_time = int(time_period.get_period_start())
+        stop_time = int(time_period.get_period_end())
+        slot_count = (stop_time - start_time) // SAMPLE_TIME + 1
+        strata = self.choose_slots(slot_count)
+        slot_rows = self.read_slots(
+            start_time, stop_time,
+            [slot_index for stratum_size, slot_indexes in strata
+             for slot_index in slot_indexes])
+        if slot_rows is None:
+            return None
+        width = self.max_count + 4
+        sample_count_total = len(slot_rows)
+        results = []
+        for column_index in range(len(self.COLUMN_NAMES)):
+            estimates = [0.0] * width
+            variances = [0.0] * width
+            for stratum_size, slot_indexes in strata:
+                sample_count = len(slot_indexes)
+                slot_values = [self.get_slot_values(slot_rows[slot_index],
+                                                    column_index)
+                               for slot_index in slot_indexes]
+                for index in range(width):
+                    values = [values[index] for values in slot_values]
+                    mean = float(sum(values)) / sample_count
+                    estimates[index] += stratum_size * mean
+                    if 1 < sample_count < stratum_size:
+                        variance = sum((value - mean) ** 2
+                                       for value in values) / \
+                            (sample_count - 1)
+                        variances[index] += \
+                            stratum_size ** 2 * variance / sample_count * \
+                            (1.0 - float(sample_count) / stratum_size)
+            margins = [self.Z_VALUE * math.sqrt(variance)
+                       for variance in variances]
+            for index in range(width):
+                if self.estimates.value_keys[index] != "User Hours":
+                    margins[index] = max(margins[index], self.get_score_margin(
+                        estimates[index], slot_count, sample_count_total))
+            results.append(([int(round(estimate)) for estimate in estimates],
+                            [int(math.ceil(margin)) for margin in margins]))
+        return results
+
+    def get_score_margin(self, estimate, slot_count, sample_count):
+        """
+        :return: the larger half of the Wilson score interval of a count
+            of estimate in slot_count slots from sample_count sampled slots
+        """
+        if sample_count >= slot_count:
+            return 0.0
+        share = min(max(estimate / slot_count, 0.0), 1.0)
+        z_squared = self.Z_VALUE ** 2
+        center = (share + z_squared / (2 * sample_count)) / \
+            (1 + z_squared / sample_count)
+        half_width = self.Z_VALUE * math.sqrt(
+            share * (1 - share) / sample_count +
+            z_squared / (4 * sample_count ** 2)) / \
+            (1 + z_squared / sample_count)
+        return slot_count * max(center + half_width - share,
+                                share - (center - half_width)) * \
+            math.sqrt(1.0 - float(sample_count) / slot_count)
+
+    def fill_period_exactly(self, period_type, period_index, time_period):
+        """
+        :return: False if the time was up before the period was read
+        """
+        reporters = []
+        for user_type in ("Teacher", "Student"):
+            for status in ("All", "Active"):
+                if time.time() >= self.deadline:
+                    return False
+                reporter = ReportValues(self.db_reader, user_type, status,
+                                        time_period, self.max_count,
+                                        self.time_finder.downsampled_before)
+                reporter.fill_array_from_database()
+                reporters.append((user_type, status, reporter))
+        for user_type, status, reporter in reporters:
+            self.estimates.set_values(period_type, user_type, status,
+                                      period_index,
+                                      reporter.value_dict.values())
+            self.margins.set_values(period_type, user_type, status,
+                                    period_index, [0] * self.estimates.width)
+        return True
+
+    def run(self):
+        """
+        Estimate the periods until they are done or the time is up.
+        :return: the number of periods that were estimated or read
+        """
+        start_time = time.time()
+        self.deadline = start_time + self.time_budget
+        downsampled_before = self.time_finder.downsampled_before
+        work = []
+        for period_type in self.estimates.period_types:
+            periods = self.estimates.periods[period_type]
+            work.extend((period_type, period_index, periods[period_index])
+                        for period_index in reversed(range(len(periods))))
+        for work_index, (period_type, period_index, time_period) in \
+                enumerate(work):
+            slot_count = (time_period.get_period_end() -
+                          time_period.get_period_start()) // SAMPLE_TIME + 1
+            if slot_count <= self.samples or (
+                    downsampled_before is not None and
+                    time_period.get_period_start() < downsampled_before):
+                if not self.fill_period_exactly(period_type, period_index,
+                                                time_period):
+                    self.skipped_count = len(work) - work_index
+                    break
+                self.exact_count += 1
+                continue
+            results = self.estimate_period(time_period)
+            if results is None:
+                self.skipped_count = len(work) - work_index
+                break
+            for column_name, (estimates, margins) in zip(
+                    self.COLUMN_NAMES, results):
+                user_type = column_name.replace("Active", "").replace(
+                    "Count", "")
+                status = "Active" if column_name.startswith("Active") \
+                    else "All"
+                self.estimates.set_values(period_type, user_type, status,
+                                          period_index, estimates)
+                self.margins.set_values(period_type, user_type, status,
+                                        period_index, margins)
+            self.sampled_count += 1
+        self.elapsed_time = time.time() - start_time
+        return self.sampled_count + self.exact_count
+
+    def iter_csv_rows(self):
+        """
+        Generate the rows of the preview csv with the margin of each value
+        in hours in the column after it, the header row first.
+        :return: a generator of row lists
+        """
+        estimate_rows = self.estimates.iter_csv_rows()
+        margin_rows = self.margins.iter_csv_rows()
+        row_header = next(estimate_rows)
+        next(margin_rows)
+        yield row_header[:4] + [name for value_key in row_header[4:]
+                                for name in (value_key, value_key + " +-")]
+        for estimate_row, margin_row in zip(estimate_rows, margin_rows):
+            yield estimate_row[:4] + [
+                value for values in zip(estimate_row[4:], margin_row[4:])
+                for value in values]
+
+    def write_csv_file(self, csv_filename):
+
+        outfile = open(csv_filename, "w")
+        writer = csv.writer(outfile)
+        for row_values in self.iter_csv_rows():
+            writer.writerow(row_values)
+        outfile.close()
+
+    def print_summary(self):
+        """
+        Print the estimated student hours of each month.
+        """
+        print ("Quick preview of %d periods in %.1f s (%d sampled, %d exact"
+               "%s), student hours with 95%% intervals:"
+               % (self.sampled_count + self.exact_count, self.elapsed_time,
+                  self.sampled_count, self.exact_count,
+                  ", %d not reached" % self.skipped_count
+                  if self.skipped_count else ""))
+        value_indexes = [self.estimates.value_keys.index(value_key)
+                         for value_key in ("On Hours", "Active Hours",
+                                           "User Hours")]
+        for (period_type, user_type, status, time_period, estimates), \
+                (margin_period_type, margin_user_type, margin_status,
+                 margin_period, margins) in zip(self.estimates.iter_rows(),
+                                                self.margins.iter_rows()):
+            if period_type != "Month" or user_type != "Student" or \
+                    status != "All":
+                continue
+            print ("  %s  " % datetime.date.fromtimestamp(
+                time_period.get_period_start()).strftime("%m/%d/%y") +
+                   ", ".join("%s %.1f +- %.1f" % (
+                       self.estimates.value_keys[index],
+                       estimates[index] / 60.0, margins[index] / 60.0)
+                             for index in value_indexes))
+
+
+class ResultGenerator:
+    """
+    Dump the database as a file, generate a csv file from the roport data,
+    and save bot as a compressed tar file.
+    """
+
+    def __init__(self, report_data, school_name, upper_dir_name="./",
+                 codec="bz2", workers=1, delta_end_time=None,
+                 db_reader=None, profiler=None, heatmap=None,
+                 dump_mode="stream", dump_workers=1, json_report=False):
+        """
+
+        :param report_data: a ReportMatrix or a reporter_dict
+        :param school_name:
+        :param codec: the compression for the archive, "bz2", "xz" or "zstd"
+        :param workers: the number of processes that compress the dump
+        :param delta_end_time: if set only dump the SummaryData rows up to
+            this time that are newer than the previous delta dump
+        :param db_reader: needed only for databases that are not dumped
+            with mysqldump
+        :param profiler: a Profiler to time the stages and add its summary
+            to the results
+        :param heatmap: a UsageHeatmap to write as a second csv file
+        :param dump_mode: "stream" for a single mysqldump streamed into the
+            compressed archive, "parallel" for a ParallelDumper directory
+            of compressed chunks or "columnar" for a ColumnarExporter file,
+            both in an uncompressed tar archive
+        :param dump_workers: the number of worker processes of the
+            parallel dump
+        :param json_report: also write the report as a json file
+        """
+        self.school_name = school_name
+        self.db_reader = db_reader
+        self.profiler = profiler
+        self.profile_filename = ""
+        self.heatmap = heatmap
+        self.heatmap_filename = ""
+        self.dump_mode = dump_mode
+        self.dump_workers = dump_workers
+        self.dump_dirname = ""
+        self.export_filename = ""
+        self.codec = codec
+        self.workers = workers
+        self.delta_end_time = delta_end_time
+        self.delta_start_time = None
+        self.delta_sequence = 0
+        self.dump_error = None
+        self.delta_state_filename = os.path.join(
+            upper_dir_name, "SystemMonitor_delta_state.json")
+        self.manifest_filename = ""
+        if not isinstance(report_data, ReportMatrix):
+            report_data = ReportMatrix.from_reporter_dict(report_data)
+        self.report_matrix = report_data
+        self.json_report = json_report
+        self.json_filename = ""
+        self.upper_dirname = upper_dir_name
+        self.dirname = ""
+        self.file_name_base = ""
+        self.result_dirname = ""
+        self.report_filename = ""
+        self.dump_filename = ""
+        self.tar_filename = ""
+        self.temp_path_tar_filename = ""
+        self.final_path_tar_filename = ""
+
+    def generate_names(self):
+        """
+        Gnerate all filenames and directories from the schoolname and date
+        :return:
+        """
+        time_suffix = time.strftime("%m_%d_%y", time.localtime())
+        base_name =self.school_name.title().replace(" ", "")
+        self.file_name_base = base_name + "_" + time_suffix
+        self.result_dirname = self.file_name_base + "_dir"
+        self.dirname = self.upper_dirname + "/" + self.result_dirname
+        self.report_filename = self.dirname + "/" + self.file_name_base + ".csv"
+        self.dump_filename = self.dirname + "/" + self.file_name_base + ".sql"
+        self.heatmap_filename = \
+            self.dirname + "/" + self.file_name_base + "_heatmap.csv"
+        self.json_filename = self.dirname + "/" + self.file_name_base + ".json"
+        self.manifest_filename = \
+            self.dirname + "/" + self.file_name_base + ".manifest.json"
+        self.profile_filename = \
+            self.dirname + "/" + self.file_name_base + ".profile.txt"
+        self.dump_dirname = self.dirname + "/" + self.file_name_base + "_dump"
+        self.tar_filename = self.file_name_base + ARCHIVE_SUFFIXES[self.codec]
+        self.export_filename = \
+            self.dirname + "/" + self.file_name_base + EXPORT_SUFFIX
+        if self.dump_mode in ("parallel", "columnar"):
+            # the dump chunks or columns are compressed already
+            self.tar_filename = self.file_name_base + ".tar"
+        self.temp_path_tar_filename = "./" + self.tar_filename
+        self.final_path_tar_filename = self.dirname + "/" + self.tar_filename
+
+    def make_result_directory(self):
+        """
+        If the directory already exists, remove it and its contents.
+        Then create the directory
+        :return:
+        """
+        if os.path.exists(self.dirname):
+            try:
+                shutil.rmtree(self.dirname)
+            except OSError as e:
+                print ("Could not remove the old directory: %s" % e)
+        try:
+            os.mkdir(self.dirname)
+        except OSError:
+            print ("""
+Error:
+    Could not create the directory "%s" in
+        "%s" for the results.
+    Please try using the option "--storagedir"
+      on the command line -- maybe the /media directory that is your
+      thumbdrive.
+    If you have used the --storagedir option check the spelling
+      of the directory.
+    If nothing else works you can also rerun this program with a sudo.
+            """ % (self.result_dirname, self.upper_dirname))
+            sys.exit(-1)
+
+    def dump_database(self):
+        """
+        Dump the complete SystemMontor database into file "filename".
+        This is a text file and could be quite large. This why it is dumped
+        to an external file.
+        :return output from the mysqldump command:
+        """
+        try:
+            output = subprocess.check_output(DUMP_COMMAND, shell=True,
+                                             universal_newlines=True,
+                                             stderr=open(os.devnull, 'wb'))
+        except subprocess.CalledProcessError as e:
+            print ("""
+Error:
+    There was an error while doing the database dump.
+    The error reported is:  "%s"
+    The databse dump file may not be usable but the report probably is.
+    """ % e)
+            return "Error in dump: %s" % e
+        return output
+
+    def write_database_dump_file(self):
+        """
+        Create a file with the complete dump ot the sql SysetmMonitor tables.
+        Prepend the requied atart sql commnad to make it directly loadable
+        :return:
+        """
+        dump = self.dump_database()
+        dump_file = open(self.dump_filename, "w")
+        dump_file.write("USE SystemMonitor;\n")
+        dump_file.write(dump)
+        dump_file.close()
+
+    def iter_report_rows(self):
+        """
+        Generate the rows of the csv report, the header row first.
+        :return: a generator of row lists
+        """
+        return self.report_matrix.iter_csv_rows()
+
+    def get_report_text(self):
+        """
+        :return: the csv report as a string
+        """
+        report_file = io.StringIO()
+        self.report_matrix.write_csv(report_file)
+        return report_file.getvalue()
+
+    def write_report_file(self, report_filename):
+
+        outfile = open(report_filename, "w")
+        self.report_matrix.write_csv(outfile)
+        outfile.close()
+
+    def write_json_file(self, json_filename):
+
+        outfile = open(json_filename, "w")
+        self.report_matrix.write_json(outfile, self.school_name)
+        outfile.close()
+
+    def write_heatmap_file(self, heatmap_filename):
+
+        outfile = open(heatmap_filename, "w")
+        writer = csv.writer(outfile)
+        for row_values in self.heatmap.iter_report_rows():
+            writer.writerow(row_values)
+        outfile.close()
+
+    def prepare_for_sending(self):
+        """
+        Use the compresson command to create a single compressed file to return
+        via email. The directory has been created and the report and dump files
+        have been written into it.
+        :return:
+        """
+        combine_command = "tar -cjf %s %s" % (self.temp_path_tar_filename,
+                                              os.path.basename(self.dirname))
+        try:
+            # shange directory so no extra path elements in the tar file
+            os.chdir(self.upper_dirname)
+            output = subprocess.check_output(combine_command, shell=True,
+                                             universal_newlines=True,
+                                             stderr=subprocess.STDOUT)
+            # now move the compressed file into the directory also
+            shutil.move(self.temp_path_tar_filename,
+                        self.final_path_tar_filename)
+            # remove the .sql file
+            os.remove(self.dump_filename)
+        except subprocess.CalledProcessError as e:
+            print ("There was an error while doing the database dump: %s" % e)
+            return False
+        return True
+
+    def stream_database_dump(self):
+        """
+        Run mysqldump and yield its output in pieces of DUMP_CHUNK_SIZE bytes
+        so that the dump is never held in memory. The first piece is the
+        "USE SystemMonitor" line that makes the dump directly loadable.
+        :return: a generator of bytes
+        """
+        if self.db_reader is not None:
+            statements = self.db_reader.iter_dump()
+            if statements is not None:
+                try:
+                    for chunk in chunk_dump_statements(statements):
+                        yield chunk
+                except self.db_reader.error_class as e:
+                    self.dump_error = e
+                    print ("There was an error while doing the database "
+                           "dump: %s" % e)
+                    yield ("Error in dump: %s" % e).encode()
+                return
+        yield b"USE SystemMonitor;\n"
+        for dump_command in self.get_dump_commands():
+            for chunk in self.stream_command_output(dump_command):
+                yield chunk
+
+    def get_dump_commands(self):
+        """
+        The complete dump is a single mysqldump. A delta dump has all the
+        other tables in full followed by only the SummaryData rows recorded
+        since the previous delta.
+        :return: a list of the mysqldump commands
+        """
+        if self.delta_end_time is None:
+            return [DUMP_COMMAND]
+        other_tables = "--ignore-table=SystemMonitor.SummaryData "
+        if self.delta_start_time is None:
+            return [DUMP_COMMAND + other_tables,
+                    DELTA_DUMP_COMMAND + '--where="Time <= %d" '
+                    % self.delta_end_time + "SystemMonitor SummaryData"]
+        return [DELTA_DUMP_COMMAND + "SystemMonitor " + other_tables,
+                DELTA_DUMP_COMMAND + "--no-create-info --insert-ignore "
+                '--where="Time > %d AND Time <= %d" '
+                % (self.delta_start_time, self.delta_end_time)
+                + "SystemMonitor SummaryData"]
+
+    def stream_command_output(self, dump_command):
+        try:
+            process = subprocess.Popen(dump_command, shell=True,
+                                       stdout=subprocess.PIPE,
+                                       stderr=open(os.devnull, 'wb'))
+        except OSError as e:
+            error = e
+        else:
+            while True:
+                chunk = process.stdout.read(DUMP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            process.stdout.close()
+            return_code = process.wait()
+            if not return_code:
+                return
+            error = subprocess.CalledProcessError(return_code, dump_command)
+        self.dump_error = error
+        print ("""
+Error:
+    There was an error while doing the database dump.
+    The error reported is:  "%s"
+    The databse dump file may not be usable but the report probably is.
+    """ % error)
+        yield ("Error in dump: %s" % error).encode()
+
+    def get_delta_database_id(self):
+        """
+        :return: the id of the dumped database as a json compatible list,
+            None if it is only dumped with mysqldump
+        """
+        if self.db_reader is None:
+            return None
+        return list(self.db_reader.get_database_id())
+
+    def read_delta_state(self):
+        """
+        Read the time of the last SummaryData row that was exported by the
+        previous delta dump from the state file in the storage directory.
+        A state of another school or database is ignored.
+        :return: the state dict, empty if there has been no delta dump
+        """
+        try:
+            with open(self.delta_state_filename, "r") as state_file:
+                state = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        if not isinstance(state, dict) or \
+                state.get("school") != self.school_name or \
+                state.get("database") != self.get_delta_database_id():
+            print ("The delta state in %s is from another school or database,"
+                   " a complete dump is made." % self.delta_state_filename)
+            return {}
+        return state
+
+    def set_delta_start(self):
+        """
+        Continue from the previous delta dump. A complete dump (sequence 0)
+        is made if there is none or if the database has no rows newer than
+        it, which happens when the database has been reset.
+        :return:
+        """
+        state = self.read_delta_state()
+        last_time = state.get("last_time")
+        if last_time is None:
+            return
+        if self.delta_end_time <= last_time:
+            print ("The database has no rows after the previous delta dump,"
+                   " a complete dump is made.")
+            return
+        self.delta_start_time = last_time
+        self.delta_sequence = state.get("sequence", 0) + 1
+
+    def write_delta_state(self):
+        temp_filename = self.delta_state_filename + ".tmp"
+        state = {"school": self.school_name,
+                 "database": self.get_delta_database_id(),
+                 "last_time": self.delta_end_time,
+                 "sequence": self.delta_sequence,
+                 "archive": self.tar_filename}
+        try:
+            with open(temp_filename, "w") as state_file:
+                json.dump(state, state_file, indent=2)
+            os.rename(temp_filename, self.delta_state_filename)
+        except (IOError, OSError) as e:
+            print ("The delta state file %s could not be written: %s"
+                   % (self.delta_state_filename, e))
+            return False
+        return True
+
+    def write_delta_manifest(self):
+        """
+        Describe the delta dump so that the receiving side can chain the
+        deltas of a school back into a full database. Sequence 0 is a
+        complete dump, each later delta follows the delta whose
+        "last_time" is this one's "previous_time".
+        :return:
+        """
+        manifest = {"format": "SystemMonitor delta dump",
+                    "version": 1,
+                    "school": self.school_name,
+                    "created": int(time.time()),
+                    "sequence": self.delta_sequence,
+                    "previous_time": self.delta_start_time,
+                    "last_time": self.delta_end_time,
+                    "complete": self.delta_start_time is None,
+                    "dump_file": os.path.basename(self.dump_filename),
+                    "load": "Load the complete dump (sequence 0) then each "
+                            "delta in sequence order with "
+                            "\"mysql < file.sql\". Only the SummaryData "
+                            "rows are incremental, the other tables are "
+                            "replaced by every delta."}
+        with open(self.manifest_filename, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+    def new_tar_info(self, arcname, size=0, is_dir=False):
+        tar_info = tarfile.TarInfo(arcname)
+        tar_info.mtime = int(time.time())
+        tar_info.uid = os.getuid()
+        tar_info.gid = os.getgid()
+        if is_dir:
+            tar_info.type = tarfile.DIRTYPE
+            tar_info.mode = 0o755
+        else:
+            tar_info.mode = 0o644
+            tar_info.size = size
+        return tar_info
+
+    def write_directory_result_files(self):
+        """
+        Dump the database into the result directory with a ParallelDumper
+        or a ColumnarExporter and then write the directory as the archive.
+        :return: True if the dump and the archive were written
+        """
+        if self.dump_mode == "columnar":
+            dumper = ColumnarExporter(self.db_reader, self.export_filename,
+                                      self.codec)
+        else:
+            dumper = ParallelDumper(self.db_reader, self.dump_dirname,
+                                    self.codec, self.dump_workers)
+        with profile_stage(self.profiler, "dump_database"):
+            dump_successful = dumper.dump()
+        print (dumper.get_throughput_text())
+        if self.profiler is not None:
+            self.profiler.add_note(dumper.get_throughput_text())
+            self.profiler.write_summary(self.profile_filename)
+        with profile_stage(self.profiler, "write_result_archive"):
+            successful = self.write_directory_archive()
+        return dump_successful and successful
+
+    def write_directory_archive(self):
+        """
+        Write the result directory into an uncompressed tar file inside it.
+        :return: True if the archive was written
+        """
+        dir_arcname = os.path.basename(self.dirname)
+        archive_arcname = dir_arcname + "/" + self.tar_filename
+
+        def leave_out_archive(tar_info):
+            if tar_info.name == archive_arcname:
+                return None
+            return tar_info
+
+        try:
+            with tarfile.open(self.final_path_tar_filename, "w",
+                              format=tarfile.GNU_FORMAT) as tar_file:
+                tar_file.add(self.dirname, dir_arcname,
+                             filter=leave_out_archive)
+        except (IOError, OSError, tarfile.TarError) as e:
+            print ("There was an error while writing the result file: %s"
+                   % e)
+            return False
+        return True
+
+    def write_result_archive(self):
+        """
+        Write the archive file with the result directory, the csv report and
+        the sql dump without ever writing the uncompressed dump to disk.
+        A tar header must contain the size of the file so the dump is first
+        compressed into a spool file while its size is counted. The archive
+        is then written as the compressed headers and report followed by
+        the spooled dump. Concatenated compressed streams decompress as one
+        tar file with the same layout that "tar -cjf" produced.
+        :return: True if the archive was written
+        """
+        dir_arcname = os.path.basename(self.dirname)
+        try:
+            with tempfile.TemporaryFile(dir=self.dirname) as dump_spool:
+                compressor = ParallelCompressor(dump_spool, self.codec,
+                                                self.workers)
+                dump_size = 0
+                try:
+                    with profile_stage(self.profiler, "dump_database"):
+                        for chunk in self.stream_database_dump():
+                            dump_size += len(chunk)
+                            compressor.write(chunk)
+                    header = self.new_tar_info(
+                        dir_arcname, is_dir=True).tobuf(tarfile.GNU_FORMAT)
+                    small_filenames = [self.report_filename]
+                    if self.heatmap is not None:
+                        small_filenames.append(self.heatmap_filename)
+                    if self.json_report:
+                        small_filenames.append(self.json_filename)
+                    if self.delta_end_time is not None:
+                        small_filenames.append(self.manifest_filename)
+                    for filename in small_filenames:
+                        with open(filename, "rb") as small_file:
+                            contents = small_file.read()
+                        header += self.new_tar_info(
+                            dir_arcname + "/" + os.path.basename(filename),
+                            len(contents)).tobuf(tarfile.GNU_FORMAT)
+                        header += contents + tar_padding(len(contents))
+                    header += self.new_tar_info(
+                        dir_arcname + "/" + os.path.basename(
+                            self.dump_filename),
+                        dump_size).tobuf(tarfile.GNU_FORMAT)
+                    # finish the dump member and the archive
+                    archive_size = len(header) + dump_size
+                    trailer = tar_padding(dump_size)
+                    if self.profiler is not None:
+                        # the profile goes last so it includes the dump
+                        compressor.flush()
+                        self.profiler.add_counter("dump_bytes", dump_size)
+                        self.profiler.add_counter("compressed_bytes",
+                                                  compressor.bytes_out)
+                        self.profiler.add_note(
+                            compressor.get_throughput_text())
+                        profile = self.profiler.get_summary_text().encode()
+                        trailer += self.new_tar_info(
+                            dir_arcname + "/" + os.path.basename(
+                                self.profile_filename),
+                            len(profile)).tobuf(tarfile.GNU_FORMAT)
+                        trailer += profile + tar_padding(len(profile))
+                    trailer += b"\0" * (2 * tarfile.BLOCKSIZE)
+                    archive_size += len(trailer)
+                    trailer += b"\0" * (-archive_size % tarfile.RECORDSIZE)
+                    compressor.write(trailer)
+                finally:
+                    compressor.close()
+                print (compressor.get_throughput_text())
+                dump_spool.seek(0)
+                with open(self.final_path_tar_filename, "wb") as tar_file:
+                    tar_file.write(compress_block(self.codec, header))
+                    shutil.copyfileobj(dump_spool, tar_file, DUMP_CHUNK_SIZE)
+        except (IOError, OSError) as e:
+            print ("There was an error while writing the result file: %s"
+                   % e)
+            return False
+        return True
+
+    def write_all_result_files(self):
+        """
+        The primary function for writing all result files.
+        It performs thes actions.
+        1. Create a directory for the results
+        2. Write a csv file that contaions the report results into the directory
+        3. Perform a database dump of the SystemMonitor database and stream
+            it as a sql dump file straight into a compressed tar file of the
+            directory.
+        4. Write the tar file into the directory to prepare for a simple copy
+            of all of the resutls in various forms that can be used to forward
+            the data.
+        :return:
+        """
+        self.generate_names()
+        with profile_stage(self.profiler, "make_result_directory"):
+            self.make_result_directory()
+        with profile_stage(self.profiler, "write_report_file"):
+            self.write_report_file(self.report_filename)
+        if self.heatmap is not None:
+            self.write_heatmap_file(self.heatmap_filename)
+        if self.json_report:
+            self.write_json_file(self.json_filename)
+        if self.dump_mode in ("parallel", "columnar"):
+            return self.write_directory_result_files()
+        if self.delta_end_time is not None:
+            self.set_delta_start()
+            self.write_delta_manifest()
+        with profile_stage(self.profiler, "write_result_archive"):
+            successful = self.write_result_archive()
+        if self.profiler is not None:
+            self.profiler.write_summary(self.profile_filename)
+        if successful and self.delta_end_time is not None:
+            if self.dump_error is None:
+                self.write_delta_state()
+            else:
+                # the next delta dumps these rows again
+                print ("The delta state is kept because the dump failed.")
+        return successful
+
+
+class SchoolHost:
+    """
+    The connection parameters for the SystemMonitor database of one school
+    server.
+    """
+
+    def __init__(self, school_name, host, user_name="root",
+                 password="mysqlAdmin", db_name="SystemMonitor", port=3306):
+        self.school_name = school_name
+        self.host = host
+        self.user_name = user_name
+        self.password = password
+        self.db_name = db_name
+        self.port = port
+
+
+def read_fleet_file(fleet_filename):
+    """
+    Read the list of school servers. Each line of the csv file is
+    "school name, host[:port], user, password, database" where everything
+    after the host may be left out to use the values of a school server.
+    Empty lines and lines starting with "#" are ignored.
+    :param fleet_filename:
+    :return: a list of SchoolHost objects
+    :raises ValueError: for a line without a host, a bad port or a school
+        name that is on an earlier line
+    """
+    school_hosts = []
+    school_names = set()
+    with open(fleet_filename, "r") as fleet_file:
+        for line_number, row in enumerate(csv.reader(fleet_file), 1):
+            row = [value.strip() for value in row]
+            if not row or not row[0] or row[0].startswith("#"):
+                continue
+            if len(row) < 2 or not row[1]:
+                raise ValueError("line %d of %s has no host"
+                                 % (line_number, fleet_filename))
+            if row[0] in school_names:
+                raise ValueError("line %d of %s repeats the school %s"
+                                 % (line_number, fleet_filename, row[0]))
+            host, _, port = row[1].partition(":")
+            params = dict(zip(("user_name", "password", "db_name"),
+                              [value for value in row[2:5] if value]))
+            if port:
+                if not port.isdigit():
+                    raise ValueError("line %d of %s has the bad port %s"
+                                     % (line_number, fleet_filename, port))
+                params["port"] = int(port)
+            school_names.add(row[0])
+            school_hosts.append(SchoolHost(row[0], host, **params))
+    return school_hosts
+
+
+class FleetReporter:
+    """
+    Run the report for many school servers at once from the head office.
+    Each school is read on its own thread with its own connection so a slow
+    or offline school only delays itself. A school that does not finish
+    within the timeout is reported as failed and left behind, and another
+    thread takes its place. The schools that are not done when every one
+    of them could have used the whole timeout are failed too, also the
+    ones that never started. The results are kept by school name, which
+    must be unique.
+    """
+
+    def __init__(self, school_hosts, num_months=60, max_user_count=20,
+                 engine="query", cache_dir=DEFAULT_CACHE_DIR, workers=8,
+                 timeout=600):
+        school_names = [school_host.school_name
+                        for school_host in school_hosts]
+        if len(set(school_names)) != len(school_names):
+            raise ValueError("the school names of a fleet must be unique")
+        self.school_hosts = school_hosts
+        self.num_months = num_months
+        self.max_user_count = max_user_count
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.timeout = timeout
+        self.results = {}
+        self.errors = {}
+        self.start_times = {}
+        self.run_times = {}
+        self.lock = threading.Lock()
+        self.work_queue = queue.Queue()
+        self.done_event = threading.Event()
+
+    def gather_school(self, school_host):
+        db_reader = DbReader(school_host.db_name, school_host.password,
+                             school_host.user_name, school_host.host,
+                             port=school_host.port,
+                             connect_timeout=self.timeout,
+                             exit_on_error=False)
+        time_finder = TimeFinder(db_reader, self.num_months, num_weeks=0)
+        data_gatherer = DataGatherer(
+            db_reader, time_finder, self.max_user_count, self.engine,
+            os.path.join(self.cache_dir,
+                         school_host.school_name.replace("/", "_")),
+            workers=1)
+        result, reporter_count = data_gatherer.create_value_objects()
+        if not reporter_count:
+            raise ValueError("there is no report data")
+        return result
+
+    def start_worker(self):
+        # daemon threads so a school that never answers can not keep the
+        # program from finishing
+        worker = threading.Thread(target=self.run_worker)
+        worker.daemon = True
+        worker.start()
+
+    def run_worker(self):
+        while True:
+            try:
+                school_host = self.work_queue.get_nowait()
+            except queue.Empty:
+                return
+            school_name = school_host.school_name
+            with self.lock:
+                self.start_times[school_name] = time.time()
+            try:
+                result = self.gather_school(school_host)
+                error = None
+            except Exception as e:
+                result = None
+                error = e
+            with self.lock:
+                self.run_times[school_name] = \
+                    time.time() - self.start_times[school_name]
+                if school_name not in self.errors:
+                    if error is None:
+                        self.results[school_name] = result
+                    else:
+                        self.errors[school_name] = str(error)
+                self.done_event.set()
+
+    def run(self):
+        """
+        Gather the reports of all schools.
+        :return: the dict of results by school name and the dict of errors
+        """
+        for school_host in self.school_hosts:
+            self.work_queue.put(school_host)
+        worker_count = max(min(self.workers, len(self.school_hosts)), 1)
+        for i in range(worker_count):
+            self.start_worker()
+        # one more timeout for the threads that replace the stuck ones
+        fleet_timeout = self.timeout * (
+            -(-len(self.school_hosts) // worker_count) + 1)
+        deadline = time.time() + fleet_timeout
+        while True:
+            with self.lock:
+                now = time.time()
+                for school_name, start_time in self.start_times.items():
+                    if school_name not in self.results and \
+                            school_name not in self.errors and \
+                            now - start_time > self.timeout:
+                        self.errors[school_name] = \
+                            "no answer after %d seconds" % self.timeout
+                        # the stuck thread keeps waiting for the school
+                        if not self.work_queue.empty():
+                            self.start_worker()
+                if now > deadline:
+                    while not self.work_queue.empty():
+                        try:
+                            self.work_queue.get_nowait()
+                        except queue.Empty:
+                            break
+                    for school_host in self.school_hosts:
+                        school_name = school_host.school_name
+                        if school_name not in self.results and \
+                                school_name not in self.errors:
+                            self.errors[school_name] = \
+                                "not done within the %d seconds of the " \
+                                "fleet run" % fleet_timeout
+                if len(self.results) + len(self.errors) >= \
+                        len(self.school_hosts):
+                    break
+                self.done_event.clear()
+            self.done_event.wait(1.0)
+        return self.results, self.errors
+
+    def write_combined_report(self, report_filename):
+        """
+        Write one csv file with the rows of every school that reported,
+        in the order of the fleet file, with the school name as the first
+        column.
+        :return: the number of schools in the file
+        """
+        school_count = 0
+        with open(report_filename, "w") as outfile:
+            writer = csv.writer(outfile)
+            for school_host in self.school_hosts:
+                result = self.results.get(school_host.school_name)
+                if not result:
+                    continue
+                rows = ResultGenerator(
+                    result, school_host.school_name).iter_report_rows()
+                row_header = next(rows)
+                if not school_count:
+                    writer.writerow(["School"] + row_header)
+                for row_values in rows:
+                    writer.writerow([school_host.school_name] + row_values)
+                school_count += 1
+        return school_count
+
+
+def run_fleet_report(fleet_filename, top_level_dir_name, num_months=60,
+                     max_user_count=20, engine="query",
+                     cache_dir=DEFAULT_CACHE_DIR, workers=8, timeout=600):
+    """
+    Create the combined csv report for all schools in the fleet file.
+    :return: True if every school reported
+    """
+    start_time = time.time()
+    try:
+        school_hosts = read_fleet_file(fleet_filename)
+    except (IOError, OSError, ValueError) as e:
+        print ("The fleet file could not be read: %s" % e)
+        return False
+    fleet_reporter = FleetReporter(school_hosts, num_months, max_user_count,
+                                   engine, cache_dir, workers, timeout)
+    results, errors = fleet_reporter.run()
+    report_filename = os.path.join(
+        top_level_dir_name,
+        "Fleet_%s.csv" % time.strftime("%m_%d_%y", time.localtime()))
+    school_count = fleet_reporter.write_combined_report(report_filename)
+    for school_host in fleet_reporter.school_hosts:
+        school_name = school_host.school_name
+        if school_name in errors:
+            print ("%s: failed, %s" % (school_name, errors[school_name]))
+        else:
+            print ("%s: %.1f seconds" % (
+                school_name, fleet_reporter.run_times.get(school_name, 0.0)))
+    print ("%d of %d schools are in %s after %.1f seconds"
+           % (school_count, len(fleet_reporter.school_hosts),
+              report_filename, time.time() - start_time))
+    return not errors
+
+
+class TimeRanges:
+    """
+    A set of closed time ranges kept merged and sorted so that a time is
+    looked up with a binary search.
+    """
+
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.stops = []
+        for start_time, stop_time in ranges:
+            self.add(start_time, stop_time)
+
+    def add(self, start_time, stop_time):
+        index = bisect.bisect_left(self.stops, start_time)
+        while index < len(self.starts) and self.starts[index] <= stop_time:
+            start_time = min(start_time, self.starts[index])
+            stop_time = max(stop_time, self.stops[index])
+            del self.starts[index]
+            del self.stops[index]
+        self.starts.insert(index, start_time)
+        self.stops.insert(index, stop_time)
+
+    def contains(self, sample_time):
+        index = bisect.bisect_right(self.starts, sample_time) - 1
+        return index >= 0 and sample_time <= self.stops[index]
+
+    def get_ranges(self):
+        return list(zip(self.starts, self.stops))
+
+
+ARCHIVE_NAME_PATTERN = re.compile(
+    r"^(?P<school>.+)_(?P<date>\d\d_\d\d_\d\d)\.(?:tbz|txz|tzst|tar)$")
+INSERT_PATTERN = re.compile(
+    r"^INSERT (?:IGNORE )?INTO [`\"]?(\w+)[`\"]?\s*(?:\(([^)]*)\))?"
+    r"\s*VALUES\s*(.*);\s*$", re.DOTALL)
+
+
+def parse_create_columns(statement):
+    """
+    :return: the column names of a CREATE TABLE statement in order
+    """
+    body = statement[statement.index("(") + 1:statement.rindex(")")]
+    column_names = []
+    depth = 0
+    part = []
+    for character in body + ",":
+        if character == "," and depth == 0:
+            words = "".join(part).split()
+            part = []
+            if words and words[0].upper() not in (
+                    "PRIMARY", "KEY", "UNIQUE", "CONSTRAINT", "INDEX",
+                    "FOREIGN", "CHECK", "FULLTEXT"):
+                column_names.append(words[0].strip("`\"[]"))
+            continue
+        depth += {"(": 1, ")": -1}.get(character, 0)
+        part.append(character)
+    return column_names
+
+
+def split_sql_rows(values_text):
+    """
+    Split the VALUES of an INSERT statement into rows. A quoted value may
+    hold parentheses, commas and escaped or doubled quotes.
+    :return: a list of rows, each a list of the value texts
+    """
+    if "'" not in values_text and '"' not in values_text:
+        # the rows of numbers that the dumps hold
+        return [row_text.split(",") for row_text in
+                re.findall(r"\(([^()]*)\)", values_text)]
+    rows = []
+    row = None
+    value = []
+    quote = None
+    index = 0
+    while index < len(values_text):
+        character = values_text[index]
+        if quote is not None:
+            value.append(character)
+            if character == "\\":
+                value.append(values_text[index + 1:index + 2])
+                index += 1
+            elif character == quote:
+                if values_text[index + 1:index + 2] == quote:
+                    value.append(quote)
+                    index += 1
+                else:
+                    quote = None
+        elif row is None:
+            if character == "(":
+                row = []
+                value = []
+        elif character in "'\"":
+            quote = character
+            value.append(character)
+        elif character == ",":
+            row.append("".join(value))
+            value = []
+        elif character == ")":
+            row.append("".join(value))
+            rows.append(row)
+            row = None
+        else:
+            value.append(character)
+        index += 1
+    return rows
+
+
+def parse_sql_value(text):
+    """
+    :return: None for NULL, the number as an int or the text of any other
+        value without its quotes. Only the number columns of SummaryData
+        are ingested.
+    """
+    text = text.strip()
+    if text.upper() == "NULL":
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    if len(text) > 1 and text[0] == text[-1] and text[0] in "'\"":
+        text = text[1:-1]
+    try:
+        return int(float(text))
+    except ValueError:
+        return text
+
+
+class SummaryRowCollector:
+    """
+    Collect the SummaryData rows of one archive as columns of INGEST_COLUMNS
+    and leave out the rows in the time ranges that are already stored.
+    """
+
+    def __init__(self, covered_ranges=()):
+        self.covered = TimeRanges(covered_ranges)
+        self.columns = [array.array("q") for column_name in INGEST_COLUMNS]
+        self.column_names = list(INGEST_COLUMNS)
+        self.skipped_count = 0
+
+    def set_column_names(self, column_names):
+        self.column_names = column_names
+
+    def add_row(self, row, column_names=None):
+        column_names = column_names or self.column_names
+        values = dict(zip(column_names, row))
+        sample_time = values.get("Time")
+        if sample_time is None:
+            return
+        if self.covered.contains(sample_time):
+            self.skipped_count += 1
+            return
+        for column, column_name in zip(self.columns, INGEST_COLUMNS):
+            value = values.get(column_name)
+            column.append(INGEST_NULL if value is None else int(value))
+
+    def add_statement(self, statement):
+        """
+        Add the rows of a SummaryData INSERT statement and remember the
+        column order of a CREATE TABLE statement.
+        """
+        if statement.startswith("CREATE TABLE") and \
+                re.match(r"CREATE TABLE (?:IF NOT EXISTS )?[`\"]?"
+                         r"SummaryData[`\"]?\s*\(", statement):
+            self.set_column_names(parse_create_columns(statement))
+            return
+        if not statement.startswith("INSERT"):
+            return
+        match = INSERT_PATTERN.match(statement)
+        if match is None or match.group(1) != "SummaryData":
+            return
+        column_names = None
+        if match.group(2):
+            column_names = [column_name.strip(" `\"")
+                            for column_name in match.group(2).split(",")]
+        for row in split_sql_rows(match.group(3)):
+            self.add_row([parse_sql_value(value) for value in row],
+                         column_names)
+
+    def add_sql_lines(self, lines):
+        """
+        :param lines: the decoded lines of a SQL dump
+        """
+        statement = []
+        for line in lines:
+            if not statement and not (line.startswith("INSERT") or
+                                      line.startswith("CREATE TABLE")):
+                continue
+            statement.append(line)
+            if line.rstrip().endswith(";"):
+                self.add_statement("".join(statement))
+                statement = []
+
+    def get_row_count(self):
+        return len(self.columns[0])
+
+
+def open_result_archive(archive_filename):
+    """
+    :return: an open tarfile of a result archive of any codec
+    """
+    if archive_filename.endswith(".tzst"):
+        if zstandard is None:
+            raise tarfile.TarError("the zstandard module is not installed")
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            open(archive_filename, "rb"), read_across_frames=True,
+            closefd=True)
+        return tarfile.open(fileobj=reader, mode="r|")
+    return tarfile.open(archive_filename, "r:*")
+
+
+def parse_result_archive(archive_filename, covered_ranges=()):
+    """
+    Read the SummaryData rows of a result archive from its SQL dump,
+    parallel dump chunks or columnar export. This is a module function so
+    that it can be run in an ArchiveIngester worker process.
+    :param covered_ranges: the (start, stop) ranges already in the store
+        for this school
+    :return: a dict with the column arrays or the error
+    """
+    result = {"archive": os.path.basename(archive_filename), "error": None}
+    collector = SummaryRowCollector(covered_ranges)
+    try:
+        with open_result_archive(archive_filename) as tar_file:
+            for member in tar_file:
+                if not member.isfile():
+                    continue
+                member_name = os.path.basename(member.name)
+                member_file = tar_file.extractfile(member)
+                if member_name.endswith(".sql"):
+                    collector.add_sql_lines(io.TextIOWrapper(
+                        member_file, "utf-8", "surrogateescape"))
+                elif ".sql." in member_name and (
+                        "_SummaryData." in member_name or
+                        "_schema." in member_name):
+                    chunk_codec = None
+                    for codec, suffix in CHUNK_SUFFIXES.items():
+                        if member_name.endswith(suffix):
+                            chunk_codec = codec
+                    if chunk_codec is None:
+                        continue
+                    with tempfile.NamedTemporaryFile() as chunk_file:
+                        shutil.copyfileobj(member_file, chunk_file)
+                        chunk_file.flush()
+                        for statement in iter_chunk_statements(
+                                chunk_codec, chunk_file.name):
+                            collector.add_statement(statement)
+                elif member_name.endswith(EXPORT_SUFFIX):
+                    with tempfile.NamedTemporaryFile(
+                            suffix=EXPORT_SUFFIX) as export_file:
+                        shutil.copyfileobj(member_file, export_file)
+                        export_file.flush()
+                        reader = ColumnarExportReader(export_file.name)
+                        try:
+                            if "SummaryData" in reader.get_table_names():
+                                collector.set_column_names(
+                                    reader.get_column_names("SummaryData"))
+                                for row in reader.iter_rows("SummaryData"):
+                                    collector.add_row(row)
+                        finally:
+                            reader.close()
+    except ARCHIVE_ERRORS as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["columns"] = collector.columns
+    result["rows"] = collector.get_row_count()
+    result["skipped"] = collector.skipped_count
+    return result
+
+
+class ArchiveIngester:
+    """
+    Load the result archives that the schools return into one SQLite store
+    at the head office. The archives are found by the names that
+    ResultGenerator.generate_names gives them and parsed on a pool of
+    processes. Every archive covers the time range of its rows, so the rows
+    of a later archive that fall in a range already stored for the school
+    are left out before the bulk insert.
+    """
+
+    def __init__(self, store_filename, workers=1):
+        self.store_filename = store_filename
+        self.workers = max(workers, 1)
+        self.db_reader = DbReader(store_filename, "", "", backend="sqlite")
+        self.archive_count = 0
+        self.row_count = 0
+        self.skipped_count = 0
+        self.errors = {}
+        self.elapsed_time = 0.0
+
+    def create_tables(self):
+        self.db_reader.return_cursor("PRAGMA journal_mode = WAL")
+        self.db_reader.return_cursor("PRAGMA synchronous = OFF")
+        self.db_reader.return_cursor(
+            "CREATE TABLE IF NOT EXISTS SchoolSummaryData (School TEXT, %s, "
+            "PRIMARY KEY (School, Time))"
+            % ", ".join("%s INTEGER" % column_name
+                        for column_name in INGEST_COLUMNS))
+        self.db_reader.return_cursor(
+            "CREATE TABLE IF NOT EXISTS IngestedArchives (Archive TEXT "
+            "PRIMARY KEY, School TEXT, ReportDate TEXT, Rows INTEGER, "
+            "FirstTime INTEGER, LastTime INTEGER, Ingested INTEGER)")
+        self.db_reader.connector.commit()
+
+    @staticmethod
+    def scan(archive_dirname):
+        """
+        :return: a list of (school, report date, archive filename) in date
+            order
+        """
+        archives = []
+        for filename in os.listdir(archive_dirname):
+            match = ARCHIVE_NAME_PATTERN.match(filename)
+            if match is None:
+                continue
+            report_date = datetime.datetime.strptime(
+                match.group("date"), "%m_%d_%y").date().isoformat()
+            archives.append((match.group("school"), report_date,
+                             os.path.join(archive_dirname, filename)))
+        archives.sort(key=lambda archive: (archive[1], archive[0]))
+        return archives
+
+    def get_covered_ranges(self):
+        """
+        :return: a dict of school name to the TimeRanges already stored
+        """
+        covered = {}
+        for school, first_time, last_time in self.db_reader.return_list(
+                "SELECT School, FirstTime, LastTime FROM IngestedArchives "
+                "WHERE Rows > 0"):
+            covered.setdefault(school, TimeRanges()).add(first_time,
+                                                         last_time)
+        return covered
+
+    def store_result(self, school, report_date, result, covered):
+        """
+        Insert the rows of a parsed archive that are not in the covered
+        ranges of the school and record the archive.
+        :return: the number of rows inserted, None if they could not be
+            written
+        """
+        school_ranges = covered.setdefault(school, TimeRanges())
+        rows = []
+        for row in zip(*result["columns"]):
+            if school_ranges.contains(row[0]):
+                self.skipped_count += 1
+                continue
+            rows.append((school,) + tuple(
+                None if value == INGEST_NULL else value for value in row))
+        first_time = min(result["columns"][0]) if result["rows"] else None
+        last_time = max(result["columns"][0]) if result["rows"] else None
+        if rows and not self.db_reader.write_rows(
+                "INSERT OR IGNORE INTO SchoolSummaryData VALUES (%s)"
+                % ", ".join(["%s"] * (len(INGEST_COLUMNS) + 1)), rows):
+            return None
+        if first_time is not None:
+            school_ranges.add(first_time, last_time)
+        if not self.db_reader.write_rows(
+                "INSERT OR REPLACE INTO IngestedArchives VALUES "
+                "(%s, %s, %s, %s, %s, %s, %s)",
+                [(result["archive"], school, report_date, result["rows"],
+                  first_time, last_time, int(time.time()))]):
+            return None
+        return len(rows)
+
+    def ingest(self, archive_dirname):
         """
-        Create datetime objects for start and finish time
-        :return: start and end datetime objects
+        Parse the new archives of the directory on the worker pool and
+        store them in date order.
+        :return: the number of archives stored
         """
-        start_datetime = datetime.datetime.fromtimestamp(
-            self.time_period.get_start_time())
-        end_datetime = datetime.datetime.fromtimestamp(
-            self.time_period.get_end_time())
-        return start_datetime, end_datetime
+        start_time = time.time()
+        self.create_tables()
+        ingested = set(row[0] for row in self.db_reader.return_list(
+            "SELECT Archive FROM IngestedArchives"))
+        archives = [archive for archive in self.scan(archive_dirname)
+                    if os.path.basename(archive[2]) not in ingested]
+        covered = self.get_covered_ranges()
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            pending = [(school, report_date, filename, pool.apply_async(
+                parse_result_archive,
+                (filename, covered.get(school, TimeRanges()).get_ranges())))
+                       for school, report_date, filename in archives]
+            pool.close()
+            for school, report_date, filename, async_result in pending:
+                archive_name = os.path.basename(filename)
+                try:
+                    result = async_result.get()
+                except Exception as e:
+                    # an error that parse_result_archive did not expect
+                    self.errors[archive_name] = "%s: %s" % (
+                        type(e).__name__, e)
+                    continue
+                if result["error"] is not None:
+                    self.errors[archive_name] = result["error"]
+                    continue
+                row_count = self.store_result(school, report_date, result,
+                                              covered)
+                if row_count is None:
+                    self.errors[archive_name] = \
+                        "the rows could not be written to the store"
+                    continue
+                self.row_count += row_count
+                self.skipped_count += result["skipped"]
+                self.archive_count += 1
+        finally:
+            pool.terminate()
+            pool.join()
+        self.elapsed_time = time.time() - start_time
+        return self.archive_count
 
+    def get_throughput_text(self):
+        seconds = max(self.elapsed_time, 0.001)
+        return "Ingested %d archives and %d rows in %.1f s (%.1f archives/s, " \
+               "%.0f rows/s), %d rows were already stored" \
+               % (self.archive_count, self.row_count, self.elapsed_time,
+                  self.archive_count / seconds, self.row_count / seconds,
+                  self.skipped_count)
 
-class DataGatherer:
-    """
 
+def run_ingest(archive_dirname, store_filename, workers=1):
     """
+    Load every new result archive of the directory into the store.
+    :return: True if no archive failed
+    """
+    ingester = ArchiveIngester(store_filename, workers)
+    ingester.ingest(archive_dirname)
+    for archive_name, error in sorted(ingester.errors.items()):
+        print ("%s: failed, %s" % (archive_name, error))
+    print (ingester.get_throughput_text())
+    print ("The schools are in %s" % store_filename)
+    return not ingester.errors
 
-    def __init__(self, db_reader, time_finder, max_user_count=20):
-        self.db_reader = db_reader
-        self.time_finder = time_finder
-        self.max_user_count = max_user_count
-        self.reporter_dict = {}
 
-    # def perform_count_query(self, ):
-    def create_value_objects(self):
-        """
-        Create a dictionary of all ReportValue objects. The key is generated by the ReportValue
-        object.
-        :return:
-        """
-        reporter_count = 0
-        for time_period in self.time_finder.get_weeks():
-            for status in ("All", "Active"):
-                for user_type in ("Teacher", "Student"):
-                    # create a reporter object for each type and time period
-                    reporter = ReportValues(self.db_reader, user_type, status,
-                                            time_period,
-                                            self.max_user_count)
-                    self.reporter_dict[
-                        ("Week", user_type, status, time_period)] = \
-                        reporter.fill_array_from_database()
-                    reporter_count += 1
-        for time_period in self.time_finder.get_months():
-            for status in ("All", "Active"):
-                for user_type in ("Teacher", "Student"):
-                    reporter = ReportValues(self.db_reader, user_type, status,
-                                            time_period,
-                                            self.max_user_count)
-                    self.reporter_dict[
-                        ("Month", user_type, status, time_period)] = \
-                        reporter.fill_array_from_database()
-                    reporter_count += 1
-        if reporter_count == 0:
-            """
-Error:
-    There was a problem with getting report data so the report is bad.
-    If no other errors reported then the database dump may be OK.
-    Return the .the .tbz file. """
-        return self.reporter_dict, reporter_count
+def run_watch(db_reader, top_level_dir_name, num_months=60,
+              max_user_count=20, cache_dir=DEFAULT_CACHE_DIR,
+              write_interval=3600):
+    """
+    Keep the csv report in the storage directory up to date until the
+    process is interrupted.
+    """
+    if hasattr(os, "nice"):
+        os.nice(WATCH_NICE)
+    report_filename = os.path.join(top_level_dir_name,
+                                   "SystemMonitor_report.csv")
+    watcher = ReportWatcher(db_reader, report_filename, num_months,
+                            max_user_count, cache_dir, write_interval)
+    print ("Watching SummaryData, the report is kept in %s"
+           % report_filename)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
 
 
-class ResultGenerator:
+class PrefixSumIndex:
     """
-    Dump the database as a file, generate a csv file from the roport data,
-    and save bot as a compressed tar file.
+    Running totals of the SummaryData histograms at hour resolution so the
+    report values of any range of whole hours are the difference of two
+    rows. For every count column each row holds the samples of each
+    value up to max_bucket, of the larger values and of NULL, and the
+    column sum, added up over all hours before the row. Only the hours
+    with samples have a row and they are found with a binary search. The
+    downsampled hours of SummaryHourly are included and new rows are
+    added on refresh without reading the old ones again.
     """
+    COLUMN_NAMES = DailyRollup.COLUMN_NAMES
+    GRANULARITIES = ("range", "day", "week", "month", "term")
 
-    def __init__(self, report_data, school_name, upper_dir_name="./"):
-        """
+    def __init__(self, db_reader, max_bucket=PREFIX_MAX_COUNT):
+        self.db_reader = db_reader
+        self.max_bucket = max_bucket
+        # the buckets 0 to max_bucket, the larger values and NULL
+        self.width = max_bucket + 3
+        self.key = None
+        self.high_water_mark = None
+        self.last_refresh_time = 0
+        self.clear()
 
-        :param report_data:
-        :param school_name:
-        """
-        self.school_name = school_name
-        self.report_data = report_data
-        self.upper_dirname = upper_dir_name
-        self.dirname = ""
-        self.file_name_base = ""
-        self.result_dirname = ""
-        self.report_filename = ""
-        self.dump_filename = ""
-        self.tar_filename = ""
-        self.temp_path_tar_filename = ""
-        self.final_path_tar_filename = ""
+    def clear(self):
+        self.high_water_mark = None
+        self.hour_starts = array.array("q")
+        # 32 bit counts hold thousands of years of samples
+        self.counts = [array.array("i", [0] * self.width)
+                       for column_name in self.COLUMN_NAMES]
+        self.sums = [array.array("q", [0]) for column_name in
+                     self.COLUMN_NAMES]
 
-    def generate_names(self):
+    def get_key(self):
+        min_time, max_time = self.db_reader.return_single_value(
+            "SELECT MIN(Time), MAX(Time) FROM SummaryData")
+        return min_time, max_time, get_downsampled_range(self.db_reader)
+
+    def add_hour(self, hour_start, hour_counts, hour_sums):
         """
-        Gnerate all filenames and directories from the schoolname and date
-        :return:
+        Append the row of one hour.
+        :param hour_counts: a list per column of the bucket counts
+        :param hour_sums: the column sums of the hour
         """
-        time_suffix = time.strftime("%m_%d_%y", time.localtime())
-        base_name =self.school_name.title().replace(" ", "")
-        self.file_name_base = base_name + "_" + time_suffix
-        self.result_dirname = self.file_name_base + "_dir"
-        self.dirname = self.upper_dirname + "/" + self.result_dirname
-        self.report_filename = self.dirname + "/" + self.file_name_base + ".csv"
-        self.dump_filename = self.dirname + "/" + self.file_name_base + ".sql"
-        self.tar_filename = self.file_name_base + ".tbz"
-        self.temp_path_tar_filename = "./" + self.tar_filename
-        self.final_path_tar_filename = self.dirname + "/" + self.tar_filename
+        self.hour_starts.append(hour_start)
+        for counts, sums, column_counts, column_sum in zip(
+                self.counts, self.sums, hour_counts, hour_sums):
+            offset = len(counts) - self.width
+            counts.extend([counts[offset + index] + column_counts[index]
+                           for index in range(self.width)])
+            sums.append(sums[-1] + column_sum)
 
-    def make_result_directory(self):
+    def remove_last_hour(self):
         """
-        If the directory already exists, remove it and its contents.
-        Then create the directory
-        :return:
+        :return: the start of the removed hour
         """
-        if os.path.exists(self.dirname):
-            try:
-                shutil.rmtree(self.dirname)
-            except OSError as e:
-                print ("Could not remove the old directory: %s" % e)
-        try:
-            os.mkdir(self.dirname)
-        except OSError:
-            print ("""
-Error:
-    Could not create the directory "%s" in
-        "%s" for the results.
-    Please try using the option "--storagedir"
-      on the command line -- maybe the /media directory that is your
-      thumbdrive.
-    If you have used the --storagedir option check the spelling
-      of the directory.
-    If nothing else works you can also rerun this program with a sudo.
-            """ % (self.result_dirname, self.upper_dirname))
-            sys.exit(-1)
+        hour_start = self.hour_starts.pop()
+        for counts, sums in zip(self.counts, self.sums):
+            del counts[len(counts) - self.width:]
+            sums.pop()
+        return hour_start
 
-    def dump_database(self):
+    def get_bucket(self, value):
+        if value is None or value < 0:
+            return self.width - 1
+        return min(value, self.max_bucket + 1)
+
+    def iter_hours(self, start_time, downsampled_before):
         """
-        Dump the complete SystemMontor database into file "filename".
-        This is a text file and could be quite large. This why it is dumped
-        to an external file.
-        :return output from the mysqldump command:
+        Generate (hour start, counts, sums) from the hours of SummaryHourly
+        and then the rows of SummaryData from start_time on.
         """
-        dump_command = \
-            "mysqldump --user=root --password=mysqlAdmin --add-drop-database --databases SystemMonitor "
-        try:
-            output = subprocess.check_output(dump_command, shell=True,
-                                             universal_newlines=True,
-                                             stderr=open(os.devnull, 'wb'))
-        except subprocess.CalledProcessError as e:
-            print ("""
-Error:
-    There was an error while doing the database dump.
-    The error reported is:  "%s"
-    The databse dump file may not be usable but the report probably is.
-    """ % e)
-            return "Error in dump: %s" % e
-        return output
+        if downsampled_before is not None and start_time < downsampled_before:
+            query = "SELECT Time, %s FROM %s WHERE Time >= %%s ORDER BY Time" \
+                    % (", ".join(self.COLUMN_NAMES),
+                       SummaryMaintainer.HOURLY_TABLE)
+            for row in self.db_reader.iter_rows(query, (start_time,)):
+                hour_counts = []
+                hour_sums = []
+                for histogram_text in row[1:]:
+                    column_counts = [0] * self.width
+                    column_sum = 0
+                    for value, samples_count in \
+                            SummaryMaintainer.parse_histogram(histogram_text):
+                        column_counts[self.get_bucket(value)] += samples_count
+                        column_sum += max(value, 0) * samples_count
+                    hour_counts.append(column_counts)
+                    hour_sums.append(column_sum)
+                yield row[0], hour_counts, hour_sums
+            start_time = downsampled_before
+        query = "SELECT Time, %s FROM SummaryData WHERE Time >= %%s " \
+                "ORDER BY Time" % ", ".join(self.COLUMN_NAMES)
+        hour_start = None
+        hour_counts = None
+        hour_sums = None
+        for row in self.db_reader.iter_rows(query, (start_time,)):
+            if hour_start is None or row[0] >= hour_start + 3600:
+                if hour_start is not None:
+                    yield hour_start, hour_counts, hour_sums
+                hour_start = SummaryMaintainer.get_hour_start(row[0])
+                hour_counts = [[0] * self.width for column_name in
+                               self.COLUMN_NAMES]
+                hour_sums = [0] * len(self.COLUMN_NAMES)
+            for index, value in enumerate(row[1:]):
+                hour_counts[index][self.get_bucket(value)] += 1
+                hour_sums[index] += value or 0
+        if hour_start is not None:
+            yield hour_start, hour_counts, hour_sums
 
-    def write_database_dump_file(self):
+    def refresh(self):
         """
-        Create a file with the complete dump ot the sql SysetmMonitor tables.
-        Prepend the requied atart sql commnad to make it directly loadable
-        :return:
+        Add the rows recorded since the last refresh. The last hour is
+        read again because it may have been incomplete. The index is
+        rebuilt when older rows were removed or downsampled. If the read
+        fails the index is cleared so the next refresh builds it again.
+        :return: the number of hours added
         """
-        dump = self.dump_database()
-        dump_file = open(self.dump_filename, "w")
-        dump_file.write("USE SystemMonitor;\n")
-        dump_file.write(dump)
-        dump_file.close()
+        key = self.get_key()
+        self.last_refresh_time = time.time()
+        if key == self.key:
+            return 0
+        if self.key is None or key[0] != self.key[0] or \
+                key[2] != self.key[2] or key[1] is None or \
+                self.high_water_mark is None or \
+                key[1] < self.high_water_mark:
+            self.clear()
+        if key[1] is None and key[2] is None:
+            self.key = key
+            return 0
+        downsampled_before = key[2][1] if key[2] is not None else None
+        start_time = 0
+        if self.hour_starts:
+            start_time = self.remove_last_hour()
+        hour_count = 0
+        try:
+            for hour_start, hour_counts, hour_sums in self.iter_hours(
+                    start_time, downsampled_before):
+                self.add_hour(hour_start, hour_counts, hour_sums)
+                hour_count += 1
+        except self.db_reader.error_class:
+            self.key = None
+            self.clear()
+            raise
+        self.key = key
+        self.high_water_mark = key[1]
+        return hour_count
 
-    def write_report_file(self, report_filename):
+    def refresh_if_due(self, interval=SAMPLE_TIME):
+        if time.time() - self.last_refresh_time >= interval:
+            self.refresh()
 
-        outfile = open(report_filename, "w")
-        writer = csv.writer(outfile)
-        keys = list(self.report_data.keys())
-        # keys.sort(cmp = key_compare)
-        keys.sort(key=key_sort_val, reverse=True)
-        sample_row = self.report_data[keys[0]].value_dict
-        row_keys = list(sample_row.keys())
-        row_header_list = ["Period Type", "User", "Status", "Start Time"]
-        row_header_list.extend(row_keys)
-        row_header = []
-        for row_key in row_header_list:
-            row_header.append(str(row_key))
-        # row_header.append("Total Hours")
-        writer.writerow(row_header)
-        for key in keys:
-            date = datetime.datetime.fromtimestamp(
-                key[3].get_period_start()).strftime("%m/%d/%y")
-            row_values = [key[0], key[1], key[2], date]
-            # hour_sum = 0.0
-            for row_key in row_keys:
-                value = self.report_data[key].value_dict[row_key] / 60.0
-                row_values.append(float("%3.2f" % value))
-                # hour_sum += value
-                # last_value = value
-            # remove the "All" column in the sum
-            # hour_sum -= last_value
-            # row_values.append(float("%3.2f" %hour_sum))
-            writer.writerow(row_values)
-        outfile.close()
+    def get_values(self, column_name, start_time, end_time, max_count=20):
+        """
+        Count the samples of the hours that start in [start_time, end_time)
+        with two row lookups.
+        :return: an OrderedDict with the keys of ReportValues.value_dict
+        """
+        if end_time <= start_time:
+            raise ValueError("the end must be after the start")
+        if not 1 <= max_count <= self.max_bucket:
+            raise ValueError("the max count must be from 1 to %d"
+                             % self.max_bucket)
+        column_index = self.COLUMN_NAMES.index(column_name)
+        first_row = bisect.bisect_left(self.hour_starts, start_time)
+        stop_row = bisect.bisect_left(self.hour_starts, end_time)
+        counts = self.counts[column_index]
+        first_offset = first_row * self.width
+        stop_offset = stop_row * self.width
+        bucket_counts = [counts[stop_offset + index] -
+                         counts[first_offset + index]
+                         for index in range(self.width)]
+        value_dict = collections.OrderedDict()
+        for i in range(1, max_count + 1):
+            value_dict[i] = bucket_counts[i]
+        value_dict["> Count"] = sum(bucket_counts[max_count + 1:-1])
+        value_dict["On Hours"] = sum(bucket_counts)
+        value_dict["User Hours"] = self.sums[column_index][stop_row] - \
+            self.sums[column_index][first_row]
+        value_dict["Active Hours"] = sum(bucket_counts[1:-1])
+        return value_dict
 
-    def prepare_for_sending(self):
+    @staticmethod
+    def split_range(start_time, end_time, granularity):
         """
-        Use the compresson command to create a single compressed file to return
-        via email. The directory has been created and the report and dump files
-        have been written into it.
-        :return:
+        :return: a list of (start, end) of the local calendar periods of the
+            granularity that overlap [start_time, end_time), cut to it.
+            Weeks start on Monday.
         """
-        combine_command = "tar -cjf %s %s" % (self.temp_path_tar_filename,
-                                              os.path.basename(self.dirname))
-        try:
-            # shange directory so no extra path elements in the tar file
-            os.chdir(self.upper_dirname)
-            output = subprocess.check_output(combine_command, shell=True,
-                                             universal_newlines=True,
-                                             stderr=subprocess.STDOUT)
-            # now move the compressed file into the directory also
-            shutil.move(self.temp_path_tar_filename,
-                        self.final_path_tar_filename)
-            # remove the .sql file
-            os.remove(self.dump_filename)
-        except subprocess.CalledProcessError as e:
-            print ("There was an error while doing the database dump: %s" % e)
-            return False
-        return True
+        if granularity not in PrefixSumIndex.GRANULARITIES:
+            raise ValueError("the granularity must be one of %s"
+                             % ", ".join(PrefixSumIndex.GRANULARITIES))
+        if granularity == "range":
+            return [(start_time, end_time)]
+        start_date = datetime.date.fromtimestamp(start_time)
+        if granularity == "week":
+            start_date -= datetime.timedelta(start_date.weekday())
+        elif granularity == "month":
+            start_date = start_date.replace(day=1)
+        elif granularity == "term":
+            start_date = start_date.replace(month=max(
+                month for month in TimeFinder.TERM_START_MONTHS
+                if month <= start_date.month), day=1)
+        periods = []
+        period_start = int(time.mktime(start_date.timetuple()))
+        while period_start < end_time:
+            if granularity == "day":
+                next_date = start_date + datetime.timedelta(1)
+            elif granularity == "week":
+                next_date = start_date + datetime.timedelta(7)
+            else:
+                step = 1 if granularity == "month" else \
+                    12 // len(TimeFinder.TERM_START_MONTHS)
+                month_index = start_date.year * 12 + start_date.month - 1 + \
+                    step
+                next_date = datetime.date(month_index // 12,
+                                          month_index % 12 + 1, 1)
+            period_end = int(time.mktime(next_date.timetuple()))
+            periods.append((max(period_start, start_time),
+                            min(period_end, end_time)))
+            start_date = next_date
+            period_start = period_end
+        return periods
 
-    def write_all_result_files(self):
+    def get_report(self, start_time, end_time, granularity="range",
+                   user_type="Student", status="All", max_count=20):
         """
-        The primary function for writing all result files.
-        It performs thes actions.
-        1. Create a directory for the results
-        2. Write a csv file that contaions the report results into the directory
-        3. Perform a database dump of the SystemMonitor database, then write it
-            as a sql dump file in the directory
-        4. Create a compressed tar file of the directory.
-        5. Move the tar file into the directory to prepare for a simple copy
-            of all of the resutls in various forms that can be used to forward
-            the data.
-        :return:
+        The report values of each period of the granularity in the range.
+        :return: a list of (period start, period end, value_dict)
         """
-        self.generate_names()
-        self.make_result_directory()
-        self.write_database_dump_file()
-        self.write_report_file(self.report_filename)
-        return self.prepare_for_sending()
+        if user_type not in ("Teacher", "Student"):
+            raise ValueError("the user must be Teacher or Student")
+        if status not in ("All", "Active"):
+            raise ValueError("the status must be All or Active")
+        if end_time <= start_time:
+            raise ValueError("the end must be after the start")
+        column_name = "%s%sCount" % ("Active" if status == "Active" else "",
+                                     user_type)
+        return [(period_start, period_end,
+                 self.get_values(column_name, period_start, period_end,
+                                 max_count))
+                for period_start, period_end in self.split_range(
+                    start_time, end_time, granularity)]
+
+    def get_status(self):
+        return {"hours": len(self.hour_starts),
+                "first_hour": self.hour_starts[0] if self.hour_starts
+                else None,
+                "last_hour": self.hour_starts[-1] if self.hour_starts
+                else None,
+                "max_count": self.max_bucket,
+                "memory_bytes": sum(
+                    counts.itemsize * len(counts) for counts in
+                    self.counts + self.sums + [self.hour_starts])}
+
+
+def parse_query_time(text):
+    """
+    :param text: unix seconds or a local date as YYYY-MM-DD
+    :return: the unix time
+    """
+    if text.isdigit():
+        return int(text)
+    return int(time.mktime(
+        datetime.datetime.strptime(text, "%Y-%m-%d").timetuple()))
+
+
+class ReportQueryHandler(http_server.BaseHTTPRequestHandler):
+    """
+    Answer GET /report with the report values of a range as json, for
+    example /report?start=2024-01-08&end=2024-03-29&granularity=week
+    &user=Student&status=Active&maxcount=20. The end date is included.
+    GET /status describes the index. The values are hours as in the csv
+    report.
+    """
+
+    def do_GET(self):
+        url = url_parse.urlparse(self.path)
+        params = dict((name, values[-1]) for name, values in
+                      url_parse.parse_qs(url.query).items())
+        index = self.server.prefix_index
+        try:
+            index.refresh_if_due()
+            if url.path == "/status":
+                return self.send_json(200, index.get_status())
+            if url.path != "/report":
+                return self.send_json(404, {"error": "unknown path %s"
+                                                     % url.path})
+            query_start = time.time()
+            start_time = parse_query_time(params["start"])
+            end_text = params.get("end", "")
+            if not end_text:
+                end_time = index.hour_starts[-1] + 3600 \
+                    if index.hour_starts else start_time
+            elif end_text.isdigit():
+                end_time = int(end_text)
+            else:
+                # the end date is the whole day
+                end_time = parse_query_time(end_text) + 86400
+            hours_per_sample = SAMPLE_TIME / 3600.0
+            periods = []
+            for period_start, period_end, value_dict in index.get_report(
+                    start_time, end_time, params.get("granularity", "range"),
+                    params.get("user", "Student"), params.get("status", "All"),
+                    int(params.get("maxcount", 20))):
+                periods.append({
+                    "start": datetime.datetime.fromtimestamp(
+                        period_start).strftime("%Y-%m-%d %H:%M"),
+                    "end": datetime.datetime.fromtimestamp(
+                        period_end).strftime("%Y-%m-%d %H:%M"),
+                    "start_time": period_start, "end_time": period_end,
+                    "hours": collections.OrderedDict(
+                        (str(key), round(value * hours_per_sample, 2))
+                        for key, value in value_dict.items())})
+            self.send_json(200, {"periods": periods, "query_ms": round(
+                (time.time() - query_start) * 1000.0, 3)})
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {"error": "bad query: %s" % e})
+        except DB_ERRORS as e:
+            self.send_json(503, {"error": "database error: %s" % e})
+
+    def send_json(self, status_code, contents):
+        body = json.dumps(contents).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep the console for the errors
+        pass
+
+
+def run_query_server(db_reader, port=SERVE_PORT, host="127.0.0.1"):
+    """
+    Build the prefix sum index and answer report queries on the local
+    port until the process is interrupted.
+    """
+    prefix_index = PrefixSumIndex(db_reader)
+    start_time = time.time()
+    prefix_index.refresh()
+    print ("Indexed %d hours in %.1f s, serving http://%s:%d/report"
+           % (len(prefix_index.hour_starts), time.time() - start_time, host,
+              port))
+    server = http_server.HTTPServer((host, port), ReportQueryHandler)
+    server.prefix_index = prefix_index
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+def chunk_dump_statements(statements):
+    """
+    Join the SQL statements of an in process dump into pieces of about
+    DUMP_CHUNK_SIZE bytes.
+    :return: a generator of bytes
+    """
+    chunk = []
+    chunk_size = 0
+    for statement in statements:
+        line = (statement + "\n").encode()
+        chunk.append(line)
+        chunk_size += len(line)
+        if chunk_size >= DUMP_CHUNK_SIZE:
+            yield b"".join(chunk)
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+def create_summary_table(db_reader):
+    db_reader.return_cursor(
+        "CREATE TABLE IF NOT EXISTS SummaryData (Time INT PRIMARY KEY, "
+        "TeacherCount INT, StudentCount INT, ActiveTeacherCount INT, "
+        "ActiveStudentCount INT)")
+
+
+def generate_synthetic_data(db_reader, years, seed=1,
+                            first_day=datetime.date(2020, 1, 6)):
+    """
+    Fill the SummaryData table with SAMPLE_TIME samples that look like a
+    school lab: the server is on during school days in term time, the
+    students come in for lessons and some of the logged in users are
+    active. The same seed always gives the same data.
+    :param db_reader: a DbReader for an empty database
+    :param years: the number of years of samples
+    :return: the number of rows written
+    """
+    randomizer = random.Random(seed)
+    create_summary_table(db_reader)
+    insert_query = "INSERT INTO SummaryData (Time, TeacherCount, " \
+                   "StudentCount, ActiveTeacherCount, ActiveStudentCount) " \
+                   "VALUES (%s, %s, %s, %s, %s)"
+    lessons = ((8 * 60, 10 * 60), (11 * 60, 13 * 60), (14 * 60, 16 * 60))
+    rows = []
+    row_count = 0
+    for day_number in range(int(years * 365)):
+        day = first_day + datetime.timedelta(day_number)
+        # school holidays in June and December and most weekends
+        if day.month == 12 or (day.month == 6 and day.day > 15) or \
+                (day.weekday() > 4 and randomizer.random() > 0.1) or \
+                randomizer.random() < 0.05:
+            continue
+        day_start = int(time.mktime(day.timetuple()))
+        on_minute = 7 * 60 + randomizer.randint(0, 60)
+        off_minute = 16 * 60 + randomizer.randint(0, 120)
+        class_size = randomizer.randint(10, 40)
+        for minute in range(on_minute, off_minute, SAMPLE_TIME // 60):
+            if any(start <= minute < stop for start, stop in lessons):
+                students = max(0, min(class_size + randomizer.randint(-5, 5),
+                                      45))
+                teachers = randomizer.randint(1, 3)
+            else:
+                students = randomizer.randint(0, 5)
+                teachers = randomizer.randint(0, 2)
+            rows.append((day_start + minute * 60, teachers, students,
+                         randomizer.randint(0, teachers),
+                         int(students * randomizer.uniform(0.5, 1.0))))
+        if len(rows) >= 10000:
+            db_reader.write_rows(insert_query, rows)
+            row_count += len(rows)
+            rows = []
+    if rows:
+        db_reader.write_rows(insert_query, rows)
+        row_count += len(rows)
+    return row_count
+
+
+def time_call(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
+
+
+def run_benchmark(years_list, top_level_dir_name, max_user_count=20,
+                  engines=("query", "sweep", "rollup", "numpy"), codec="bz2",
+                  workers=1):
+    """
+    Time every stage of the report on synthetic SQLite databases of
+    several sizes and write the results as a json file so that the
+    throughput can be compared between releases.
+    :param years_list: the sizes of the databases in years of samples
+    :return: the name of the json file
+    """
+    work_dir = tempfile.mkdtemp(prefix="reporter_benchmark_")
+    results = []
+    try:
+        for years in years_list:
+            db_filename = os.path.join(work_dir, "SystemMonitor_%s.db" % years)
+            db_reader = DbReader(db_filename, "", "", backend="sqlite")
+            row_count, generate_time = time_call(
+                generate_synthetic_data, db_reader, years)
+            time_finder, finder_time = time_call(
+                TimeFinder, db_reader, int(years * 12) + 1, 0)
+            stages = {"generate_data": generate_time,
+                      "time_finder": finder_time}
+            result = {}
+            for engine in engines:
+                data_gatherer = DataGatherer(
+                    db_reader, time_finder, max_user_count, engine,
+                    os.path.join(work_dir, "cache_%s" % years))
+                (result, reporter_count), gather_time = time_call(
+                    data_gatherer.create_value_objects)
+                stages["create_value_objects_%s" % engine] = gather_time
+                if engine == "rollup":
+                    # a second run only has to read the cached rollup
+                    data_gatherer = DataGatherer(
+                        db_reader, time_finder, max_user_count, engine,
+                        os.path.join(work_dir, "cache_%s" % years))
+                    (result, reporter_count), gather_time = time_call(
+                        data_gatherer.create_value_objects)
+                    stages["create_value_objects_rollup_cached"] = \
+                        gather_time
+            result_generator = ResultGenerator(result, "Benchmark", work_dir,
+                                               codec, workers,
+                                               db_reader=db_reader)
+            result_generator.generate_names()
+            result_generator.make_result_directory()
+            stages["write_report_file"] = time_call(
+                result_generator.write_report_file,
+                result_generator.report_filename)[1]
+            stages["dump_archive"] = time_call(
+                result_generator.write_result_archive)[1]
+            results.append({
+                "years": years, "rows": row_count,
+                "database_bytes": os.path.getsize(db_filename),
+                "archive_bytes": os.path.getsize(
+                    result_generator.final_path_tar_filename),
+                "stages": stages,
+                "rows_per_second": dict(
+                    (stage, row_count / max(seconds, 1e-6))
+                    for stage, seconds in stages.items())})
+            db_reader.connector.close()
+            print ("%s years, %d rows: %s" % (years, row_count, ", ".join(
+                "%s %.2f s" % (stage, seconds)
+                for stage, seconds in sorted(stages.items()))))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    benchmark = {"version": VERSION, "python": platform.python_version(),
+                 "machine": platform.machine(),
+                 "cpu_count": multiprocessing.cpu_count(),
+                 "created": int(time.time()),
+                 "max_user_count": max_user_count, "codec": codec,
+                 "workers": workers, "results": results}
+    benchmark_filename = os.path.join(
+        top_level_dir_name,
+        "benchmark_%s.json" % time.strftime("%Y%m%d_%H%M%S",
+                                            time.localtime()))
+    with open(benchmark_filename, "w") as benchmark_file:
+        json.dump(benchmark, benchmark_file, indent=2)
+    return benchmark_filename
+
+
+def compress_block(codec, data):
+    """
+    Compress one block as a complete stream. This is a module function so
+    that it can be run in the ParallelCompressor worker processes.
+    """
+    if codec == "xz":
+        return lzma.compress(data)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return bz2.compress(data)
+
+
+def decompress_block(codec, data):
+    if codec == "xz":
+        return lzma.decompress(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return bz2.decompress(data)
+
+
+def new_compressor(codec):
+    """
+    :return: an incremental compressor with compress and flush methods
+    """
+    if codec == "xz":
+        return lzma.LZMACompressor()
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compressobj()
+    return bz2.BZ2Compressor()
+
+
+def open_decompressed(codec, filename):
+    """
+    :return: a binary file object of the decompressed contents
+    """
+    if codec == "xz":
+        return lzma.open(filename, "rb")
+    if codec == "zstd":
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            open(filename, "rb"), closefd=True))
+    return bz2.open(filename, "rb")
+
+
+def dump_table_range(db_reader, codec, task):
+    """
+    Write the rows of one ParallelDumper task as INSERT statements into a
+    compressed chunk file.
+    :return: a dict of the row count and the raw and compressed sizes
+    """
+    driver = db_reader.driver
+    query = "SELECT * FROM `%s`" % task["table"]
+    conditions = []
+    params = []
+    if task["low"] is not None:
+        conditions.append("`%s` >= %%s" % task["key"])
+        params.append(task["low"])
+    if task["high"] is not None:
+        conditions.append("`%s` < %%s" % task["key"])
+        params.append(task["high"])
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if task["key"] is not None:
+        query += " ORDER BY `%s`" % task["key"]
+    compressor = new_compressor(codec)
+    row_count = 0
+    byte_count = 0
+    compressed_count = 0
+    with open(task["filename"], "wb") as chunk_file:
+        header = "".join(line + "\n" for line in
+                         driver.get_data_header(DUMP_DB_NAME)).encode()
+        byte_count += len(header)
+        compressed = compressor.compress(header)
+        cursor = driver.streaming_cursor(db_reader.connector)
+        try:
+            db_reader.execute(cursor, query, tuple(params) or None)
+            while True:
+                rows = cursor.fetchmany(DUMP_INSERT_ROWS)
+                if not rows:
+                    break
+                statement = "INSERT INTO `%s` VALUES %s;\n" % (
+                    task["table"], ",".join(
+                        "(%s)" % ",".join(
+                            driver.quote_value(db_reader.connector, value)
+                            for value in row) for row in rows))
+                data = statement.encode("utf-8", "surrogateescape")
+                row_count += len(rows)
+                byte_count += len(data)
+                compressed += compressor.compress(data)
+                if compressed:
+                    chunk_file.write(compressed)
+                    compressed_count += len(compressed)
+                    compressed = b""
+        finally:
+            cursor.close()
+        compressed += compressor.flush()
+        chunk_file.write(compressed)
+        compressed_count += len(compressed)
+    return {"rows": row_count, "bytes": byte_count,
+            "compressed_bytes": compressed_count}
+
+
+def run_dump_worker(connect_params, codec, task_queue, result_queue,
+                    worker_index=None):
+    """
+    The body of a ParallelDumper worker process. It connects, starts its
+    snapshot, says that it is ready and then dumps the tasks from the
+    queue until it gets None. Every error is sent back so the coordinator
+    never waits for a worker that has stopped.
+    """
+    try:
+        db_reader = DbReader(exit_on_error=False, **connect_params)
+        db_reader.driver.begin_snapshot(db_reader)
+    except Exception as e:
+        result_queue.put(("error", worker_index, "a dump worker could not "
+                                                 "connect: %s" % e))
+        return
+    result_queue.put(("ready", worker_index, None))
+    while True:
+        item = task_queue.get()
+        if item is None:
+            break
+        task_index, task = item
+        try:
+            result_queue.put(("done", task_index,
+                              dump_table_range(db_reader, codec, task)))
+        except Exception as e:
+            result_queue.put(("error", task_index, "%s: %s"
+                              % (os.path.basename(task["filename"]), e)))
+    db_reader.connector.close()
+
+
+def iter_chunk_statements(codec, filename):
+    """
+    Generate the SQL statements of a dump chunk. A statement may span
+    several lines and always ends with a ";" at the end of a line.
+    """
+    lines = []
+    with open_decompressed(codec, filename) as chunk_file:
+        for line in chunk_file:
+            lines.append(line.decode("utf-8", "surrogateescape"))
+            if line.rstrip().endswith(b";"):
+                yield "".join(lines)
+                lines = []
+    if "".join(lines).strip():
+        yield "".join(lines)
+
+
+def load_dump_chunk(connect_params, codec, filename):
+    """
+    Run the statements of one chunk on a new connection. This is a module
+    function so that it can be run in a worker process.
+    :return: the number of statements
+    """
+    db_reader = DbReader(exit_on_error=False, **connect_params)
+    cursor = db_reader.connector.cursor()
+    statement_count = 0
+    for statement in iter_chunk_statements(codec, filename):
+        cursor.execute(statement)
+        statement_count += 1
+    db_reader.connector.commit()
+    db_reader.connector.close()
+    return statement_count
+
+
+def load_parallel_dump(db_reader, dump_dirname, workers=1):
+    """
+    Load a ParallelDumper directory: the schema chunk first and then the
+    table chunks on a pool of worker processes.
+    :param db_reader: a connection to the server or file to load into
+    :return: True if every chunk was loaded
+    """
+    try:
+        with open(os.path.join(dump_dirname,
+                               ParallelDumper.MANIFEST_FILENAME)) as \
+                manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, OSError, ValueError) as e:
+        print ("The dump manifest could not be read: %s" % e)
+        return False
+    codec = manifest["codec"]
+    start_time = time.time()
+    try:
+        load_dump_chunk(db_reader.connect_params, codec,
+                        os.path.join(dump_dirname, manifest["schema"]))
+    except (ImportError, IOError, OSError) + DB_ERRORS as e:
+        print ("The schema could not be loaded: %s" % e)
+        return False
+    pool = multiprocessing.Pool(max(workers, 1))
+    pending = [(chunk, pool.apply_async(
+        load_dump_chunk, (db_reader.connect_params, codec,
+                          os.path.join(dump_dirname, chunk["file"]))))
+               for chunk in manifest["chunks"]]
+    pool.close()
+    failed_count = 0
+    for chunk, result in pending:
+        try:
+            result.get()
+        except (ImportError, IOError, OSError) + DB_ERRORS as e:
+            print ("The chunk %s could not be loaded: %s"
+                   % (chunk["file"], e))
+            failed_count += 1
+    pool.join()
+    print ("Loaded %d of %d chunks, %d rows in %.1f s"
+           % (len(pending) - failed_count, len(pending),
+              sum(chunk["rows"] for chunk in manifest["chunks"]),
+              time.time() - start_time))
+    return not failed_count and not manifest.get("errors")
+
+
+def available_codecs():
+    codecs = ["bz2"]
+    if lzma is not None:
+        codecs.append("xz")
+    if zstandard is not None:
+        codecs.append("zstd")
+    return codecs
+
+
+def parse_compress_option(option_text):
+    """
+    Split the --compress option "codec[:workers]" into its parts.
+    :return: (codec, workers)
+    """
+    codec, _, workers_text = option_text.partition(":")
+    codec = codec or "bz2"
+    if codec not in available_codecs():
+        raise argparse.ArgumentTypeError(
+            "the compression must be one of %s"
+            % ", ".join(available_codecs()))
+    try:
+        workers = int(workers_text) if workers_text \
+            else multiprocessing.cpu_count()
+    except (ValueError, NotImplementedError):
+        raise argparse.ArgumentTypeError(
+            "the number of workers must be a number")
+    return codec, max(workers, 1)
 
 
-def key_sort_val(key):
+def tar_padding(size):
     """
-    Determine a value to be used in sorting the rows in tjhe report output.
-    The explicit function is used rather than lambda so the computaion result
-    can be seen.
-    :param key:
-    :return computed comparison key value:
+    The zero bytes that fill a tar member of "size" bytes to a whole block
     """
-    val = 2 ** 32 * (key[0] == "Month") + 2 ** 31 * (key[1] == "Student") + \
-          2 ** 30 * (key[2] == "Active") + (
-                  int(key[3].get_period_start()) - 2 ^ 20)
-    return val
+    return b"\0" * (-size % tarfile.BLOCKSIZE)
 
 
 def get_schoolname_from_gui():
@@ -597,20 +6044,37 @@ def get_schoolname():
     return "Unknown"
 
 
-def generate_csv_report(report_filename, num_months=60, max_user_count=20):
+def generate_csv_report(report_filename, num_months=60, max_user_count=20,
+                        engine="query", cache_dir=DEFAULT_CACHE_DIR,
+                        column_cache=False, use_cache=True,
+                        workers=GATHER_WORKERS):
     """
     This can be called by another program to just create the csv report file.
     :param report_filename: This sould be the full path name
     :param num_months:
     :param max_user_count:
-    :return:
+    :param engine: "query", "sweep", "rollup" or "numpy", see DataGatherer
+    :param cache_dir: the directory for the rollup, column and report caches
+    :param column_cache: use the mmap column cache with the numpy engine
+    :param use_cache: reuse the last report if SummaryData has not changed
+    :param workers: the number of connections that read the report values
+        at the same time with the query and rollup engines
+    :return: the reporter_dict of the report
     """
     db_reader = DbReader("SystemMonitor", "mysqlAdmin", "root", "localhost")
     time_finder = TimeFinder(db_reader, num_months, num_weeks=0)
-    data_gatherer = DataGatherer(db_reader, time_finder, max_user_count)
-    result, reporter_count = data_gatherer.create_value_objects()
-    result_generator = ResultGenerator(result, "School", "./")
-    result_generator.write_report_file(report_filename)
+    data_gatherer = DataGatherer(db_reader, time_finder, max_user_count,
+                                 engine, cache_dir, column_cache, workers)
+    if not use_cache:
+        result, reporter_count = data_gatherer.create_value_objects()
+        result_generator = ResultGenerator(result, "School", "./")
+        result_generator.write_report_file(report_filename)
+        return result
+    report_text, result = ReportCache(cache_dir).get_report(
+        data_gatherer, num_months, max_user_count)
+    with open(report_filename, "w", newline="") as report_file:
+        report_file.write(report_text)
+    return result
 
 
 if __name__ == "__main__":
@@ -625,6 +6089,90 @@ if __name__ == "__main__":
     parser.add_argument("--storagedir", dest="top_level_dir",
                         default="./", type=str,
                         help="The directory for the result (default; the directory you are in)")
+    parser.add_argument("--engine", dest="engine", default="query",
+                        choices=["query", "sweep", "rollup", "numpy"],
+                        help="How the report values are computed: one query per value, a single sweep through the table, from the cached daily rollup or with NumPy arrays (default query)")
+    parser.add_argument("--workers", dest="workers", default=GATHER_WORKERS,
+                        type=int,
+                        help="The number of database connections that read the report values at the same time with --engine query or rollup (default %d)" % GATHER_WORKERS)
+    parser.add_argument("--cachedir", dest="cache_dir",
+                        default=DEFAULT_CACHE_DIR, type=str,
+                        help="The directory for the cached daily rollup (default %s)" % DEFAULT_CACHE_DIR)
+    parser.add_argument("--delta", dest="delta", action="store_true",
+                        help="Only dump the SummaryData rows recorded since the last delta dump saved in the storage directory")
+    parser.add_argument("--fleet", dest="fleet_filename", default="",
+                        type=str,
+                        help="Create one combined csv report for all school servers listed in this csv file of: school name, host[:port], user, password, database")
+    parser.add_argument("--fleetworkers", dest="fleet_workers", default=8,
+                        type=int,
+                        help="The number of schools read at the same time in fleet mode (default 8)")
+    parser.add_argument("--timeout", dest="timeout", default=600, type=int,
+                        help="The seconds to wait for each school in fleet mode (default 600)")
+    parser.add_argument("--sqlite", dest="sqlite_filename", default="",
+                        type=str,
+                        help="Read a SQLite copy of the SystemMonitor database instead of the MySQL server")
+    parser.add_argument("--benchmark", dest="benchmark", default="",
+                        type=str,
+                        help="Time every stage on synthetic databases of these sizes in years, for example 1,2,5, and write the results as json into the storage directory")
+    parser.add_argument("--profile", dest="profile", action="store_true",
+                        help="Time every query and stage and write a profile next to the csv report")
+    parser.add_argument("--createindex", dest="create_index",
+                        action="store_true",
+                        help="Create a covering index on SummaryData (Time and the counts) if it is missing")
+    parser.add_argument("--columncache", dest="column_cache",
+                        action="store_true",
+                        help="With --engine numpy keep a memory mapped copy of the SummaryData columns in the cache directory and only read new rows")
+    parser.add_argument("--quick", dest="quick", action="store_true",
+                        help="First print and write a sampled preview of the report with 95%% confidence intervals within --quickbudget seconds, then make the full report")
+    parser.add_argument("--quickonly", dest="quick_only",
+                        action="store_true",
+                        help="Only make the quick preview")
+    parser.add_argument("--quickbudget", dest="quick_budget",
+                        default=QUICK_TIME_BUDGET, type=int,
+                        help="The seconds the quick preview may take (default %d)" % QUICK_TIME_BUDGET)
+    parser.add_argument("--quicksamples", dest="quick_samples",
+                        default=QUICK_SAMPLES, type=int,
+                        help="The sampled minutes per period of the quick preview (default %d)" % QUICK_SAMPLES)
+    parser.add_argument("--json", dest="json_report", action="store_true",
+                        help="Also write the report as a json file")
+    parser.add_argument("--heatmap", dest="heatmap", action="store_true",
+                        help="Also write a csv of the student usage for every hour of every weekday")
+    parser.add_argument("--watch", dest="watch", action="store_true",
+                        help="Keep running and keep SystemMonitor_report.csv in the storage directory up to date so a later run only has to dump the database")
+    parser.add_argument("--watchinterval", dest="watch_interval",
+                        default=3600, type=int,
+                        help="The least seconds between two report writes in watch mode (default 3600)")
+    parser.add_argument("--nocache", dest="no_cache", action="store_true",
+                        help="Always compute the report instead of using a cached report of the same data")
+    parser.add_argument("--dump", dest="dump_mode", default="stream",
+                        choices=["stream", "parallel", "columnar"],
+                        help="stream: one mysqldump streamed into the compressed archive, parallel: every table in key ranges on --dumpworkers connections from one snapshot into compressed chunks, columnar: a compact typed binary file of compressed column blocks (default stream)")
+    parser.add_argument("--dumpworkers", dest="dump_workers",
+                        default=multiprocessing.cpu_count(), type=int,
+                        help="The number of connections of the parallel dump and load (default all cores)")
+    parser.add_argument("--load", dest="load_dirname", default="", type=str,
+                        help="Load a parallel dump directory into the database (or the --sqlite file) and exit")
+    parser.add_argument("--ingest", dest="ingest_dirname", default="",
+                        type=str,
+                        help="Load every new school result archive of the directory into the --store file and exit")
+    parser.add_argument("--store", dest="store_filename",
+                        default="./SystemMonitor_schools.db", type=str,
+                        help="The SQLite file of the ingested school data (default ./SystemMonitor_schools.db)")
+    parser.add_argument("--ingestworkers", dest="ingest_workers",
+                        default=multiprocessing.cpu_count(), type=int,
+                        help="The number of processes that parse the archives (default all cores)")
+    parser.add_argument("--maintain", dest="maintain", action="store_true",
+                        help="Partition SummaryData by month, downsample the months older than --rawdays into hourly histograms in SummaryHourly, remove them from SummaryData and exit")
+    parser.add_argument("--rawdays", dest="raw_days",
+                        default=DOWNSAMPLE_AGE_DAYS, type=int,
+                        help="The days of SummaryData samples kept at full resolution by --maintain (default %d)" % DOWNSAMPLE_AGE_DAYS)
+    parser.add_argument("--serve", dest="serve", action="store_true",
+                        help="Keep a prefix sum index of SummaryData and answer report queries for any date range as json on a local port, for example http://127.0.0.1:%d/report?start=2024-01-08&end=2024-03-29&granularity=week" % SERVE_PORT)
+    parser.add_argument("--port", dest="port", default=SERVE_PORT, type=int,
+                        help="The local port of --serve (default %d)" % SERVE_PORT)
+    parser.add_argument("--compress", dest="compress", default="bz2",
+                        type=parse_compress_option,
+                        help="The archive compression and number of worker processes as codec[:workers], the codec is one of %s (default bz2 on all cores)" % ", ".join(available_codecs()))
     parser.add_argument('-v', "--version", action='version',
                         version=VERSION)
     args = parser.parse_args()
@@ -632,14 +6180,127 @@ if __name__ == "__main__":
     max_user_count = args.maxcount
     top_level_dir_name = args.top_level_dir
     school_name = args.school_name
+    engine = args.engine
+    cache_dir = args.cache_dir
+    codec, workers = args.compress
+    delta = args.delta
+    if args.benchmark:
+        benchmark_filename = run_benchmark(
+            [float(years) for years in args.benchmark.split(",")],
+            top_level_dir_name, max_user_count, codec=codec, workers=workers)
+        print ("The benchmark results are in %s" % benchmark_filename)
+        sys.exit(0)
+    if args.fleet_filename:
+        successful = run_fleet_report(args.fleet_filename, top_level_dir_name,
+                                      num_months, max_user_count, engine,
+                                      cache_dir, args.fleet_workers,
+                                      args.timeout)
+        sys.exit(0 if successful else 1)
+    if args.ingest_dirname:
+        successful = run_ingest(args.ingest_dirname, args.store_filename,
+                                args.ingest_workers)
+        sys.exit(0 if successful else 1)
+    if args.load_dirname:
+        if args.sqlite_filename:
+            load_reader = DbReader(args.sqlite_filename, "", "",
+                                   backend="sqlite")
+        else:
+            # the SystemMonitor database may not exist yet
+            load_reader = DbReader("mysql", "mysqlAdmin", "root",
+                                   "localhost")
+        successful = load_parallel_dump(load_reader, args.load_dirname,
+                                        args.dump_workers)
+        sys.exit(0 if successful else 1)
+    if args.sqlite_filename:
+        db_reader = DbReader(args.sqlite_filename, "", "", backend="sqlite")
+    else:
+        db_reader = DbReader("SystemMonitor", "mysqlAdmin", "root",
+                             "localhost")
+    if args.maintain:
+        maintainer = SummaryMaintainer(db_reader, args.raw_days)
+        successful = maintainer.run()
+        print (maintainer.get_status_text())
+        sys.exit(0 if successful else 1)
+    if args.serve:
+        run_query_server(db_reader, args.port)
+        sys.exit(0)
+    if args.watch:
+        run_watch(db_reader, top_level_dir_name, num_months, max_user_count,
+                  cache_dir, args.watch_interval)
+        sys.exit(0)
     if not school_name:
         school_name = get_schoolname_from_gui()
-    db_reader = DbReader("SystemMonitor", "mysqlAdmin", "root", "localhost")
-    time_finder = TimeFinder(db_reader, num_months, num_weeks=0)
-    data_gatherer = DataGatherer(db_reader, time_finder, max_user_count)
-    result, reporter_count = data_gatherer.create_value_objects()
-    result_generator = ResultGenerator(result, school_name, top_level_dir_name)
+    profiler = None
+    if args.profile:
+        profiler = Profiler()
+        db_reader.set_profiler(profiler)
+    with profile_stage(profiler, "check_index"):
+        index_manager = SummaryIndexManager(db_reader)
+        if index_manager.ensure_index(args.create_index) != "covering":
+            print (index_manager.get_status_text())
+    if profiler is not None:
+        profiler.add_note(index_manager.get_status_text())
+    with profile_stage(profiler, "time_finder"):
+        time_finder = TimeFinder(db_reader, num_months, num_weeks=0)
+    if args.quick or args.quick_only:
+        quick_filename = os.path.join(top_level_dir_name,
+                                      "SystemMonitor_quick.csv")
+        with profile_stage(profiler, "quick_preview"):
+            quick_estimator = QuickEstimator(db_reader, time_finder,
+                                             max_user_count,
+                                             args.quick_samples,
+                                             args.quick_budget)
+            try:
+                quick_estimator.run()
+                quick_estimator.write_csv_file(quick_filename)
+                quick_estimator.print_summary()
+                print ("The preview is in %s" % quick_filename)
+            except DB_ERRORS as e:
+                print ("The quick preview failed: %s" % e)
+                if args.quick_only:
+                    sys.exit(1)
+        if args.quick_only:
+            sys.exit(0)
+        print ("Making the full report now.")
+    data_gatherer = DataGatherer(db_reader, time_finder, max_user_count,
+                                 engine, cache_dir, args.column_cache,
+                                 args.workers)
+    with profile_stage(profiler, "create_value_objects"):
+        if args.no_cache:
+            result, reporter_count = data_gatherer.create_value_objects()
+        else:
+            report_cache = ReportCache(cache_dir)
+            report_text, result = report_cache.get_report(
+                data_gatherer, num_months, max_user_count)
+            if profiler is not None:
+                profiler.add_note("Report cache: %s, %d values reused"
+                                  % (report_cache.status,
+                                     report_cache.reused_count))
+    heatmap = None
+    if args.heatmap:
+        with profile_stage(profiler, "usage_heatmap"):
+            try:
+                heatmap = data_gatherer.create_usage_heatmap()
+            except db_reader.error_class as e:
+                print ("The usage heatmap could not be made: %s" % e)
+    delta_end_time = None
+    if delta and args.dump_mode != "stream":
+        print ("A delta dump is always streamed, --dump %s is ignored."
+               % args.dump_mode)
+        args.dump_mode = "stream"
+    if delta:
+        delta_end_time = time_finder.database_max_time
+    result_generator = ResultGenerator(result, school_name, top_level_dir_name,
+                                       codec, workers, delta_end_time,
+                                       db_reader, profiler, heatmap,
+                                       args.dump_mode, args.dump_workers,
+                                       args.json_report)
     successful = result_generator.write_all_result_files()
+    if successful and data_gatherer.failed_count:
+        print ("The run finished but %d report values could not be read so "
+               "their periods are missing from the report in %s."
+               % (data_gatherer.failed_count, top_level_dir_name))
+        sys.exit(1)
     if successful:
         location = ""
         if top_level_dir_name != ".":
@@ -0,0 +1,735 @@
+"""
+Tests of reporter.py on small SQLite databases of synthetic samples.
+Run them in this directory with "python -m pytest" or
+"python -m unittest test_reporter".
+"""
+import json
+import collections
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import reporter
+
+YEARS = 0.4
+NUM_MONTHS = 6
+MAX_COUNT = 20
+SUMMARY_COLUMNS = ", ".join(reporter.INGEST_COLUMNS)
+
+
+def get_report_values(reporter_dict):
+    """
+    :return: the value_dict of every report value by a key that does not
+        depend on the TimePeriod objects
+    """
+    return dict(((key[0], key[1], key[2], key[3].get_period_start()),
+                 dict(report_values.value_dict))
+                for key, report_values in reporter_dict.items())
+
+
+class FailingCursor:
+    """
+    A streaming cursor that fails after its first chunk.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.fetch_count = 0
+
+    def fetchmany(self, size):
+        self.fetch_count += 1
+        if self.fetch_count > 1:
+            raise reporter.sqlite3.OperationalError("the read failed")
+        return self.cursor.fetchmany(size)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class SqliteFleetReporter(reporter.FleetReporter):
+    """
+    A fleet of SQLite databases. The school on the host "stuck" never
+    answers and the one on "broken" fails.
+    """
+
+    def __init__(self, school_hosts, cache_dir, timeout):
+        reporter.FleetReporter.__init__(self, school_hosts, NUM_MONTHS,
+                                        MAX_COUNT, cache_dir=cache_dir,
+                                        workers=2, timeout=timeout)
+        self.release_event = threading.Event()
+
+    def gather_school(self, school_host):
+        if school_host.host == "stuck":
+            self.release_event.wait()
+            raise ValueError("released")
+        if school_host.host == "broken":
+            raise reporter.sqlite3.OperationalError("no such table")
+        db_reader = reporter.DbReader(school_host.db_name, "", "",
+                                      backend="sqlite")
+        time_finder = reporter.TimeFinder(db_reader, self.num_months, 0)
+        result, reporter_count = reporter.DataGatherer(
+            db_reader, time_finder, self.max_user_count, self.engine,
+            self.cache_dir, workers=1).create_value_objects()
+        return result
+
+
+class ReporterTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp()
+        cls.source_filename = os.path.join(cls.work_dir, "source.db")
+        reporter.generate_synthetic_data(
+            reporter.DbReader(cls.source_filename, "", "", backend="sqlite"),
+            YEARS)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+
+    def open_copy(self, name):
+        """
+        :return: a DbReader of a copy of the synthetic database
+        """
+        filename = os.path.join(self.work_dir, name + ".db")
+        shutil.copy(self.source_filename, filename)
+        return reporter.DbReader(filename, "", "", backend="sqlite")
+
+    def new_data_gatherer(self, db_reader, engine="query",
+                          cache_name="cache", column_cache=False):
+        time_finder = reporter.TimeFinder(db_reader, NUM_MONTHS, 0)
+        return reporter.DataGatherer(
+            db_reader, time_finder, MAX_COUNT, engine,
+            os.path.join(self.work_dir, cache_name), column_cache,
+            workers=1)
+
+    def gather(self, db_reader, engine="query", cache_name="cache",
+               column_cache=False):
+        """
+        :return: the reporter_dict of the report
+        """
+        data_gatherer = self.new_data_gatherer(db_reader, engine, cache_name,
+                                               column_cache)
+        reporter_dict, reporter_count = data_gatherer.create_value_objects()
+        self.assertTrue(reporter_count)
+        self.assertEqual(data_gatherer.failed_count, 0)
+        return reporter_dict
+
+    def get_report(self, db_reader, engine="query", cache_name="cache",
+                   column_cache=False):
+        return get_report_values(self.gather(db_reader, engine, cache_name,
+                                             column_cache))
+
+    def get_row_count(self, db_reader, table_name):
+        return db_reader.return_single_value(
+            "SELECT COUNT(*) FROM %s" % table_name)[0]
+
+    def get_max_time(self, db_reader):
+        return db_reader.return_single_value(
+            "SELECT MAX(Time) FROM SummaryData")[0]
+
+    def write_delta(self, db_reader, school_name, end_time, dirname):
+        """
+        :return: the ResultGenerator of a delta dump up to end_time
+        """
+        result_generator = reporter.ResultGenerator(
+            self.gather(db_reader), school_name, dirname,
+            delta_end_time=end_time, db_reader=db_reader)
+        self.assertTrue(result_generator.write_all_result_files())
+        return result_generator
+
+    def read_delta_state(self, dirname):
+        with open(os.path.join(dirname, "SystemMonitor_delta_state.json"),
+                  "r") as state_file:
+            return json.load(state_file)
+
+    def test_engines_agree(self):
+        db_reader = self.open_copy("engines")
+        expected = self.get_report(db_reader)
+        engines = ["sweep", "rollup"]
+        if reporter.numpy is not None:
+            engines.append("numpy")
+        for engine in engines:
+            self.assertEqual(self.get_report(db_reader, engine, engine),
+                             expected, engine)
+        # a second rollup run reads the cached days
+        self.assertEqual(self.get_report(db_reader, "rollup", "rollup"),
+                         expected)
+
+    def test_ingest_round_trip(self):
+        db_reader = self.open_copy("ingest")
+        dump_dirname = os.path.join(self.work_dir, "dump")
+        self.assertTrue(reporter.ParallelDumper(db_reader, dump_dirname,
+                                                "bz2", 2).dump())
+        archive_dirname = os.path.join(self.work_dir, "archives")
+        os.makedirs(archive_dirname)
+        with tarfile.open(os.path.join(archive_dirname,
+                                       "Test School_01_02_21.tar"),
+                          "w") as tar_file:
+            tar_file.add(dump_dirname, "School_01_02_21_dir/dump")
+        store_filename = os.path.join(self.work_dir, "store.db")
+        ingester = reporter.ArchiveIngester(store_filename, 2)
+        self.assertEqual(ingester.ingest(archive_dirname), 1)
+        self.assertEqual(ingester.errors, {})
+        self.assertEqual(
+            ingester.db_reader.return_list(
+                "SELECT %s FROM SchoolSummaryData WHERE School = %%s "
+                "ORDER BY Time" % SUMMARY_COLUMNS, ("Test School",)),
+            db_reader.return_list("SELECT %s FROM SummaryData ORDER BY Time"
+                                  % SUMMARY_COLUMNS))
+        # an archive is only ingested once
+        self.assertEqual(reporter.ArchiveIngester(store_filename).ingest(
+            archive_dirname), 0)
+
+    def test_delta_dump_continues_from_state(self):
+        db_reader = self.open_copy("delta")
+        dirname = os.path.join(self.work_dir, "delta")
+        os.makedirs(dirname)
+        max_time = self.get_max_time(db_reader)
+        first_time = max_time - 7 * 86400
+        result_generator = self.write_delta(db_reader, "Test School",
+                                            first_time, dirname)
+        self.assertEqual(result_generator.delta_sequence, 0)
+        self.assertIsNone(result_generator.delta_start_time)
+        result_generator = self.write_delta(db_reader, "Test School",
+                                            max_time, dirname)
+        self.assertEqual(result_generator.delta_sequence, 1)
+        self.assertEqual(result_generator.delta_start_time, first_time)
+        with open(result_generator.manifest_filename, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(manifest["previous_time"], first_time)
+        self.assertFalse(manifest["complete"])
+        state = self.read_delta_state(dirname)
+        self.assertEqual(state["last_time"], max_time)
+        self.assertEqual(state["school"], "Test School")
+        self.assertEqual(state["database"],
+                         list(db_reader.get_database_id()))
+        # no rows after the state, the database has been reset
+        result_generator = self.write_delta(db_reader, "Test School",
+                                            max_time, dirname)
+        self.assertEqual(result_generator.delta_sequence, 0)
+        self.assertIsNone(result_generator.delta_start_time)
+
+    def test_delta_dump_ignores_other_state(self):
+        dirname = os.path.join(self.work_dir, "delta_other")
+        os.makedirs(dirname)
+        db_reader = self.open_copy("delta_first")
+        max_time = self.get_max_time(db_reader)
+        self.write_delta(db_reader, "Test School", max_time - 86400,
+                         dirname)
+        result_generator = self.write_delta(db_reader, "Other School",
+                                            max_time, dirname)
+        self.assertEqual(result_generator.delta_sequence, 0)
+        other_reader = self.open_copy("delta_second")
+        result_generator = self.write_delta(other_reader, "Other School",
+                                            max_time + 1, dirname)
+        self.assertEqual(result_generator.delta_sequence, 0)
+        self.assertEqual(self.read_delta_state(dirname)["database"],
+                         list(other_reader.get_database_id()))
+
+    def test_failed_delta_dump_keeps_state(self):
+        db_reader = self.open_copy("delta_failed")
+        dirname = os.path.join(self.work_dir, "delta_failed")
+        os.makedirs(dirname)
+        max_time = self.get_max_time(db_reader)
+        self.write_delta(db_reader, "Test School", max_time - 86400,
+                         dirname)
+
+        def iter_failing_dump():
+            yield "CREATE TABLE SummaryData (Time INTEGER);"
+            raise reporter.sqlite3.OperationalError("the dump failed")
+
+        db_reader.iter_dump = iter_failing_dump
+        result_generator = self.write_delta(db_reader, "Test School",
+                                            max_time, dirname)
+        self.assertIsNotNone(result_generator.dump_error)
+        self.assertEqual(self.read_delta_state(dirname)["last_time"],
+                         max_time - 86400)
+
+    def remove_rows_after(self, db_reader, cut_time):
+        """
+        :return: the SummaryData rows after cut_time that were deleted
+        """
+        rows = db_reader.return_list(
+            "SELECT %s FROM SummaryData WHERE Time > %%s" % SUMMARY_COLUMNS,
+            (cut_time,))
+        db_reader.return_cursor("DELETE FROM SummaryData WHERE Time > %s",
+                                (cut_time,))
+        db_reader.connector.commit()
+        return rows
+
+    def add_rows(self, db_reader, rows):
+        self.assertTrue(db_reader.write_rows(
+            "INSERT INTO SummaryData (%s) VALUES (%s)"
+            % (SUMMARY_COLUMNS, ", ".join(["%s"] * len(rows[0]))), rows))
+
+    def get_cached_report(self, db_reader, cache_name):
+        """
+        :return: the ReportCache status and the report values, read with
+            an empty memory cache
+        """
+        reporter.ReportCache.memory_entries.clear()
+        report_cache = reporter.ReportCache(
+            os.path.join(self.work_dir, cache_name))
+        report_text, reporter_dict = report_cache.get_report(
+            self.new_data_gatherer(db_reader), NUM_MONTHS, MAX_COUNT)
+        return report_cache, get_report_values(reporter_dict)
+
+    def test_report_cache_reuses_older_periods(self):
+        db_reader = self.open_copy("report_cache")
+        expected = self.get_report(db_reader)
+        rows = self.remove_rows_after(
+            db_reader, self.get_max_time(db_reader) - 14 * 86400)
+        report_cache, values = self.get_cached_report(db_reader,
+                                                      "report_cache")
+        self.assertEqual(report_cache.status, "computed")
+        self.add_rows(db_reader, rows)
+        report_cache, values = self.get_cached_report(db_reader,
+                                                      "report_cache")
+        self.assertEqual(report_cache.status, "partial")
+        self.assertTrue(report_cache.reused_count)
+        self.assertEqual(values, expected)
+        report_cache, values = self.get_cached_report(db_reader,
+                                                      "report_cache")
+        self.assertEqual(report_cache.status, "file")
+        self.assertEqual(values, expected)
+
+    def test_report_cache_keeps_databases_apart(self):
+        first_reader = self.open_copy("report_cache_first")
+        report_cache, values = self.get_cached_report(first_reader,
+                                                      "report_cache_shared")
+        self.assertEqual(report_cache.status, "computed")
+        # the same rows in another database are not taken from the cache
+        second_reader = self.open_copy("report_cache_second")
+        report_cache, values = self.get_cached_report(second_reader,
+                                                      "report_cache_shared")
+        self.assertEqual(report_cache.status, "computed")
+        # nor are the older rows of another database reused
+        self.remove_rows_after(second_reader,
+                               self.get_max_time(second_reader) - 86400)
+        report_cache, values = self.get_cached_report(second_reader,
+                                                      "report_cache_shared")
+        self.assertEqual(report_cache.status, "computed")
+        self.add_rows(first_reader, [(self.get_max_time(first_reader) + 300,
+                                      1, 1, 1, 1)])
+        report_cache, values = self.get_cached_report(first_reader,
+                                                      "report_cache_shared")
+        self.assertEqual(report_cache.status, "partial")
+
+    def change_older_rows(self, db_reader):
+        """
+        Give a copy other counts but the same times as the source.
+        """
+        db_reader.return_cursor(
+            "UPDATE SummaryData SET StudentCount = StudentCount + 1 "
+            "WHERE Time < %s", (self.get_max_time(db_reader) - 30 * 86400,))
+        db_reader.connector.commit()
+
+    def test_rollup_adds_new_rows(self):
+        db_reader = self.open_copy("rollup_new")
+        expected = self.get_report(db_reader)
+        rows = self.remove_rows_after(
+            db_reader, self.get_max_time(db_reader) - 10 * 86400)
+        self.assertEqual(self.get_report(db_reader, "rollup", "rollup_new"),
+                         self.get_report(db_reader))
+        self.add_rows(db_reader, rows)
+        self.assertEqual(self.get_report(db_reader, "rollup", "rollup_new"),
+                         expected)
+
+    def test_rollup_keeps_databases_apart(self):
+        first_reader = self.open_copy("rollup_first")
+        second_reader = self.open_copy("rollup_second")
+        self.change_older_rows(second_reader)
+        for db_reader in (first_reader, second_reader, first_reader):
+            self.assertEqual(
+                self.get_report(db_reader, "rollup", "rollup_shared"),
+                self.get_report(db_reader))
+
+    @unittest.skipIf(reporter.numpy is None, "NumPy is not installed")
+    def test_column_cache_adds_new_rows(self):
+        db_reader = self.open_copy("columns_new")
+        expected = self.get_report(db_reader)
+        rows = self.remove_rows_after(
+            db_reader, self.get_max_time(db_reader) - 10 * 86400)
+        self.assertEqual(self.get_report(db_reader, "numpy", "columns_new",
+                                         True),
+                         self.get_report(db_reader))
+        self.add_rows(db_reader, rows)
+        self.assertEqual(self.get_report(db_reader, "numpy", "columns_new",
+                                         True),
+                         expected)
+
+    @unittest.skipIf(reporter.numpy is None, "NumPy is not installed")
+    def test_column_cache_keeps_databases_apart(self):
+        first_reader = self.open_copy("columns_first")
+        second_reader = self.open_copy("columns_second")
+        self.change_older_rows(second_reader)
+        for db_reader in (first_reader, second_reader, first_reader):
+            self.assertEqual(
+                self.get_report(db_reader, "numpy", "columns_shared", True),
+                self.get_report(db_reader))
+
+    def new_watcher(self, db_reader, name):
+        return reporter.ReportWatcher(
+            db_reader, os.path.join(self.work_dir, name + ".csv"), NUM_MONTHS,
+            MAX_COUNT, os.path.join(self.work_dir, name), write_interval=0)
+
+    def test_watch_adds_new_rows(self):
+        db_reader = self.open_copy("watch")
+        expected = self.get_report(db_reader)
+        rows = self.remove_rows_after(
+            db_reader, self.get_max_time(db_reader) - 10 * 86400)
+        watcher = self.new_watcher(db_reader, "watch")
+        self.assertTrue(watcher.update())
+        self.assertEqual(get_report_values(watcher.create_value_objects()),
+                         self.get_report(db_reader))
+        self.add_rows(db_reader, rows)
+        self.assertEqual(watcher.update(), len(rows))
+        self.assertEqual(watcher.update(), 0)
+        self.assertEqual(get_report_values(watcher.create_value_objects()),
+                         expected)
+        self.assertTrue(watcher.write_report())
+        report_cache, values = self.get_cached_report(db_reader, "watch")
+        self.assertEqual(report_cache.status, "file")
+        self.assertEqual(values, expected)
+        with open(watcher.report_filename, "r") as report_file:
+            self.assertEqual(report_file.read().splitlines(),
+                             reporter.ResultGenerator(
+                                 self.gather(db_reader), "School"
+                             ).get_report_text().splitlines())
+
+    def test_watch_rebuilds_after_failed_read(self):
+        db_reader = self.open_copy("watch_failed")
+        expected = self.get_report(db_reader)
+        watcher = self.new_watcher(db_reader, "watch_failed")
+        streaming_cursor = db_reader.driver.streaming_cursor
+        db_reader.driver.streaming_cursor = \
+            lambda connector: FailingCursor(streaming_cursor(connector))
+        with self.assertRaises(reporter.sqlite3.OperationalError):
+            watcher.update()
+        self.assertIsNone(watcher.high_water_mark)
+        self.assertEqual(watcher.histograms, {})
+        db_reader.driver.streaming_cursor = streaming_cursor
+        self.assertTrue(watcher.update())
+        self.assertEqual(get_report_values(watcher.create_value_objects()),
+                         expected)
+
+    def run_quick(self, db_reader, samples=reporter.QUICK_SAMPLES,
+                  time_budget=reporter.QUICK_TIME_BUDGET):
+        """
+        :return: the QuickEstimator after its run and the ReportMatrix of
+            the exact report
+        """
+        time_finder = reporter.TimeFinder(db_reader, NUM_MONTHS, 0)
+        estimator = reporter.QuickEstimator(db_reader, time_finder, MAX_COUNT,
+                                            samples, time_budget, seed=1)
+        estimator.run()
+        return estimator, reporter.ReportMatrix.from_reporter_dict(
+            self.gather(db_reader))
+
+    def test_quick_reads_small_periods_exactly(self):
+        estimator, report_matrix = self.run_quick(self.open_copy("quick"),
+                                                  samples=100000)
+        self.assertEqual(estimator.sampled_count, 0)
+        self.assertEqual(list(estimator.estimates.iter_csv_rows()),
+                         list(report_matrix.iter_csv_rows()))
+        self.assertEqual(set(value for row in estimator.margins.iter_rows()
+                             for value in row[4]), set([0]))
+
+    def test_quick_intervals_hold_the_exact_values(self):
+        estimator, report_matrix = self.run_quick(
+            self.open_copy("quick_sampled"))
+        self.assertTrue(estimator.sampled_count)
+        self.assertEqual(estimator.skipped_count, 0)
+        inside_count = 0
+        value_count = 0
+        for exact_row, estimate_row, margin_row in zip(
+                report_matrix.iter_rows(), estimator.estimates.iter_rows(),
+                estimator.margins.iter_rows()):
+            self.assertEqual(exact_row[:3], estimate_row[:3])
+            self.assertEqual(exact_row[3].get_period_start(),
+                             estimate_row[3].get_period_start())
+            for exact, estimate, margin in zip(
+                    exact_row[4], estimate_row[4], margin_row[4]):
+                inside_count += abs(exact - estimate) <= margin
+                value_count += 1
+        self.assertEqual(value_count,
+                         report_matrix.row_count * report_matrix.width)
+        self.assertGreaterEqual(inside_count, 0.95 * value_count)
+
+    def test_quick_stops_at_time_budget(self):
+        estimator, report_matrix = self.run_quick(
+            self.open_copy("quick_budget"), time_budget=0)
+        self.assertEqual(estimator.sampled_count + estimator.exact_count, 0)
+        self.assertEqual(estimator.skipped_count,
+                         report_matrix.row_count //
+                         len(reporter.ReportMatrix.GROUPS))
+        self.assertEqual(list(estimator.estimates.iter_rows()), [])
+
+    def write_fleet_file(self, name, lines):
+        fleet_filename = os.path.join(self.work_dir, name + ".csv")
+        with open(fleet_filename, "w") as fleet_file:
+            fleet_file.write("\n".join(lines) + "\n")
+        return fleet_filename
+
+    def test_read_fleet_file(self):
+        school_hosts = reporter.read_fleet_file(self.write_fleet_file(
+            "fleet", ["# school, host, user, password, database", "",
+                      "North, north.school:3307, report, secret, Monitor",
+                      "South, south.school"]))
+        self.assertEqual(
+            [(school_host.school_name, school_host.host,
+              school_host.port, school_host.user_name, school_host.db_name)
+             for school_host in school_hosts],
+            [("North", "north.school", 3307, "report", "Monitor"),
+             ("South", "south.school", 3306, "root", "SystemMonitor")])
+        for name, lines in (
+                ("fleet_repeated", ["North, north.school",
+                                    "North, other.school"]),
+                ("fleet_no_host", ["North, "]),
+                ("fleet_bad_port", ["North, north.school:port"])):
+            with self.assertRaises(ValueError):
+                reporter.read_fleet_file(self.write_fleet_file(name, lines))
+        with self.assertRaises(ValueError):
+            reporter.FleetReporter([reporter.SchoolHost("North", "a"),
+                                    reporter.SchoolHost("North", "b")])
+
+    def test_fleet_reports_the_answering_schools(self):
+        school_hosts = [
+            reporter.SchoolHost("North", "localhost",
+                                db_name=self.open_copy(
+                                    "fleet_north").connect_params["db_name"]),
+            reporter.SchoolHost("Stuck", "stuck"),
+            reporter.SchoolHost("Broken", "broken"),
+            reporter.SchoolHost("South", "localhost",
+                                db_name=self.open_copy(
+                                    "fleet_south").connect_params["db_name"])]
+        fleet_reporter = SqliteFleetReporter(
+            school_hosts, os.path.join(self.work_dir, "fleet_cache"), 1)
+        try:
+            results, errors = fleet_reporter.run()
+        finally:
+            fleet_reporter.release_event.set()
+        self.assertEqual(sorted(results), ["North", "South"])
+        self.assertEqual(sorted(errors), ["Broken", "Stuck"])
+        self.assertIn("no answer", errors["Stuck"])
+        expected = self.get_report(self.open_copy("fleet_expected"))
+        for school_name in ("North", "South"):
+            self.assertEqual(get_report_values(results[school_name]),
+                             expected)
+        report_filename = os.path.join(self.work_dir, "fleet_report.csv")
+        self.assertEqual(
+            fleet_reporter.write_combined_report(report_filename), 2)
+        with open(report_filename, "r") as report_file:
+            school_names = [line.split(",")[0]
+                            for line in report_file.read().splitlines()]
+        self.assertEqual(school_names[0], "School")
+        self.assertEqual(set(school_names[1:]), set(["North", "South"]))
+        self.assertEqual(school_names.index("South") - 1,
+                         school_names.count("North"))
+
+    def get_heatmap_cells(self, db_reader, column_cache=False):
+        heatmap = self.new_data_gatherer(
+            db_reader, cache_name="heatmap_cache",
+            column_cache=column_cache).create_usage_heatmap()
+        return heatmap.cells
+
+    def test_heatmap_counts_every_sample(self):
+        db_reader = self.open_copy("heatmap")
+        months = reporter.TimeFinder(db_reader, NUM_MONTHS, 0).get_months()
+        expected = dict((cell, [collections.Counter(), collections.Counter()])
+                        for cell in reporter.UsageHeatmap().cells)
+        for row in db_reader.return_list(
+                "SELECT Time, StudentCount, ActiveStudentCount "
+                "FROM SummaryData WHERE Time >= %s",
+                (months[0].get_period_start(),)):
+            local_time = time.localtime(row[0])
+            for counter, value in zip(
+                    expected[(local_time.tm_wday, local_time.tm_hour)],
+                    row[1:]):
+                counter[value] += 1
+        self.assertEqual(self.get_heatmap_cells(db_reader), expected)
+        self.assertEqual(self.get_heatmap_cells(db_reader, True), expected)
+        maintainer = reporter.SummaryMaintainer(
+            db_reader, 30, now=self.get_max_time(db_reader))
+        self.assertTrue(maintainer.run())
+        self.assertEqual(self.get_heatmap_cells(db_reader), expected)
+
+    def test_columnar_export_round_trip(self):
+        db_reader = self.open_copy("columnar")
+        db_reader.return_cursor(
+            "CREATE TABLE Extra (Id INTEGER PRIMARY KEY, Name TEXT, "
+            "Amount INTEGER, Ratio REAL, Data BLOB)")
+        extra_rows = [(1, "first", -2 ** 40, 0.5, b"\x00\xff"),
+                      (2, None, None, None, None),
+                      (3, "\u00e9t\u00e9", 2 ** 62, -1.25, b""),
+                      (4, "", 0, 3.0, b"data")]
+        self.assertTrue(db_reader.write_rows(
+            "INSERT INTO Extra VALUES (%s, %s, %s, %s, %s)", extra_rows))
+        export_filename = os.path.join(self.work_dir, "columnar.smcol")
+        exporter = reporter.ColumnarExporter(db_reader, export_filename)
+        # several blocks of SummaryData
+        with mock.patch.object(reporter, "EXPORT_BLOCK_ROWS", 10000):
+            self.assertTrue(exporter.dump())
+        export_reader = reporter.ColumnarExportReader(export_filename)
+        try:
+            self.assertEqual(export_reader.get_table_names(),
+                             ["Extra", "SummaryData"])
+            self.assertEqual(list(export_reader.iter_rows("Extra")),
+                             extra_rows)
+            self.assertEqual(export_reader.get_column_names("SummaryData"),
+                             db_reader.driver.get_column_names(
+                                 db_reader, "SummaryData"))
+            summary_rows = db_reader.return_list(
+                "SELECT * FROM SummaryData ORDER BY Time")
+            self.assertGreater(len(exporter.tables[1]["blocks"]), 1)
+            self.assertEqual(export_reader.get_row_count("SummaryData"),
+                             len(summary_rows))
+            self.assertEqual(list(export_reader.iter_rows("SummaryData")),
+                             summary_rows)
+            if reporter.numpy is not None:
+                self.assertEqual(
+                    export_reader.read_arrays("SummaryData")["Time"].tolist(),
+                    [row[0] for row in summary_rows])
+        finally:
+            export_reader.close()
+
+    def test_columnar_export_fails_on_read_error(self):
+        db_reader = self.open_copy("columnar_failed")
+        streaming_cursor = db_reader.driver.streaming_cursor
+        db_reader.driver.streaming_cursor = \
+            lambda connector: FailingCursor(streaming_cursor(connector))
+        self.assertFalse(reporter.ColumnarExporter(
+            db_reader, os.path.join(self.work_dir,
+                                    "columnar_failed.smcol")).dump())
+
+    def write_dump_archive(self, db_reader, archive_filename, mode):
+        """
+        Write a result archive with the SQL dump of the database.
+        """
+        dump = "".join(statement + "\n"
+                       for statement in db_reader.iter_dump()).encode()
+        with tarfile.open(archive_filename, mode) as tar_file:
+            tar_info = tarfile.TarInfo("School_01_02_21_dir/School.sql")
+            tar_info.size = len(dump)
+            tar_file.addfile(tar_info, io.BytesIO(dump))
+
+    def test_ingest_records_corrupt_archives(self):
+        db_reader = self.open_copy("ingest_corrupt")
+        archive_dirname = os.path.join(self.work_dir, "corrupt_archives")
+        os.makedirs(archive_dirname)
+        self.write_dump_archive(db_reader, os.path.join(
+            archive_dirname, "Good School_01_02_21.tbz"), "w:bz2")
+        corrupt_names = ["Truncated School_01_02_21.tbz"]
+        self.write_dump_archive(db_reader, os.path.join(
+            archive_dirname, corrupt_names[0]), "w:bz2")
+        if reporter.lzma is not None:
+            corrupt_names.append("Corrupt School_01_02_21.txz")
+            self.write_dump_archive(db_reader, os.path.join(
+                archive_dirname, corrupt_names[1]), "w:xz")
+        for archive_name in corrupt_names:
+            archive_filename = os.path.join(archive_dirname, archive_name)
+            with open(archive_filename, "rb") as archive_file:
+                contents = archive_file.read()
+            if archive_name.startswith("Truncated"):
+                contents = contents[:len(contents) // 2]
+            else:
+                # a broken stream footer is found after the rows are read
+                contents = contents[:-12] + b"\x55" * 12
+            with open(archive_filename, "wb") as archive_file:
+                archive_file.write(contents)
+        store_filename = os.path.join(self.work_dir, "corrupt_store.db")
+        ingester = reporter.ArchiveIngester(store_filename, 2)
+        self.assertEqual(ingester.ingest(archive_dirname), 1)
+        self.assertEqual(sorted(ingester.errors), sorted(corrupt_names))
+        self.assertEqual(ingester.row_count,
+                         self.get_row_count(db_reader, "SummaryData"))
+        # only the good archive is recorded so the others are tried again
+        ingester = reporter.ArchiveIngester(store_filename)
+        self.assertEqual(ingester.ingest(archive_dirname), 0)
+        self.assertEqual(sorted(ingester.errors), sorted(corrupt_names))
+
+    def test_ingest_counts_only_stored_archives(self):
+        db_reader = self.open_copy("ingest_unwritten")
+        archive_dirname = os.path.join(self.work_dir, "unwritten_archives")
+        os.makedirs(archive_dirname)
+        self.write_dump_archive(db_reader, os.path.join(
+            archive_dirname, "Test School_01_02_21.tbz"), "w:bz2")
+        store_filename = os.path.join(self.work_dir, "unwritten_store.db")
+        ingester = reporter.ArchiveIngester(store_filename)
+        ingester.db_reader.write_rows = lambda query, rows: False
+        self.assertEqual(ingester.ingest(archive_dirname), 0)
+        self.assertEqual(list(ingester.errors),
+                         ["Test School_01_02_21.tbz"])
+        self.assertEqual(ingester.row_count, 0)
+        ingester = reporter.ArchiveIngester(store_filename)
+        self.assertEqual(ingester.ingest(archive_dirname), 1)
+        self.assertEqual(ingester.row_count,
+                         self.get_row_count(db_reader, "SummaryData"))
+
+    def test_maintenance_keeps_report(self):
+        db_reader = self.open_copy("maintain")
+        expected = self.get_report(db_reader)
+        row_count = self.get_row_count(db_reader, "SummaryData")
+        max_time = db_reader.return_single_value(
+            "SELECT MAX(Time) FROM SummaryData")[0]
+        maintainer = reporter.SummaryMaintainer(db_reader, 30, now=max_time)
+        self.assertTrue(maintainer.run())
+        self.assertTrue(maintainer.downsampled_months)
+        self.assertLess(self.get_row_count(db_reader, "SummaryData"),
+                        row_count)
+        self.assertEqual(self.get_report(db_reader), expected)
+
+    def test_maintenance_keeps_rows_of_failed_read(self):
+        db_reader = self.open_copy("maintain_failed")
+        row_count = self.get_row_count(db_reader, "SummaryData")
+        max_time = db_reader.return_single_value(
+            "SELECT MAX(Time) FROM SummaryData")[0]
+        streaming_cursor = db_reader.driver.streaming_cursor
+        db_reader.driver.streaming_cursor = \
+            lambda connector: FailingCursor(streaming_cursor(connector))
+        maintainer = reporter.SummaryMaintainer(db_reader, 30, now=max_time)
+        self.assertFalse(maintainer.run())
+        self.assertEqual(self.get_row_count(db_reader, "SummaryData"),
+                         row_count)
+        self.assertEqual(self.get_row_count(
+            db_reader, reporter.SummaryMaintainer.HOURLY_TABLE), 0)
+
+    def test_prefix_index_matches_queries(self):
+        db_reader = self.open_copy("prefix")
+        prefix_index = reporter.PrefixSumIndex(db_reader)
+        self.assertTrue(prefix_index.refresh())
+        time_finder = reporter.TimeFinder(db_reader, NUM_MONTHS, 0)
+        for time_period in time_finder.get_months():
+            for column_name in reporter.DailyRollup.COLUMN_NAMES:
+                user_type = column_name.replace("Active", "").replace(
+                    "Count", "")
+                status = "Active" if column_name.startswith("Active") \
+                    else "All"
+                report_values = reporter.ReportValues(
+                    db_reader, user_type, status, time_period, MAX_COUNT)
+                report_values.fill_array_from_database()
+                self.assertEqual(
+                    prefix_index.get_values(
+                        column_name, time_period.get_period_start(),
+                        time_period.get_period_end() + 1, MAX_COUNT),
+                    report_values.value_dict)
+
+    def test_prefix_index_rejects_reversed_range(self):
+        prefix_index = reporter.PrefixSumIndex(self.open_copy("reversed"))
+        prefix_index.refresh()
+        first_hour = prefix_index.hour_starts[0]
+        with self.assertRaises(ValueError):
+            prefix_index.get_report(first_hour + 86400, first_hour)
+
+
+if __name__ == "__main__":
+    unittest.main()